@@ -5,6 +5,8 @@ import fairMTSP.main.Graph
 import io.github.oshai.kotlinlogging.KotlinLogging
 import org.jgrapht.graph.DefaultWeightedEdge
 import java.io.File
+import java.nio.ByteBuffer
+import java.nio.ByteOrder
 import kotlin.math.round
 import kotlin.math.sqrt
 
@@ -25,6 +27,10 @@ class InstanceDto(
 
 
     companion object {
+        /* header of the binary edge cost sidecar written by postprocessing/instance.py */
+        private const val SIDECAR_MAGIC = "FMTSPUTM"
+        private const val SIDECAR_VERSION = 1
+
         /**
          * Builds Coords objects from a String containing coordinates
          * @param line string that contains 3 doubles
@@ -120,10 +126,7 @@ class InstanceDto(
             }
             
             if (edgeWeightType == "GIVEN") {
-                val edgeCostLines = lines.subList(7 + numVertices, lines.size - 1)
-                edgeCosts = edgeCostLines.map(::parseEdgeCost).associate {
-                    it.first to it.second
-                }
+                edgeCosts = parseEdgeCostSidecar(coords.keys.toList()) ?: parseEdgeCostLines()
             }
         }
 
@@ -153,7 +156,56 @@ class InstanceDto(
     }
 
     private fun collectLinesFromFile() {
-        lines = File(path + name).readLines()
+        val file = File(path + name)
+        /* with a binary sidecar, the EDGE COSTS section does not need to be read */
+        lines = if (getSidecarFile().exists())
+            file.useLines { sequence -> sequence.takeWhile { !it.startsWith("EDGE COSTS") }.toList() }
+        else
+            file.readLines()
+    }
+
+    private fun getSidecarFile() = File(path + name.substringBeforeLast('.') + ".dist.bin")
+
+    private fun parseEdgeCostLines(): Map<Pair<Int, Int>, Double> {
+        val allLines = if (lines.any { it.startsWith("EDGE COSTS") }) lines else File(path + name).readLines()
+        val start = allLines.indexOfFirst { it.startsWith("EDGE COSTS") } + 1
+        val end = allLines.indexOfLast { it.trim() == "EOF" }.let { if (it < start) allLines.size else it }
+        return allLines.subList(start, end).map(::parseEdgeCost).associate {
+            it.first to it.second
+        }
+    }
+
+    /**
+     * Reads the edge costs from the binary sidecar "<name>.dist.bin": magic, version and vertex
+     * count, the vertex ids and the upper triangle of the cost matrix in row-major order, all
+     * little-endian (int32 header fields, int64 ids, float64 costs).
+     * @return edge costs, or null if there is no sidecar or it does not match the vertices
+     */
+    private fun parseEdgeCostSidecar(vertices: List<Int>): Map<Pair<Int, Int>, Double>? {
+        val file = getSidecarFile()
+        if (!file.exists()) return null
+        val buffer = ByteBuffer.wrap(file.readBytes()).order(ByteOrder.LITTLE_ENDIAN)
+        val magic = ByteArray(SIDECAR_MAGIC.length)
+        buffer.get(magic)
+        val version = buffer.int
+        val n = buffer.int
+        if (String(magic, Charsets.US_ASCII) != SIDECAR_MAGIC || version != SIDECAR_VERSION || n != vertices.size) {
+            log.warn { "ignoring sidecar ${file.name}: does not match $name" }
+            return null
+        }
+        val ids = (0 until n).map { buffer.long.toInt() }
+        if (ids != vertices) {
+            log.warn { "ignoring sidecar ${file.name}: vertex ids differ from $name" }
+            return null
+        }
+        val costs = HashMap<Pair<Int, Int>, Double>(n * (n - 1))
+        for (i in 0 until n) {
+            for (j in (i + 1) until n) {
+                costs[Pair(ids[i], ids[j])] = buffer.double
+            }
+        }
+        log.debug { "read ${costs.size} edge costs from sidecar ${file.name}" }
+        return costs
     }
 
     private fun getDepotCoord(targetCoords: Map<Int, Coords>): Coords {
@@ -26,6 +26,12 @@ object Parameters {
     var timeLimitInSeconds: Double = 3600.0
         private set
 
+    var warmStartFile: String = ""
+        private set
+
+    var shardFile: String = ""
+        private set
+
     fun initialize(
         instanceName: String,
         instancePath: String,
@@ -34,7 +40,9 @@ object Parameters {
         fairnessCoefficient: Double,
         pNorm: Int,
         outputFile: String,
-        timeLimitInSeconds: Double
+        timeLimitInSeconds: Double,
+        warmStartFile: String = "",
+        shardFile: String = ""
     ) {
         Parameters.instanceName = instanceName
         Parameters.instancePath = instancePath
@@ -44,5 +52,7 @@ object Parameters {
         Parameters.pNorm = pNorm
         Parameters.outputFile = outputFile
         Parameters.timeLimitInSeconds = timeLimitInSeconds
+        Parameters.warmStartFile = warmStartFile
+        Parameters.shardFile = shardFile
     }
 }
\ No newline at end of file
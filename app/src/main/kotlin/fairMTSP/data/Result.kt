@@ -20,5 +20,6 @@ data class Result(
     val optimalityGapPercent: Double? = null,
     val jainIndex: Double? = null,
     val giniIndex: Double? = null,
-    val normIndex: Double? = null
+    val normIndex: Double? = null,
+    val numNodes: Long? = null
 )
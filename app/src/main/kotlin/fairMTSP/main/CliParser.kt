@@ -85,6 +85,20 @@ class CliParser : CliktCommand() {
         }
     }
 
+    val warmStartFile: String by option(
+        "-ws",
+        help = "result JSON (e.g. of postprocessing.heuristic) whose tours are used as MIP start"
+    ).default("").validate {
+        require(it.isEmpty() || File(it).exists()) {
+            "warm start file does not exist!!!"
+        }
+    }
+
+    val shardFile: String by option(
+        "-jsonl",
+        help = "append the result as one line to this JSONL shard instead of writing a result file"
+    ).default("")
+
     override fun run() {
         log.debug { "reading command line arguments..." }
     }
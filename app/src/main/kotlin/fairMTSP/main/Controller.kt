@@ -3,9 +3,11 @@ package fairMTSP.main
 import fairMTSP.data.Instance
 import fairMTSP.data.InstanceDto
 import fairMTSP.data.Parameters
+import fairMTSP.data.Result
 import fairMTSP.solver.BranchAndCutSolver
 import ilog.cplex.IloCplex
 import io.github.oshai.kotlinlogging.KotlinLogging
+import kotlinx.serialization.decodeFromString
 import kotlinx.serialization.encodeToString
 import java.io.File
 
@@ -33,7 +35,9 @@ class Controller {
             fairnessCoefficient = parser.fairnessCoefficient,
             pNorm = parser.pNorm,
             outputFile = outputFile,
-            timeLimitInSeconds = parser.timeLimitInSeconds
+            timeLimitInSeconds = parser.timeLimitInSeconds,
+            warmStartFile = parser.warmStartFile,
+            shardFile = parser.shardFile
         )
     }
 
@@ -62,14 +66,28 @@ class Controller {
     fun run() {
         initCPLEX()
         val solver = BranchAndCutSolver(instance, cplex, Parameters)
-        try {
-            val result = solver.solve()
-            val json = prettyJson.encodeToString(result)
-            File(outputFile).writeText(json)
+        if (Parameters.warmStartFile.isNotEmpty()) {
+            val warmStart = lenientJson.decodeFromString<Result>(File(Parameters.warmStartFile).readText())
+            warmStart.tours?.let { solver.addMIPStart(it) }
+                ?: log.warn { "warm start ${Parameters.warmStartFile} has no tours, ignored" }
+        }
+        val result = try {
+            solver.solve()
         } catch (e: FairMTSPException) {
-            val result = solver.getInfeasibleResult()
-            val json = prettyJson.encodeToString(result)
-            File(outputFile).writeText(json)
+            solver.getInfeasibleResult()
+        }
+        writeResult(result)
+    }
+
+    /*
+    Writes [result] to its own JSON file, or appends it to the JSONL shard given with -jsonl
+     */
+    private fun writeResult(result: Result) {
+        if (Parameters.shardFile.isEmpty()) {
+            File(outputFile).writeText(prettyJson.encodeToString(result))
+        } else {
+            appendResultRecord(Parameters.shardFile, ResultRecord(File(outputFile).name, System.currentTimeMillis(), result))
+            log.info { "appended ${File(outputFile).name} to ${Parameters.shardFile}" }
         }
     }
 }
\ No newline at end of file
@@ -0,0 +1,52 @@
+package fairMTSP.main
+
+import fairMTSP.data.Result
+import kotlinx.serialization.Serializable
+import kotlinx.serialization.encodeToString
+import java.nio.ByteBuffer
+import java.nio.channels.FileChannel
+import java.nio.file.Files
+import java.nio.file.Paths
+import java.nio.file.StandardOpenOption
+
+/**
+ * One line of a JSONL result shard: the result and the name of the file it would have been
+ * written to otherwise, which is the key the post-processing scripts merge and deduplicate by.
+ * resultFile has to stay the first field, the scripts read the key from the start of the line.
+ * writtenAt (epoch milliseconds) decides which record of a key in several shards or result files
+ * is the latest.
+ */
+@Serializable
+data class ResultRecord(val resultFile: String, val writtenAt: Long, val result: Result)
+
+/*
+Appends [record] as a single line to the JSONL shard [shardFile]. Jobs of the same node or array
+task share a shard, so the whole line is written under an exclusive lock of the file with one
+positioned write at its end. A job killed while writing leaves a fragment without newline, which
+the readers skip; the next append starts a new line after it.
+ */
+fun appendResultRecord(shardFile: String, record: ResultRecord) {
+    val path = Paths.get(shardFile)
+    path.parent?.let { Files.createDirectories(it) }
+    val bytes = (lineJson.encodeToString(record) + "\n").toByteArray(Charsets.UTF_8)
+    FileChannel.open(path, StandardOpenOption.CREATE, StandardOpenOption.READ, StandardOpenOption.WRITE).use { channel ->
+        channel.lock().use {
+            var position = channel.size()
+            val line = if (position > 0 && !endsWithNewline(channel, position)) {
+                ByteBuffer.wrap("\n".toByteArray() + bytes)
+            } else {
+                ByteBuffer.wrap(bytes)
+            }
+            while (line.hasRemaining()) {
+                position += channel.write(line, position)
+            }
+            channel.force(false)
+        }
+    }
+}
+
+private fun endsWithNewline(channel: FileChannel, size: Long): Boolean {
+    val last = ByteBuffer.allocate(1)
+    channel.read(last, size - 1)
+    return last.get(0) == '\n'.code.toByte()
+}
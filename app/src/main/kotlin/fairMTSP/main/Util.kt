@@ -26,4 +26,14 @@ val prettyJson = Json { // this returns the JsonBuilder
     // optional: specify indent
     prettyPrintIndent = " "
     explicitNulls = true
-}
\ No newline at end of file
+}
+
+/* compact encoding of the records of JSONL result shards, one per line */
+val lineJson = Json {
+    explicitNulls = true
+}
+
+/* reads result files written by other tools, e.g. warm starts */
+val lenientJson = Json {
+    ignoreUnknownKeys = true
+}
@@ -364,6 +364,38 @@ class BranchAndCutSolver(
         cplex.use(cb, contextMask)
     }
 
+    /**
+     * Adds [tours] (depot to depot, one per vehicle, by decreasing length as
+     * required by the symmetry constraints) as MIP start. CPLEX repairs the
+     * start if it violates a constraint of the model.
+     */
+    fun addMIPStart(tours: List<List<Int>>) {
+        if (tours.size != instance.numVehicles) {
+            log.warn { "warm start has ${tours.size} tours for ${instance.numVehicles} vehicles, ignored" }
+            return
+        }
+        val vars = mutableListOf<IloNumVar>()
+        val vals = mutableListOf<Double>()
+        tours.forEachIndexed { vehicle, tour ->
+            val edgeCount = mutableMapOf<DefaultWeightedEdge, Double>()
+            tour.zipWithNext().forEach { (i, j) ->
+                val edge = graph.getEdge(i, j) ?: throw FairMTSPException("warm start uses missing edge ($i, $j)")
+                edgeCount[edge] = edgeCount.getOrDefault(edge, 0.0) + 1.0
+            }
+            edgeVariable[vehicle]!!.forEach { (edge, variable) ->
+                vars.add(variable)
+                vals.add(edgeCount.getOrDefault(edge, 0.0))
+            }
+            val visited = tour.toSet()
+            vertexVariable[vehicle]!!.forEach { (vertex, variable) ->
+                vars.add(variable)
+                vals.add(if (vertex == instance.depot || vertex in visited) 1.0 else 0.0)
+            }
+        }
+        cplex.addMIPStart(vars.toTypedArray(), vals.toDoubleArray(), IloCplex.MIPStartEffort.Repair, "warmStart")
+        log.info { "added warm start with ${tours.size} tours as MIP start" }
+    }
+
     /**
      * Function to export the model
      */
@@ -381,7 +413,8 @@ class BranchAndCutSolver(
             vertexCoords = instance.vertexCoords,
             computationTimeInSec = round(computationTime * 100.0) / 100.0,
             fairnessCoefficient = fairnessCoefficient,
-            pNorm = pNorm
+            pNorm = pNorm,
+            numNodes = cplex.nnodes64
         )
     }
 
@@ -454,7 +487,8 @@ class BranchAndCutSolver(
             optimalityGapPercent = round(cplex.mipRelativeGap * 10000.0) / 100.0,
             jainIndex = jainIndex,
             giniIndex = giniIndex,
-            normIndex = normIndex
+            normIndex = normIndex,
+            numNodes = cplex.nnodes64
         )
         return result
     }
@@ -0,0 +1,313 @@
+"""
+Compressed archives of completed result rounds.
+
+A round folder (results/round-2 with its min, epsFair, ... folders, result
+files, JSONL shards and shard folders) is archived into a single file next
+to it, results/round-2.archive:
+
+    magic | block 0 | block 1 | ... | index | index offset, index length | magic
+
+Every block is a zlib-compressed run of up to BLOCK_RECORDS results, one
+JSON line each, in member order (<folder>/<result file name>), so that the
+results of one instance share a block and its vertex coordinates compress
+away. The index is zlib-compressed JSON with the offset and length of every
+block and, per member, its block, its line in the block and its key
+(instance, vehicles, objective, p, fc). A single result is read by
+decompressing one block only.
+
+Paths below an archived round resolve to the archive: load_result() and
+folder_results() fall back to <round>.archive for result files and folders
+that are no longer on disk, so update_db and the plot scripts read archived
+rounds unchanged.
+
+    python -m postprocessing.archive create ../../../../results/round-2 [--delete]
+    python -m postprocessing.archive list ../../../../results/round-2.archive
+    python -m postprocessing.archive get ../../../../results/round-2.archive -n eil51.tsp -v 3 -obj eps-fair -fc 0.5
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+import sys
+import zlib
+
+from postprocessing import shards
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIX = '.archive'
+MAGIC = b'FMTSPAR1'
+TRAILER = struct.Struct('<QQ')
+BLOCK_RECORDS = 256
+BLOCK_BYTES = 8 * 1024 * 1024
+
+# archives opened by load_result() and folder_results() in this process
+_open_archives = {}
+
+
+class ArchiveException(Exception):
+    """Custom exception class with message for this module."""
+
+    def __init__(self, value):
+        self.value = value
+        super().__init__(value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+def result_key(result):
+    """(instance, vehicles, objective, p, fc) of a result."""
+    return (result['instanceName'], int(result['numVehicles']), result['objectiveType'], int(result['pNorm']),
+            round(float(result['fairnessCoefficient']), 2))
+
+
+class ResultArchive:
+    """Reader of an archive; keeps the last decompressed block."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        if self._file.read(len(MAGIC)) != MAGIC:
+            self._file.close()
+            raise ArchiveException(f'{path} is not a result archive')
+        self._file.seek(-(TRAILER.size + len(MAGIC)), os.SEEK_END)
+        index_offset, index_length = TRAILER.unpack(self._file.read(TRAILER.size))
+        if self._file.read(len(MAGIC)) != MAGIC:
+            self._file.close()
+            raise ArchiveException(f'{path} is truncated')
+        self._file.seek(index_offset)
+        index = json.loads(zlib.decompress(self._file.read(index_length)))
+        self.blocks = index['blocks']
+        self.members = {}
+        self.keys = {}
+        self._folders = {}
+        for member, block, line, *key in index['entries']:
+            self.members[member] = (block, line)
+            self.keys.setdefault(tuple(key), []).append(member)
+            folder, _, name = member.rpartition('/')
+            self._folders.setdefault(folder, []).append(name)
+        self._cached_block = None
+        self._cached_lines = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, member):
+        return member in self.members
+
+    def _lines(self, block):
+        if block != self._cached_block:
+            offset, length = self.blocks[block]
+            self._file.seek(offset)
+            self._cached_lines = zlib.decompress(self._file.read(length)).splitlines()
+            self._cached_block = block
+        return self._cached_lines
+
+    def folders(self):
+        """{folder: number of results}, '' for results at the top of the round."""
+        return {folder: len(names) for folder, names in sorted(self._folders.items())}
+
+    def read(self, member):
+        """Result of a member (<folder>/<result file name>)."""
+        if member not in self.members:
+            raise KeyError(f'{member} not in {self.path}')
+        block, line = self.members[member]
+        return json.loads(self._lines(block)[line])
+
+    def find(self, instance, vehicles, objective, p=1, fc=0.0):
+        """Members of a key, in member order."""
+        return self.keys.get((instance, int(vehicles), objective, int(p), round(float(fc), 2)), [])
+
+    def get(self, instance, vehicles, objective, p=1, fc=0.0):
+        """Result of a key (of the first member if it is in several folders), None if missing."""
+        members = self.find(instance, vehicles, objective, p, fc)
+        return self.read(members[0]) if members else None
+
+    def folder_results(self, folder):
+        """(file name, result) of the members of a folder in name order; every block is decompressed once."""
+        prefix = f'{folder}/' if folder else ''
+        for name in self._folders.get(folder, []):
+            yield name, self.read(prefix + name)
+
+
+def _write_block(f_out, lines, blocks, level):
+    data = zlib.compress(b''.join(lines), level)
+    blocks.append((f_out.tell(), len(data)))
+    f_out.write(data)
+
+
+def write_archive(root, archive_path=None, block_records=BLOCK_RECORDS, level=9):
+    """
+    Archive the results below a round folder.
+
+    Results are read with postprocessing.shards (result files and shards of
+    every folder and its shard folders, deduplicated); the archive is
+    written atomically.
+
+    Returns:
+        Tuple (archive path, number of results)
+    """
+    root = os.path.normpath(root)
+    archive_path = archive_path or root + ARCHIVE_SUFFIX
+    tmp_path = f'{archive_path}.{os.getpid()}.tmp'
+    blocks, entries, lines = [], [], []
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as f_out:
+            f_out.write(MAGIC)
+            for folder in shards.result_folders(root):
+                prefix = os.path.relpath(folder, root).replace(os.sep, '/')
+                for name, result in shards.merge_results(shards.folder_sources(folder)):
+                    member = name if prefix == '.' else f'{prefix}/{name}'
+                    line = json.dumps(result, separators=(',', ':')).encode() + b'\n'
+                    entries.append([member, len(blocks), len(lines), *result_key(result)])
+                    lines.append(line)
+                    size += len(line)
+                    if len(lines) >= block_records or size >= BLOCK_BYTES:
+                        _write_block(f_out, lines, blocks, level)
+                        lines, size = [], 0
+            if lines:
+                _write_block(f_out, lines, blocks, level)
+            index = zlib.compress(json.dumps({'blocks': blocks, 'entries': entries}).encode(), level)
+            index_offset = f_out.tell()
+            f_out.write(index)
+            f_out.write(TRAILER.pack(index_offset, len(index)))
+            f_out.write(MAGIC)
+    except shards.ShardException as se:
+        os.remove(tmp_path)
+        raise ArchiveException(se.value)
+    os.replace(tmp_path, archive_path)
+    return archive_path, len(entries)
+
+
+def _result_bytes(root):
+    return sum(os.path.getsize(os.path.join(path, f)) for folder in shards.result_folders(root)
+               for path in shards.shard_folders(folder) for f in os.listdir(path)
+               if f.endswith('.json') or f.endswith(shards.SHARD_SUFFIX))
+
+
+def remove_archived(root):
+    """Remove the result files and shards below root, and the folders they leave empty."""
+    for folder in reversed(shards.result_folders(root)):
+        shards.remove_results(folder)
+        if os.path.normpath(folder) != os.path.normpath(root) and not os.listdir(folder):
+            os.rmdir(folder)
+
+
+def find_archive(path):
+    """(archive path, member) of a result file or folder below an archived round, None if there is none."""
+    path = os.path.abspath(path)
+    root = path
+    while not os.path.isfile(root + ARCHIVE_SUFFIX):
+        root, child = os.path.split(root)
+        if not child:
+            return None
+    return root + ARCHIVE_SUFFIX, os.path.relpath(path, root).replace(os.sep, '/')
+
+
+def open_archive(archive_path):
+    """Archive reader shared by the callers of this process."""
+    archive_path = os.path.abspath(archive_path)
+    if archive_path not in _open_archives:
+        _open_archives[archive_path] = ResultArchive(archive_path)
+    return _open_archives[archive_path]
+
+
+def load_result(file_path):
+    """Result of a result file, read from the archive of its round if the file is not on disk."""
+    if os.path.isfile(file_path):
+        with open(file_path, 'r') as fin:
+            return json.load(fin)
+    found = find_archive(file_path)
+    if found is None:
+        raise FileNotFoundError(file_path)
+    archive_path, member = found
+    return open_archive(archive_path).read(member)
+
+
+def folder_results(dir_path):
+    """(file name, result) of a folder of an archived round in name order."""
+    found = find_archive(dir_path)
+    if found is None:
+        raise FileNotFoundError(dir_path)
+    archive_path, folder = found
+    return open_archive(archive_path).folder_results('' if folder == '.' else folder)
+
+
+def member_paths(archive_path):
+    """Paths of the members of an archive as if the round were on disk (they resolve with load_result)."""
+    root = archive_path[:-len(ARCHIVE_SUFFIX)]
+    return [os.path.join(root, *member.split('/')) for member in sorted(open_archive(archive_path).members)]
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser(description="compressed archives of result rounds")
+    commands = parser.add_subparsers(dest='command', required=True)
+    create = commands.add_parser('create', help='archive a round folder into <round>.archive')
+    create.add_argument('root', help='results round folder, e.g. results/round-2')
+    create.add_argument('-o', '--output', default=None, help='archive file (default: <root>.archive)')
+    create.add_argument('-b', '--blockRecords', type=int, default=BLOCK_RECORDS, help='results per block')
+    create.add_argument('-d', '--delete', action='store_true',
+                        help='remove the archived result files and shards, and emptied folders')
+    listing = commands.add_parser('list', help='folders and sizes of an archive')
+    listing.add_argument('archive')
+    get = commands.add_parser('get', help='print one result of an archive')
+    get.add_argument('archive')
+    get.add_argument('-n', '--instance', required=True)
+    get.add_argument('-v', '--vehicles', type=int, required=True)
+    get.add_argument('-obj', '--objective', required=True)
+    get.add_argument('-p', '--pNorm', type=int, default=1)
+    get.add_argument('-fc', '--fairnessCoefficient', type=float, default=0.0)
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'create':
+            if not os.path.isdir(args.root):
+                raise ArchiveException(f'{args.root} is not a folder')
+            if args.delete and args.output is not None:
+                raise ArchiveException('--delete needs the default archive path, '
+                                       'otherwise the round no longer resolves to it')
+            before = _result_bytes(args.root)
+            archive_path, count = write_archive(args.root, args.output, args.blockRecords)
+            with ResultArchive(archive_path) as archive:
+                if len(archive) != count:
+                    raise ArchiveException(f'{archive_path} holds {len(archive)} of {count} results')
+            log.info(f'archived {count} results in {archive_path}: {before / 2**20:.1f} MB to '
+                     f'{os.path.getsize(archive_path) / 2**20:.1f} MB')
+            if args.delete:
+                remove_archived(args.root)
+                log.info(f'removed the archived result files and shards of {args.root}')
+        elif args.command == 'list':
+            with ResultArchive(args.archive) as archive:
+                for folder, count in archive.folders().items():
+                    print(f'{folder or ".":<24} {count:>8}')
+                print(f'{"total":<24} {len(archive):>8} results in {len(archive.blocks)} blocks, '
+                      f'{os.path.getsize(args.archive) / 2**20:.1f} MB')
+        else:
+            with ResultArchive(args.archive) as archive:
+                result = archive.get(args.instance, args.vehicles, args.objective, args.pNorm,
+                                     args.fairnessCoefficient)
+            if result is None:
+                raise ArchiveException('no such result in the archive')
+            print(json.dumps(result, indent=1))
+    except ArchiveException as ae:
+        log.error(ae)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
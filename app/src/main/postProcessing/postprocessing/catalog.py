@@ -0,0 +1,154 @@
+"""
+Catalog of the instances in app/data.
+
+The catalog is a JSON file (app/data/catalog.json) with one entry per
+instance file: name, dimension, number of solver vertices, depot, type,
+group and the vehicle counts used in the sweeps. The run generator and the
+queries read it instead of listing the data folder. Instances of published
+results whose file is not in app/data (att48.tsp) keep an entry with
+"hasInstanceFile": false: the exports list their results, the run generator
+skips them.
+
+    python -m postprocessing.catalog --rebuild
+"""
+import argparse
+import json
+import logging
+import os
+import re
+
+log = logging.getLogger(__name__)
+
+CATALOG_FILE = 'catalog.json'
+TSP_VEHICLES = [3, 4, 5]
+ROAD_VEHICLES = [4]
+
+
+def get_data_path() -> str:
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../../data'))
+
+
+def get_catalog_path(data_path: str = None) -> str:
+    return os.path.join(data_path or get_data_path(), CATALOG_FILE)
+
+
+def vehicle_counts(instance) -> list:
+    """Vehicle counts of the sweeps: k of the file name for CVRP, 4 for road networks, 3-5 otherwise."""
+    if instance.edge_weight_type == 'GIVEN':
+        return list(ROAD_VEHICLES)
+    if instance.type == 'CVRP':
+        match = re.search(r'-k(\d+)$', instance.name) or re.search(r'trucks: (\d+)', instance.header.get('COMMENT', ''))
+        if match:
+            return [int(match.group(1))]
+    return list(TSP_VEHICLES)
+
+
+def instance_group(instance) -> str:
+    if instance.edge_weight_type == 'GIVEN':
+        return 'road'
+    return 'cvrplib' if instance.type == 'CVRP' else 'tsplib'
+
+
+def catalog_entry(file_path: str) -> dict:
+    # reading the catalog must stay light, numpy is only needed to (re)build it
+    from postprocessing.instance import file_hash, read_instance
+
+    instance = read_instance(file_path)
+    return {
+        'name': instance.file_name,
+        'dimension': instance.dimension,
+        'numVertices': instance.num_vertices,
+        'depot': int(instance.depot),
+        'type': instance.type,
+        'edgeWeightType': instance.edge_weight_type,
+        'group': instance_group(instance),
+        'vehicles': vehicle_counts(instance),
+        'sha1': file_hash(file_path),
+    }
+
+
+def has_instance_file(entry) -> bool:
+    return entry.get('hasInstanceFile', True)
+
+
+def _sort_key(entry):
+    # instances without file after the instance files of their size, as in the original instance lists
+    return (entry['group'] != 'tsplib', entry['dimension'] if entry['group'] == 'tsplib' else 0,
+            not has_instance_file(entry), entry['name'])
+
+
+def write_catalog(entries: dict, data_path: str = None):
+    catalog_path = get_catalog_path(data_path)
+    ordered = sorted(entries.values(), key=_sort_key)
+    tmp_path = f'{catalog_path}.tmp'
+    with open(tmp_path, 'w') as f_out:
+        json.dump(ordered, f_out, indent=1)
+        f_out.write('\n')
+    os.replace(tmp_path, catalog_path)
+
+
+def build_catalog(data_path: str = None) -> dict:
+    """Scan the data folder once and write the catalog; entries of instances without file are kept."""
+    data_path = data_path or get_data_path()
+    entries = {}
+    catalog_path = get_catalog_path(data_path)
+    if os.path.isfile(catalog_path):
+        with open(catalog_path, 'r') as fin:
+            entries = {entry['name']: entry for entry in json.load(fin) if not has_instance_file(entry)}
+    for f in sorted(os.listdir(data_path)):
+        file_path = os.path.join(data_path, f)
+        if f.endswith(('.tsp', '.vrp')) and os.path.isfile(file_path):
+            entries[f] = catalog_entry(file_path)
+    write_catalog(entries, data_path)
+    log.info(f'wrote catalog of {len(entries)} instances to {catalog_path}')
+    return entries
+
+
+def load_catalog(data_path: str = None) -> dict:
+    """Return the catalog as a dictionary keyed by file name, building it if missing."""
+    catalog_path = get_catalog_path(data_path)
+    if not os.path.isfile(catalog_path):
+        return build_catalog(data_path)
+    with open(catalog_path, 'r') as fin:
+        return {entry['name']: entry for entry in json.load(fin)}
+
+
+def register_instance(file_path: str, vehicles: list = None, data_path: str = None) -> dict:
+    """Add or update the catalog entry of one instance file."""
+    entries = load_catalog(data_path)
+    entry = catalog_entry(file_path)
+    if vehicles is not None:
+        entry['vehicles'] = list(vehicles)
+    entries[entry['name']] = entry
+    write_catalog(entries, data_path)
+    log.info(f'registered {entry["name"]} in the instance catalog')
+    return entry
+
+
+def instance_vehicle_pairs(data_path: str = None, groups=('tsplib', 'cvrplib'), with_results_only=False):
+    """
+    (instance, vehicles) pairs of the benchmark sweeps, TSPLIB by size first, then CVRPLIB by name.
+
+    Instances without file (results only) are left out unless with_results_only,
+    e.g. for the exports of the published results.
+    """
+    entries = sorted(load_catalog(data_path).values(), key=_sort_key)
+    return [(entry['name'], vehicle) for entry in entries if entry['group'] in groups
+            and (with_results_only or has_instance_file(entry)) for vehicle in entry['vehicles']]
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser(description="build or show the instance catalog")
+    parser.add_argument('-d', '--data', default=None, help='data folder (default: app/data)')
+    parser.add_argument('-r', '--rebuild', action='store_true', help='rescan the data folder')
+    args = parser.parse_args()
+    entries = build_catalog(args.data) if args.rebuild else load_catalog(args.data)
+    for entry in sorted(entries.values(), key=_sort_key):
+        print(f"{entry['name']:<16} {entry['group']:<8} n={entry['dimension']:<4} "
+              f"depot={entry['depot']:<4} k={entry['vehicles']}" + ('' if has_instance_file(entry) else ' (no file)'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Single entry point of the Python tooling.
+
+    fairmtsp generate ...      run scripts of the sweeps (runGenerator/script_generator.py)
+    fairmtsp ingest            ingest a round into results/store.db (readResults/update_db.py)
+    fairmtsp export -t ...     CSV exports of the results store (readResults/queries.py)
+    fairmtsp validate ...      check result JSONs against their instances (readResults/validate.py)
+    fairmtsp bench ...         time the results pipeline on synthetic results (readResults/benchmark.py)
+    fairmtsp regress ...       solver regression runs on the quick set (runGenerator/regression.py)
+    fairmtsp monitor ...       live progress and throughput of running sweeps (runGenerator/monitor.py)
+    fairmtsp compact <round>   compact result files and JSONL shards (postprocessing/shards.py)
+    fairmtsp archive ...       compressed archives of finished rounds (postprocessing/archive.py)
+    fairmtsp store ...         rounds, provenance and round comparisons of the store (postprocessing/store.py)
+    fairmtsp plot seattle|pareto|tours ...
+    fairmtsp importtime        startup and import time of the commands
+
+Every subcommand hands its remaining arguments to the main() of its script,
+which is imported only when the subcommand runs. This module itself only
+imports the standard library, so that `fairmtsp --help` and the light
+subcommands start fast; heavy packages (numpy, networkx, matplotlib, osmnx)
+are imported inside the scripts where they are needed. `fairmtsp
+importtime` runs every command with `python -X importtime ... --help` and
+reports wall and import times against a budget.
+
+The runGenerator and readResults scripts are found relative to this
+package, i.e. the command needs a source checkout (poetry install, which
+installs the package in development mode).
+"""
+import argparse
+import importlib
+import os
+import sys
+
+PACKAGE_PATH = os.path.dirname(os.path.realpath(__file__))
+RUN_GENERATOR_PATH = os.path.abspath(os.path.join(PACKAGE_PATH, '..', 'runGenerator'))
+READ_RESULTS_PATH = os.path.abspath(os.path.join(PACKAGE_PATH, '..', '..', '..', '..', '..', 'readResults'))
+
+# subcommand: (module, folder to put on sys.path or None for package modules, help)
+COMMANDS = {
+    'generate': ('script_generator', RUN_GENERATOR_PATH, 'generate the run scripts of the sweeps'),
+    'ingest': ('update_db', READ_RESULTS_PATH, 'ingest the result JSON files of a round into results/store.db'),
+    'export': ('queries', READ_RESULTS_PATH, 'export tables of the results store to CSV'),
+    'validate': ('validate', READ_RESULTS_PATH, 'check result JSON files against their instances'),
+    'bench': ('benchmark', READ_RESULTS_PATH, 'time ingestion, exports and Pareto data on synthetic results'),
+    'regress': ('regression', RUN_GENERATOR_PATH, 'compare solver runs on the quick set with a baseline'),
+    'monitor': ('monitor', RUN_GENERATOR_PATH, 'follow the progress and throughput of running sweeps'),
+    'compact': ('postprocessing.shards', None, 'compact the result files and JSONL shards of a round'),
+    'archive': ('postprocessing.archive', None, 'create, list and read compressed archives of result rounds'),
+    'store': ('postprocessing.store', None, 'rounds, provenance and comparisons of the results store'),
+}
+
+PLOTS = {
+    'seattle': ('postprocessing.plot_seattle', 'tours on the Seattle road network'),
+    'pareto': ('postprocessing.plot_pareto_COF', 'COF and Pareto-front figures'),
+    'tours': ('postprocessing.plot_tours', 'tour figures of the results of any instance'),
+}
+
+# commands whose startup importtime checks against the budget
+LIGHT_COMMANDS = [[], ['plot'], ['plot', 'seattle'], ['plot', 'pareto'], ['plot', 'tours'], ['ingest'], ['export']]
+
+
+def run_script(module, folder, prog, args):
+    """Import module and run its main() with args as the command line."""
+    if folder is not None and folder not in sys.path:
+        sys.path.insert(0, folder)
+    sys.argv = [prog] + list(args)
+    return importlib.import_module(module).main()
+
+
+def _import_times(stderr):
+    """(total import time, [(cumulative us, module)] of the top-level imports) of -X importtime output."""
+    import re
+
+    top_level = []
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)', line)
+        if match is not None and match.group(3) == '':
+            top_level.append((int(match.group(2)), match.group(4)))
+    return sum(t for t, _ in top_level), sorted(top_level, reverse=True)
+
+
+def import_report(commands, budget_ms=200.0, top=5):
+    """
+    Start every command with --help under -X importtime and print wall and import times.
+
+    Returns:
+        List of the commands that failed or were slower than budget_ms
+    """
+    import subprocess
+    import time
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    baseline_ms = (time.perf_counter() - start) * 1000
+    print(f'interpreter startup: {baseline_ms:.0f} ms, budget: {budget_ms:.0f} ms')
+    slow = []
+    for command in commands:
+        argv = [sys.executable, '-X', 'importtime', '-m', 'postprocessing.cli'] + command + ['--help']
+        start = time.perf_counter()
+        completed = subprocess.run(argv, capture_output=True, text=True)
+        wall_ms = (time.perf_counter() - start) * 1000
+        total_us, modules = _import_times(completed.stderr)
+        status = 'ok' if wall_ms <= budget_ms else 'SLOW'
+        if completed.returncode != 0:
+            status = f'FAILED ({completed.returncode})'
+        if status != 'ok':
+            slow.append(command)
+        label = ' '.join(['fairmtsp'] + command + ['--help'])
+        print(f'{label:<32} {wall_ms:7.0f} ms wall {total_us / 1000:7.0f} ms imports  {status}')
+        for cumulative_us, module in modules[:top]:
+            print(f'    {cumulative_us / 1000:7.1f} ms  {module}')
+    return slow
+
+
+def handle_command_line(argv=None):
+    parser = argparse.ArgumentParser(prog='fairmtsp', description='FairMTSP experiment tooling')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, (_, _, help_text) in COMMANDS.items():
+        subparsers.add_parser(name, help=help_text, add_help=False)
+    plot = subparsers.add_parser('plot', help='figures of the results')
+    plot_kinds = plot.add_subparsers(dest='kind', required=True)
+    for name, (_, help_text) in PLOTS.items():
+        plot_kinds.add_parser(name, help=help_text, add_help=False)
+    report = subparsers.add_parser('importtime', help='startup and import times of the commands')
+    report.add_argument('-b', '--budget', type=float, default=200.0, help='wall time budget in ms')
+    report.add_argument('-a', '--all', action='store_true', help='report every command, not only the light ones')
+    return parser.parse_known_args(argv)
+
+
+def main(argv=None):
+    args, rest = handle_command_line(argv)
+    if args.command == 'importtime':
+        commands = LIGHT_COMMANDS
+        if args.all:
+            commands = LIGHT_COMMANDS + [[name] for name in COMMANDS if [name] not in LIGHT_COMMANDS] + \
+                       [['plot', name] for name in PLOTS]
+        slow = import_report(commands, args.budget)
+        # the heavy commands are reported, only the light ones have to meet the budget
+        return 1 if any(command in LIGHT_COMMANDS for command in slow) else 0
+    if args.command == 'plot':
+        module, _ = PLOTS[args.kind]
+        return run_script(module, None, f'fairmtsp plot {args.kind}', rest)
+    module, folder, _ = COMMANDS[args.command]
+    return run_script(module, folder, f'fairmtsp {args.command}', rest)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,86 +1,201 @@
-import osmnx as ox
 import networkx as nx
+import argparse
 import logging
 import random
 import numpy as np
 import json
-import os 
+import os
+from concurrent.futures import ProcessPoolExecutor
 
-random.seed(2024)
+from postprocessing import osm_cache
+from postprocessing.instance import write_sidecar
+from postprocessing.paths import get_paths_file, save_paths
 
 log = logging.getLogger(__name__)
-logging.basicConfig(
-    format = '%(asctime)s %(levelname)s--: %(message)s',
-    level = logging.INFO)
-
 
 bbox = {'Seattle': (47.619, 47.604, -122.320, -122.355)}
 city = 'Seattle'
-G_ = ox.graph_from_bbox(bbox = bbox[city], 
-                        network_type = 'drive', 
-                        simplify = True).to_undirected()
-relabel_map = {value: index for index, value in enumerate(G_.nodes())}
-back_relabel_map = {index: value for index, value in enumerate(G_.nodes())}
-
-node_data = {}
-for (node, data) in G_.nodes(data = True): 
-    node_data[node] = data 
-original_to_new_node_labels = relabel_map 
-new_to_original_node_labels = back_relabel_map 
-
-G = nx.relabel_nodes(G_, relabel_map)
-coordinates = {node: [data['x'], data['y']] for node, data in G.nodes(data = True)}
-centroid = np.mean([ value for key, value in coordinates.items() ], axis=0)
-distances_to_centroid = {
-    node: np.linalg.norm(coord - centroid) for node, coord in coordinates.items()
+
+# road graph of the worker processes, set once per worker by _init_worker
+_graph = None
+
+
+def handle_command_line():
+    """function to manage command line arguments """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of worker processes for the shortest paths')
+    parser.add_argument('--offline', action='store_true',
+                        help='only use the cached road graph, never download')
+    parser.add_argument('--refreshGraph', action='store_true',
+                        help='download the road graph again and update the cache')
+    parser.add_argument('--graphCache', default=None,
+                        help='folder of the cached road graphs (default: app/data/.cache/osm)')
+    config = parser.parse_args()
+    return config
+
+
+def load_graph(city_bbox, cache_path=None, offline=False, refresh=False):
+    return osm_cache.load_graph(city_bbox,
+                                network_type = 'drive',
+                                simplify = True,
+                                cache_path = cache_path,
+                                offline = offline,
+                                refresh = refresh).to_undirected()
+
+
+def relabel_graph(G_):
+    """Relabel the OSM node ids to 0..n-1 and keep the node data for plot_seattle.py."""
+    relabel_map = {value: index for index, value in enumerate(G_.nodes())}
+    back_relabel_map = {index: value for index, value in enumerate(G_.nodes())}
+    node_data = {}
+    for (node, data) in G_.nodes(data = True):
+        node_data[node] = data
+    G = nx.relabel_nodes(G_, relabel_map)
+    return G, relabel_map, back_relabel_map, node_data
+
+
+def nodes_by_centroid_distance(G):
+    """Node coordinates and the nodes sorted by distance to the centroid of all nodes."""
+    coordinates = {node: [data['x'], data['y']] for node, data in G.nodes(data = True)}
+    centroid = np.mean([ value for key, value in coordinates.items() ], axis=0)
+    distances_to_centroid = {
+        node: np.linalg.norm(coord - centroid) for node, coord in coordinates.items()
+        }
+    sorted_nodes = [node for node, _ in dict(
+        sorted(distances_to_centroid.items(), key = lambda item: item[1])
+        ).items()]
+    return coordinates, sorted_nodes
+
+
+def sample_targets(sorted_nodes, depot, num_targets, seed):
+    """num_targets random nodes other than the depot."""
+    rng = random.Random(seed)
+    targets = rng.sample(sorted_nodes, k = num_targets)
+    if depot in targets:
+        remaining = [node for node in sorted_nodes if node != depot and node not in set(targets)]
+        targets[targets.index(depot)] = rng.choice(remaining)
+    return targets
+
+
+def choose_terminals(G, num_targets, seed):
+    """Depot closest to the centroid of all nodes and num_targets random targets."""
+    coordinates, sorted_nodes = nodes_by_centroid_distance(G)
+    depot = sorted_nodes[0]
+    targets = sample_targets(sorted_nodes, depot, num_targets, seed)
+    return coordinates, depot, targets
+
+
+def _init_worker(graph):
+    global _graph
+    _graph = graph
+
+
+def _single_source(source, terminals, with_paths=False):
+    """One Dijkstra from source; lengths (and node sequences) to all terminals."""
+    if not with_paths:
+        lengths = nx.single_source_dijkstra_path_length(_graph, source, weight='length')
+        return [float(lengths[t]) for t in terminals], None
+    lengths, paths = nx.single_source_dijkstra(_graph, source, weight='length')
+    return [float(lengths[t]) for t in terminals], [paths[t] for t in terminals]
+
+
+def terminal_distances(G, terminals, workers=None, with_paths=False):
+    """
+    Shortest path lengths between all pairs of terminals.
+
+    Runs one single-source Dijkstra per terminal instead of one search per
+    pair, spread over worker processes that receive the graph once.
+
+    Returns:
+        Symmetric array of shape (len(terminals), len(terminals)), and with
+        with_paths also {(i, j): node sequence} for the rows i < j
+    """
+    terminals = list(terminals)
+    n = len(terminals)
+    if workers == 1:
+        _init_worker(G)
+        results = [_single_source(source, terminals, with_paths) for source in terminals]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(G,)) as executor:
+            results = list(executor.map(_single_source, terminals, [terminals] * n, [with_paths] * n,
+                                        chunksize=max(1, n // (4 * (workers or os.cpu_count() or 1)))))
+    matrix = np.array([lengths for lengths, _ in results])
+    # keep the lengths of the search from the lower index, as the pairwise searches did
+    upper = np.triu(matrix, k=1)
+    if not with_paths:
+        return upper + upper.T
+    paths = {(i, j): results[i][1][j] for i in range(n) for j in range(i+1, n)}
+    return upper + upper.T, paths
+
+
+def write_tsp(file_path, name, comment, node_coordinates, distance_matrix):
+    terminals = list(node_coordinates)
+    with open(file_path, 'w') as graph_file:
+        graph_file.write(f"NAME: {name}\n")
+        graph_file.write("DEPOT : 1\n")
+        graph_file.write(f"COMMENT: {comment} \n")
+        graph_file.write(f"DIMENSION: {len(node_coordinates)}\n")
+        graph_file.write("EDGE_WEIGHT_TYPE : GIVEN\n")
+        graph_file.write("NODE_COORD_SECTION\n")
+
+        for node, coord in node_coordinates.items():
+            graph_file.write(f"{node} {coord[0]} {coord[1]}\n")
+
+        graph_file.write("EDGE COSTS\n")
+
+        for i in range(len(terminals)-1):
+            for j in range(i+1, len(terminals)):
+                graph_file.write(f"{terminals[i]} {terminals[j]} {float(distance_matrix[i, j])}\n")
+
+        graph_file.write("EOF\n")
+
+    # binary copy of the edge costs, read by the solver and instance.py instead of the text
+    write_sidecar(file_path, terminals, distance_matrix)
+
+
+def main():
+    logging.basicConfig(
+        format = '%(asctime)s %(levelname)s--: %(message)s',
+        level = logging.INFO)
+    config = handle_command_line()
+
+    try:
+        G_ = load_graph(bbox[city], config.graphCache, config.offline, config.refreshGraph)
+    except osm_cache.GraphCacheException as ge:
+        log.error(ge)
+        return
+    G, relabel_map, back_relabel_map, node_data = relabel_graph(G_)
+    coordinates, depot, targets = choose_terminals(G, 50, 2024)
+
+    data = {
+        'node_data' : node_data,
+        'original_to_new_node_labels' : relabel_map,
+        'new_to_original_node_labels' : back_relabel_map,
+        'targets_on_new_node_labels': targets,
+        'depot_on_new_node_labels': depot
     }
-sorted_nodes = [node for node, _ in dict(
-    sorted(distances_to_centroid.items(), key = lambda item: item[1])
-    ).items()]
-depot = sorted_nodes[0]
-targets = random.sample(sorted_nodes, k = 50)
-
-data = {
-    'node_data' : node_data, 
-    'original_to_new_node_labels' : relabel_map, 
-    'new_to_original_node_labels' : back_relabel_map, 
-    'targets_on_new_node_labels': targets, 
-    'depot_on_new_node_labels': depot
-}
-
-log.info('storing relabel data in seattle.json')
-with open('seattle.json', 'w') as outfile: 
-    json.dump(data, outfile)
-    
-all_nodes = [depot] + targets
-distance_matrix = {} 
-for i in range(len(all_nodes)-1):
-    for j in range(i+1, len(all_nodes)):
-        distance_matrix[(all_nodes[i],all_nodes[j])] = nx.shortest_path_length(G, source=all_nodes[i], target=all_nodes[j], weight='length')
-        
-output_directory = '../../../../data/'
-
-os.makedirs(output_directory, exist_ok=True)
-
-node_coordinates = {node: coordinates[node] for node in all_nodes}
-
-log.info('writing seattle.tsp file')
-with open(os.path.join(output_directory, 'seattle.tsp'), 'w') as graph_file:
-    graph_file.write("NAME: seattle50\n")
-    graph_file.write("DEPOT : 1\n")
-    graph_file.write("COMMENT: Depot and 50 random targets in Seattle \n")
-    graph_file.write(f"DIMENSION: {len(node_coordinates)}\n")
-    graph_file.write("EDGE_WEIGHT_TYPE : GIVEN\n")
-    graph_file.write("NODE_COORD_SECTION\n")
-
-    for node, coord in node_coordinates.items():
-        graph_file.write(f"{node} {coord[0]} {coord[1]}\n")
-
-    graph_file.write("EDGE COSTS\n")
-
-    for edge, dist in distance_matrix.items():
-        graph_file.write(f"{edge[0]} {edge[1]} {dist}\n")
-
-    graph_file.write("EOF\n")
+
+    log.info('storing relabel data in seattle.json')
+    with open('seattle.json', 'w') as outfile:
+        json.dump(data, outfile)
+
+    all_nodes = [depot] + targets
+    log.info(f'computing shortest paths from {len(all_nodes)} terminals')
+    distance_matrix, paths = terminal_distances(G, all_nodes, config.workers, with_paths=True)
+
+    output_directory = '../../../../data/'
+    os.makedirs(output_directory, exist_ok=True)
+
+    node_coordinates = {node: coordinates[node] for node in all_nodes}
+
+    log.info('writing seattle.tsp file')
+    tsp_path = os.path.join(output_directory, 'seattle.tsp')
+    write_tsp(tsp_path, 'seattle50',
+              'Depot and 50 random targets in Seattle', node_coordinates, distance_matrix)
+    log.info('writing shortest paths between terminals')
+    save_paths(get_paths_file(tsp_path), all_nodes, paths)
 
 
+if __name__ == '__main__':
+    main()
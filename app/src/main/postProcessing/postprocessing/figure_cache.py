@@ -0,0 +1,99 @@
+"""
+Content-hashed build cache of figures.
+
+Every figure declares its inputs: data files, data read from a database or
+CSV, the rc params, the target and the plotting code. Their digest is kept
+per figure in <output folder>/.figures.json; a figure is rebuilt only when
+its digest changed or one of its output files is missing, so re-running a
+plot script after one new result rebuilds only the figures that use it.
+Figures are saved with a tight bounding box computed by matplotlib, which
+replaces the pdfcrop/rm/mv subprocesses per figure.
+"""
+import hashlib
+import json
+import logging
+import os
+
+from postprocessing import profiling
+
+log = logging.getLogger(__name__)
+
+MANIFEST = '.figures.json'
+
+_file_digests = {}
+
+
+def _file_digest(file_path):
+    """SHA-1 of a file, computed once per process and file state."""
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+    if key not in _file_digests:
+        # instance imports numpy, the plot scripts import this module before parsing --help
+        from postprocessing.instance import file_hash
+        _file_digests[key] = file_hash(file_path)
+    return _file_digests[key]
+
+
+def figure_digest(target, rc_params, files=(), data=None):
+    """
+    Digest of the inputs of a figure.
+
+    Args:
+        target: paper/presentation
+        rc_params: matplotlib rc params the figure is drawn with
+        files: data files and plotting modules the figure depends on, keyed by
+            their absolute path, as files of different folders share names
+        data: JSON-serializable data of the figure, e.g. rows of a query
+    """
+    inputs = {
+        'target': target,
+        'rc_params': rc_params,
+        'files': {os.path.normpath(os.path.abspath(f)): _file_digest(f) for f in files},
+        'data': data,
+    }
+    encoded = json.dumps(inputs, sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()
+
+
+class FigureCache:
+    """Manifest {figure name: input digest} of the figures of an output folder."""
+
+    def __init__(self, out_path, force=False):
+        self.path = os.path.join(out_path, MANIFEST)
+        self.force = force
+        self.entries = {}
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as fin:
+                self.entries = json.load(fin)
+
+    def is_current(self, name, digest, outputs):
+        """True if the figure was built from the same inputs and all its outputs exist."""
+        if self.force or self.entries.get(name) != digest:
+            return False
+        return all(os.path.isfile(f) for f in outputs)
+
+    def record(self, name, digest):
+        self.entries[name] = digest
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f_out:
+            json.dump(self.entries, f_out, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def save_figure(fig, file, crop=False, fmt='pdf', dpi=None):
+    """Save fig to <file>.<fmt>, cropped to the tight bounding box of its artists if crop."""
+    out_file = f'{file}.{fmt}'
+    tmp_file = f'{file}.{os.getpid()}.tmp.{fmt}'
+    if crop:
+        # the tight bounding box costs an extra draw of the figure
+        with profiling.stage('crop'):
+            fig.savefig(tmp_file, format=fmt, dpi=dpi, bbox_inches='tight', pad_inches=0.01)
+    else:
+        with profiling.stage('save'):
+            fig.savefig(tmp_file, format=fmt, dpi=dpi)
+    os.replace(tmp_file, out_file)
+    profiling.count('figures written')
+    return out_file
@@ -0,0 +1,428 @@
+"""
+Construction and local search heuristic for the fair m-TSP.
+
+Tours are built by savings or sweep construction and improved by variable
+neighbourhood descent over 2-opt, or-opt, inter-route relocate and
+inter-route exchange moves. Every neighbourhood is evaluated in one NumPy
+step: the tour-length vector of every candidate move is formed and scored
+with the objective at once, so the same moves serve all objectives:
+
+- min, eps-fair, delta-fair: sum of tour lengths, the fairness constraints
+  (norm index >= eps, Gini index <= delta) enter as penalties,
+- min-max: longest tour,
+- p-norm: p-norm of the tour lengths.
+
+The result is written in the Result JSON layout of the solver, so it can be
+read by update_db.py, the plotting scripts and the solver's warm start.
+
+    python -m postprocessing.heuristic -n eil51.tsp -v 5 -obj eps-fair -fc 0.5
+    python -m postprocessing.heuristic --benchmark
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from postprocessing import store
+from postprocessing.shards import result_file_name
+from postprocessing.catalog import load_catalog
+from postprocessing.instance import get_data_path, load_instance
+from postprocessing.metrics import gini_index, jain_index, norm_index, sort_lengths
+
+log = logging.getLogger(__name__)
+
+OBJECTIVES = ['min', 'min-max', 'p-norm', 'eps-fair', 'delta-fair']
+IMPROVEMENT_TOL = 1e-9
+
+
+class Objective:
+    """Scores tour-length vectors; lower is better."""
+
+    def __init__(self, objective_type: str, num_vehicles: int, fc: float = 0.0, p: int = 1, penalty: float = 1e6):
+        if objective_type not in OBJECTIVES:
+            raise ValueError(f"objective should be one of {OBJECTIVES}, given: {objective_type}")
+        self.objective_type = objective_type
+        self.num_vehicles = num_vehicles
+        self.fc = fc
+        self.p = p
+        self.penalty = penalty
+
+    def violation(self, lengths):
+        """Violation of the fairness constraint, 0 for feasible length vectors."""
+        lengths = np.asarray(lengths, dtype=float)
+        if self.objective_type == 'eps-fair':
+            return np.maximum(0.0, self.fc - np.nan_to_num(norm_index(lengths), nan=0.0))
+        if self.objective_type == 'delta-fair':
+            return np.maximum(0.0, np.nan_to_num(gini_index(lengths), nan=1.0) - self.fc)
+        return np.zeros(lengths.shape[:-1])
+
+    def value(self, lengths):
+        """Objective value as reported by the solver."""
+        lengths = np.asarray(lengths, dtype=float)
+        if self.objective_type == 'min-max':
+            return lengths.max(axis=-1)
+        if self.objective_type == 'p-norm':
+            return (lengths ** self.p).sum(axis=-1) ** (1.0 / self.p)
+        return lengths.sum(axis=-1)
+
+    def score(self, lengths):
+        lengths = np.asarray(lengths, dtype=float)
+        score = self.value(lengths) + self.penalty * self.violation(lengths)
+        if self.objective_type == 'min-max':
+            # prefer shorter total length among tours with the same maximum
+            score = score + 1e-6 * lengths.sum(axis=-1)
+        return score
+
+
+class Solution:
+    """Routes as arrays of distance-matrix rows, without the depot."""
+
+    def __init__(self, distances, depot: int, routes):
+        self.distances = distances
+        self.depot = depot
+        self.routes = [np.asarray(route, dtype=np.int64) for route in routes]
+        self.lengths = np.array([self.route_length(route) for route in self.routes], dtype=float)
+
+    def closed(self, route):
+        return np.concatenate([[self.depot], route, [self.depot]])
+
+    def route_length(self, route):
+        if len(route) == 0:
+            return 0.0
+        path = self.closed(route)
+        return float(self.distances[path[:-1], path[1:]].sum())
+
+    def set_route(self, index, route):
+        self.routes[index] = np.asarray(route, dtype=np.int64)
+        self.lengths[index] = self.route_length(self.routes[index])
+
+    def copy(self):
+        return Solution(self.distances, self.depot, [route.copy() for route in self.routes])
+
+
+def savings_construction(distances, depot: int, targets, num_vehicles: int):
+    """Clarke-Wright savings without capacities, merging until num_vehicles routes remain."""
+    routes = {int(t): [int(t)] for t in targets}
+    route_of = {int(t): int(t) for t in targets}
+    if len(routes) > num_vehicles:
+        targets = np.asarray(targets)
+        savings = distances[depot, targets][:, None] + distances[targets, depot][None, :] - distances[np.ix_(targets, targets)]
+        i, j = np.triu_indices(len(targets), k=1)
+        order = np.lexsort((j, i, -savings[i, j]))
+        for a, b in zip(targets[i[order]], targets[j[order]]):
+            a, b = int(a), int(b)
+            ra, rb = route_of[a], route_of[b]
+            if ra == rb:
+                continue
+            route_a, route_b = routes[ra], routes[rb]
+            if route_a[-1] == a and route_b[0] == b:
+                merged = route_a + route_b
+            elif route_a[0] == a and route_b[-1] == b:
+                merged = route_b + route_a
+            elif route_a[-1] == a and route_b[-1] == b:
+                merged = route_a + route_b[::-1]
+            elif route_a[0] == a and route_b[0] == b:
+                merged = route_a[::-1] + route_b
+            else:
+                continue
+            routes[ra] = merged
+            del routes[rb]
+            for t in route_b:
+                route_of[t] = ra
+            if len(routes) == num_vehicles:
+                break
+    result = list(routes.values())
+    result += [[] for _ in range(num_vehicles - len(result))]
+    return result
+
+
+def sweep_construction(coords, depot: int, targets, num_vehicles: int, start_angle: float = 0.0):
+    """Split the targets by polar angle around the depot into num_vehicles consecutive groups."""
+    targets = np.asarray(targets)
+    offsets = coords[targets] - coords[depot]
+    angles = np.mod(np.arctan2(offsets[:, 1], offsets[:, 0]) - start_angle, 2 * np.pi)
+    ordered = targets[np.lexsort((targets, angles))]
+    return [list(group) for group in np.array_split(ordered, num_vehicles)]
+
+
+class LocalSearch:
+    """Variable neighbourhood descent; every neighbourhood applies its best improving move."""
+
+    def __init__(self, objective: Objective, max_iterations: int = 10000):
+        self.objective = objective
+        self.max_iterations = max_iterations
+
+    def _best(self, solution, route_indices, new_lengths):
+        """Score candidate length vectors; new_lengths has one column per changed route."""
+        lengths = np.repeat(solution.lengths[None, :], len(new_lengths), axis=0)
+        lengths[:, route_indices] = new_lengths
+        scores = self.objective.score(lengths)
+        best = int(np.argmin(scores))
+        return best, float(scores[best])
+
+    def two_opt(self, solution, current):
+        d = solution.distances
+        for r, route in enumerate(solution.routes):
+            if len(route) < 3:
+                continue
+            path = solution.closed(route)
+            a, b = path[:-1], path[1:]
+            delta = d[a[:, None], a[None, :]] + d[b[:, None], b[None, :]] - d[a, b][:, None] - d[a, b][None, :]
+            i, j = np.triu_indices(len(a), k=2)
+            keep = ~((i == 0) & (j == len(a) - 1))
+            i, j = i[keep], j[keep]
+            if len(i) == 0:
+                continue
+            best, score = self._best(solution, [r], (solution.lengths[r] + delta[i, j])[:, None])
+            if score < current - IMPROVEMENT_TOL:
+                bi, bj = i[best], j[best]
+                new_path = np.concatenate([path[:bi + 1], path[bi + 1:bj + 1][::-1], path[bj + 1:]])
+                solution.set_route(r, new_path[1:-1])
+                return True, score
+        return False, current
+
+    def or_opt(self, solution, current):
+        d = solution.distances
+        for r, route in enumerate(solution.routes):
+            for size in (1, 2, 3):
+                if len(route) < size + 1:
+                    continue
+                path = solution.closed(route)
+                starts = np.arange(1, len(path) - size)
+                ends = starts + size - 1
+                removal = (d[path[starts - 1], path[ends + 1]] - d[path[starts - 1], path[starts]]
+                           - d[path[ends], path[ends + 1]])
+                # insert between path[g] and path[g + 1], away from the segment itself
+                gaps = np.arange(len(path) - 1)
+                s, g = np.meshgrid(np.arange(len(starts)), gaps, indexing='ij')
+                s, g = s.ravel(), g.ravel()
+                valid = (g < starts[s] - 1) | (g > ends[s])
+                s, g = s[valid], g[valid]
+                if len(s) == 0:
+                    continue
+                insertion = (d[path[g], path[starts[s]]] + d[path[ends[s]], path[g + 1]] - d[path[g], path[g + 1]])
+                best, score = self._best(solution, [r], (solution.lengths[r] + removal[s] + insertion)[:, None])
+                if score < current - IMPROVEMENT_TOL:
+                    start, end, gap = starts[s[best]], ends[s[best]], g[best]
+                    segment = path[start:end + 1]
+                    rest = np.concatenate([path[:start], path[end + 1:]])
+                    position = gap + 1 if gap < start else gap + 1 - size
+                    new_path = np.concatenate([rest[:position], segment, rest[position:]])
+                    solution.set_route(r, new_path[1:-1])
+                    return True, score
+        return False, current
+
+    def relocate(self, solution, current):
+        d = solution.distances
+        k = len(solution.routes)
+        for ra in range(k):
+            if len(solution.routes[ra]) == 0:
+                continue
+            path_a = solution.closed(solution.routes[ra])
+            x = path_a[1:-1]
+            removal = d[path_a[:-2], path_a[2:]] - d[path_a[:-2], x] - d[x, path_a[2:]]
+            for rb in range(k):
+                if rb == ra:
+                    continue
+                path_b = solution.closed(solution.routes[rb])
+                u, v = path_b[:-1], path_b[1:]
+                if len(solution.routes[rb]) == 0:
+                    u, v = u[:1], v[:1]
+                insertion = d[u[None, :], x[:, None]] + d[x[:, None], v[None, :]] - d[u, v][None, :]
+                i, j = np.indices(insertion.shape)
+                i, j = i.ravel(), j.ravel()
+                new_lengths = np.stack([solution.lengths[ra] + removal[i], solution.lengths[rb] + insertion[i, j]], axis=1)
+                best, score = self._best(solution, [ra, rb], new_lengths)
+                if score < current - IMPROVEMENT_TOL:
+                    bi, bj = i[best], j[best]
+                    solution.set_route(ra, np.delete(solution.routes[ra], bi))
+                    solution.set_route(rb, np.insert(solution.routes[rb], bj, x[bi]))
+                    return True, score
+        return False, current
+
+    def exchange(self, solution, current):
+        d = solution.distances
+        k = len(solution.routes)
+        for ra in range(k):
+            for rb in range(ra + 1, k):
+                if len(solution.routes[ra]) == 0 or len(solution.routes[rb]) == 0:
+                    continue
+                path_a = solution.closed(solution.routes[ra])
+                path_b = solution.closed(solution.routes[rb])
+                pa, x, na = path_a[:-2], path_a[1:-1], path_a[2:]
+                pb, y, nb = path_b[:-2], path_b[1:-1], path_b[2:]
+                delta_a = (d[pa[:, None], y[None, :]] + d[y[None, :], na[:, None]]
+                           - (d[pa, x] + d[x, na])[:, None])
+                delta_b = (d[pb[None, :], x[:, None]] + d[x[:, None], nb[None, :]]
+                           - (d[pb, y] + d[y, nb])[None, :])
+                i, j = np.indices(delta_a.shape)
+                i, j = i.ravel(), j.ravel()
+                new_lengths = np.stack([solution.lengths[ra] + delta_a[i, j], solution.lengths[rb] + delta_b[i, j]], axis=1)
+                best, score = self._best(solution, [ra, rb], new_lengths)
+                if score < current - IMPROVEMENT_TOL:
+                    bi, bj = i[best], j[best]
+                    route_a, route_b = solution.routes[ra].copy(), solution.routes[rb].copy()
+                    route_a[bi], route_b[bj] = y[bj], x[bi]
+                    solution.set_route(ra, route_a)
+                    solution.set_route(rb, route_b)
+                    return True, score
+        return False, current
+
+    def run(self, solution):
+        neighbourhoods = [self.two_opt, self.or_opt, self.relocate, self.exchange]
+        current = float(self.objective.score(solution.lengths))
+        iteration = 0
+        index = 0
+        while index < len(neighbourhoods) and iteration < self.max_iterations:
+            improved, current = neighbourhoods[index](solution, current)
+            iteration += 1
+            index = 0 if improved else index + 1
+        return solution
+
+
+def solve(instance, num_vehicles: int, objective_type: str, fc: float = 0.0, p: int = 1, starts: int = 4):
+    """
+    Run the heuristic from savings and sweep starts and return the best solution.
+
+    Returns:
+        Tuple (solution, objective)
+    """
+    distances = np.asarray(instance.distances())
+    depot = int(instance.rows(instance.depot))
+    targets = np.array([row for row in range(instance.num_vertices) if row != depot])
+    objective = Objective(objective_type, num_vehicles, fc, p, penalty=10.0 * float(distances.sum()))
+    search = LocalSearch(objective)
+
+    initial = [savings_construction(distances, depot, targets, num_vehicles)]
+    if np.ptp(instance.coords, axis=0).max() > 0:
+        initial += [sweep_construction(instance.coords, depot, targets, num_vehicles, 2 * np.pi * s / starts)
+                    for s in range(starts)]
+
+    best, best_score = None, np.inf
+    for routes in initial:
+        solution = search.run(Solution(distances, depot, routes))
+        score = float(objective.score(solution.lengths))
+        if score < best_score - IMPROVEMENT_TOL:
+            best, best_score = solution, score
+    return best, objective
+
+
+def to_result(instance, solution, objective, computation_time: float) -> dict:
+    """Result dictionary in the layout of fairMTSP.data.Result, tours by decreasing length."""
+    order = np.argsort(-solution.lengths, kind='stable')
+    tours = [[int(v) for v in instance.vertices[solution.closed(solution.routes[r])]] if len(solution.routes[r])
+             else [int(instance.depot)] for r in order]
+    lengths = sort_lengths(solution.lengths)
+    feasible = float(objective.violation(lengths)) <= 1e-9
+    result = {
+        'instanceName': instance.file_name,
+        'numVertices': instance.num_vertices,
+        'depot': int(instance.depot),
+        'numVehicles': objective.num_vehicles,
+        'objectiveType': objective.objective_type,
+        'vertexCoords': {str(int(v)): {'x': float(c[0]), 'y': float(c[1])}
+                         for v, c in zip(instance.vertices, instance.coords)},
+        'tours': tours if feasible else None,
+        'tourCost': lengths.tolist() if feasible else None,
+        'objectiveValue': float(objective.value(lengths)) if feasible else None,
+        'computationTimeInSec': round(computation_time, 2),
+        'fairnessCoefficient': objective.fc,
+        'pNorm': objective.p,
+        'optimalityGapPercent': None,
+        'jainIndex': float(jain_index(lengths)) if feasible else None,
+        'giniIndex': float(gini_index(lengths)) if feasible else None,
+        'normIndex': float(norm_index(lengths)) if feasible else None,
+    }
+    return result
+
+
+def run_case(instance_name, num_vehicles, objective_type, fc=0.0, p=1, data_path=None):
+    instance = load_instance(instance_name, data_path)
+    start = time.perf_counter()
+    solution, objective = solve(instance, num_vehicles, objective_type, fc, p)
+    return to_result(instance, solution, objective, time.perf_counter() - start)
+
+
+def exact_values(db_path, instance_name, num_vehicles, objective_type, p):
+    """Sum of tours and max tour length of an optimal solver run, None if unknown."""
+    if not os.path.isfile(db_path):
+        return None
+    connection = store.connect(db_path)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT LengthOfTours, GapToOpt
+            FROM {'vehi' + str(num_vehicles)}
+            WHERE instanceName = ? AND numVehicles = ? AND objective = ? AND pNorm = ? AND fairnessCoefficient = ?
+            """, (instance_name, str(num_vehicles), objective_type, str(p), '0.0'))
+        row = cursor.fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    cursor.close()
+    connection.close()
+    if row is None or float(row[1]) > 0.0:
+        return None
+    return [abs(float(x)) for x in json.loads(row[0])]
+
+
+def benchmark(data_path, db_path, objectives=('min', 'min-max')):
+    """Compare heuristic values with proven optima of the solver on the E and A sets."""
+    catalog = load_catalog(data_path)
+    names = sorted(name for name, entry in catalog.items() if entry['group'] == 'cvrplib')
+    print(f'{"instance":<14} {"k":>2} {"objective":<10} {"heuristic":>10} {"optimum":>10} {"gap %":>7} {"time s":>7}')
+    gaps = []
+    for name in names:
+        for num_vehicles in catalog[name]['vehicles']:
+            for objective_type in objectives:
+                result = run_case(name, num_vehicles, objective_type, data_path=data_path)
+                optimal_lengths = exact_values(db_path, name, num_vehicles, objective_type, 1)
+                optimum = round(float(Objective(objective_type, num_vehicles).value(optimal_lengths)), 2) if optimal_lengths else None
+                gap = 100.0 * (result['objectiveValue'] - optimum) / optimum if optimum else None
+                if gap is not None:
+                    gaps.append(gap)
+                print(f'{name:<14} {num_vehicles:>2} {objective_type:<10} {result["objectiveValue"]:>10.1f} '
+                      f'{optimum if optimum is not None else "-":>10} '
+                      f'{f"{gap:.2f}" if gap is not None else "-":>7} {result["computationTimeInSec"]:>7.2f}')
+    if gaps:
+        print(f'mean gap {np.mean(gaps):.2f} %, max gap {np.max(gaps):.2f} % over {len(gaps)} proven optima')
+
+
+def handle_command_line():
+    parser = argparse.ArgumentParser(description="fair m-TSP construction and local search heuristic")
+    parser.add_argument('-n', '--instance', default='seattle.tsp', help='instance name')
+    parser.add_argument('-path', '--data', default=None, help='instance folder (default: app/data)')
+    parser.add_argument('-v', '--vehicles', type=int, default=2, help='number of vehicles')
+    parser.add_argument('-obj', '--objective', choices=OBJECTIVES, default='min', help='type of objective')
+    parser.add_argument('-fc', '--fairnessCoefficient', type=float, default=0.5, help='fairness value')
+    parser.add_argument('-p', '--pNorm', type=int, default=2, help='p norm value')
+    parser.add_argument('-r', '--results', default='./', help='folder to write the result file to')
+    parser.add_argument('-b', '--benchmark', action='store_true',
+                        help='compare with proven optima of the E and A sets instead')
+    parser.add_argument('-db', '--database', default=None,
+                        help='results database with solver optima (default: results/store.db, else results/round-2/results.db)')
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.INFO)
+    args = handle_command_line()
+    data_path = args.data or get_data_path()
+    if args.benchmark:
+        benchmark(data_path, args.database or store.default_database())
+        return
+    fc = args.fairnessCoefficient if args.objective in ['eps-fair', 'delta-fair'] else 0.0
+    p = args.pNorm if args.objective == 'p-norm' else 1
+    result = run_case(args.instance, args.vehicles, args.objective, fc, p, data_path)
+    out_path = os.path.join(args.results, result_file_name(args.instance, args.vehicles, args.objective, p, fc))
+    with open(out_path, 'w') as f_out:
+        json.dump(result, f_out, indent=1)
+    log.info(f'objective {result["objectiveValue"]}, tour lengths {result["tourCost"]}, written to {out_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+"""
+Reader for the TSPLIB/CVRPLIB instances in app/data.
+
+The parsing mirrors fairMTSP.data.InstanceDto so that vertex ids, the depot
+and the (rounded) edge lengths agree with what the solver uses:
+
+- EXPLICIT instances (LOWER_DIAG_ROW, LOWER_ROW, UPPER_ROW) have vertices
+  0..n-1 with depot 0,
+- EUC_2D/GEO instances use the ids of NODE_COORD_SECTION; the depot is read
+  from DEPOT_SECTION and, if missing, a vertex 0 is added at the mean of the
+  target coordinates (GEO coordinates are treated as planar, like the solver),
+- GIVEN instances (road networks) list their edges under EDGE COSTS and have
+  the first vertex of NODE_COORD_SECTION as depot.
+
+Distance matrices are computed with NumPy and cached as .npy files named
+after the SHA-1 of the instance file, so they can be memory-mapped.
+
+Generated road instances come with a binary sidecar <name>.dist.bin holding
+the edge costs that both this reader and the solver prefer over the text
+EDGE COSTS section: the magic FMTSPUTM, int32 version and vertex count n,
+n int64 vertex ids and the n(n-1)/2 float64 costs of the upper triangle in
+row-major order, all little-endian.
+
+    python -m postprocessing.instance --sidecar seattle.tsp
+"""
+import argparse
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+SIDECAR_MAGIC = b'FMTSPUTM'
+SIDECAR_VERSION = 1
+SECTION_ENDS = ('EOF', 'DISPLAY_DATA_SECTION', 'DEMAND_SECTION', 'DEPOT_SECTION', 'NODE_COORD_SECTION')
+
+
+class InstanceException(Exception):
+    """Custom exception class with message for this module."""
+
+    def __init__(self, value):
+        self.value = value
+        super().__init__(value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+def get_data_path() -> str:
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../../data'))
+
+
+def get_cache_path(data_path: str = None) -> str:
+    return os.path.join(data_path or get_data_path(), '.cache')
+
+
+def get_sidecar_path(file_path: str) -> str:
+    return f'{os.path.splitext(file_path)[0]}.dist.bin'
+
+
+def write_sidecar(file_path: str, vertices, matrix):
+    """Write the upper triangle of matrix as the binary sidecar of the instance file_path."""
+    vertices = np.asarray(vertices, dtype='<i8')
+    n = len(vertices)
+    rows, cols = np.triu_indices(n, k=1)
+    sidecar_path = get_sidecar_path(file_path)
+    tmp_path = f'{sidecar_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f_out:
+        f_out.write(SIDECAR_MAGIC)
+        f_out.write(np.array([SIDECAR_VERSION, n], dtype='<i4').tobytes())
+        f_out.write(vertices.tobytes())
+        f_out.write(np.asarray(matrix, dtype='<f8')[rows, cols].tobytes())
+    os.replace(tmp_path, sidecar_path)
+    return sidecar_path
+
+
+def read_sidecar(file_path: str, vertices):
+    """Full matrix from the sidecar of file_path, None if missing or not matching vertices."""
+    sidecar_path = get_sidecar_path(file_path)
+    if not os.path.isfile(sidecar_path):
+        return None
+    data = np.fromfile(sidecar_path, dtype=np.uint8)
+    magic = data[:len(SIDECAR_MAGIC)].tobytes()
+    version, n = np.frombuffer(data, dtype='<i4', count=2, offset=len(SIDECAR_MAGIC))
+    if magic != SIDECAR_MAGIC or version != SIDECAR_VERSION or n != len(vertices):
+        log.warning(f'ignoring {sidecar_path}: does not match {file_path}')
+        return None
+    offset = len(SIDECAR_MAGIC) + 8
+    ids = np.frombuffer(data, dtype='<i8', count=n, offset=offset)
+    if not np.array_equal(ids, vertices):
+        log.warning(f'ignoring {sidecar_path}: vertex ids differ from {file_path}')
+        return None
+    rows, cols = np.triu_indices(n, k=1)
+    costs = np.frombuffer(data, dtype='<f8', count=len(rows), offset=offset + 8 * n)
+    matrix = np.zeros((n, n))
+    matrix[rows, cols] = costs
+    matrix[cols, rows] = costs
+    return matrix
+
+
+def file_hash(file_path: str) -> str:
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as fin:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class Instance:
+    """
+    Header, vertices and coordinates of an instance.
+
+    vertices holds the vertex ids in the order the solver adds them to its
+    graph and coords the matching (x, y) rows. The distance matrix is indexed
+    by row, use rows() to map vertex ids to rows.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self.file_name = os.path.basename(file_path)
+        self.header = {}
+        self.vertices = None
+        self.coords = None
+        self.depot = None
+        self._lines = None
+        self._sections = {}
+        self._distances = None
+
+    @property
+    def name(self):
+        return self.header.get('NAME', self.file_name.split('.')[0])
+
+    @property
+    def type(self):
+        return self.header.get('TYPE', 'TSP')
+
+    @property
+    def dimension(self) -> int:
+        return int(self.header['DIMENSION'])
+
+    @property
+    def edge_weight_type(self):
+        return self.header.get('EDGE_WEIGHT_TYPE')
+
+    @property
+    def num_vertices(self) -> int:
+        return len(self.vertices)
+
+    def rows(self, vertex_ids):
+        """Map vertex ids (scalar or array) to rows of coords/distances."""
+        lookup = np.full(int(self.vertices.max()) + 1, -1, dtype=np.int64)
+        lookup[self.vertices] = np.arange(len(self.vertices))
+        return lookup[np.asarray(vertex_ids)]
+
+    def distances(self, use_cache: bool = True):
+        """Rounded distance matrix, loaded from or written to the .npy cache."""
+        if self._distances is None:
+            self._distances = load_distance_matrix(self, use_cache=use_cache)
+        return self._distances
+
+    def _read(self, full: bool = True):
+        with open(self.file_path, 'r') as fin:
+            if full:
+                self._lines = fin.read().splitlines()
+            else:
+                # the edge costs come from the sidecar, skip the EDGE COSTS section
+                self._lines = []
+                for line in fin:
+                    if line.startswith('EDGE COSTS'):
+                        break
+                    self._lines.append(line.rstrip('\n'))
+        current = None
+        for index, line in enumerate(self._lines):
+            stripped = line.strip()
+            if not stripped:
+                continue
+            key = stripped.split(':')[0].strip() if ':' in stripped else stripped.split()[0]
+            if stripped.startswith('EDGE COSTS'):
+                current = 'EDGE COSTS'
+                self._sections[current] = index + 1
+            elif key.endswith('_SECTION'):
+                current = key
+                self._sections[current] = index + 1
+            elif current is None and ':' in stripped:
+                self.header[key] = stripped.split(':', 1)[1].strip()
+            elif key == 'EOF':
+                current = None
+
+    def _section_tokens(self, section):
+        start = self._sections[section]
+        tokens = []
+        for line in self._lines[start:]:
+            stripped = line.strip()
+            if stripped.startswith(SECTION_ENDS) or stripped.startswith('EDGE COSTS'):
+                break
+            tokens.extend(stripped.split())
+        return tokens
+
+    def _section_rows(self, section, count=None):
+        start = self._sections[section]
+        end = start + count if count is not None else len(self._lines)
+        rows = []
+        for line in self._lines[start:end]:
+            stripped = line.strip()
+            if stripped == 'EOF' or stripped.startswith('EDGE COSTS'):
+                break
+            if stripped:
+                rows.append(stripped.split())
+        return rows
+
+    def _parse_vertices(self):
+        if self.edge_weight_type == 'EXPLICIT':
+            self.vertices = np.arange(self.dimension, dtype=np.int64)
+            self.coords = np.zeros((self.dimension, 2))
+            self.depot = 0
+            return
+
+        if 'NODE_COORD_SECTION' not in self._sections:
+            raise InstanceException(f'NODE_COORD_SECTION missing in {self.file_path}')
+        rows = np.array(self._section_rows('NODE_COORD_SECTION', self.dimension), dtype=float)
+        vertices = rows[:, 0].astype(np.int64)
+        coords = rows[:, 1:3]
+
+        depot = None
+        if self.edge_weight_type == 'EUC_2D' and 'DEPOT_SECTION' in self._sections:
+            values = [int(token) for token in self._section_tokens('DEPOT_SECTION') if token != '-1']
+            depot = values[0] if values else None
+        if depot is None and 'DEPOT' not in self.header:
+            # the solver adds vertex 0 at the mean of the targets as depot
+            vertices = np.append(vertices, 0)
+            coords = np.vstack([coords, coords.mean(axis=0)])
+            depot = 0
+        elif depot is None:
+            depot = int(vertices[0])
+        self.vertices = vertices
+        self.coords = coords
+        self.depot = depot
+
+    def explicit_matrix(self):
+        """Full matrix of the EDGE_WEIGHT_SECTION of an EXPLICIT instance."""
+        n = self.dimension
+        fmt = self.header.get('EDGE_WEIGHT_FORMAT', '').split()[0]
+        values = np.array(self._section_tokens('EDGE_WEIGHT_SECTION'), dtype=float)
+        matrix = np.zeros((n, n))
+        # the index helpers walk a triangle row by row, the order of the file
+        if fmt == 'LOWER_DIAG_ROW':
+            rows, cols = np.tril_indices(n)
+        elif fmt == 'LOWER_ROW':
+            rows, cols = np.tril_indices(n, k=-1)
+        elif fmt == 'UPPER_ROW':
+            rows, cols = np.triu_indices(n, k=1)
+        else:
+            raise InstanceException(f'unknown edge weight format {fmt} in {self.file_path}')
+        matrix[rows, cols] = values[:len(rows)]
+        matrix[cols, rows] = values[:len(rows)]
+        return matrix
+
+    def given_matrix(self, use_sidecar: bool = True):
+        """Full matrix of a GIVEN instance, from the sidecar if present or the EDGE COSTS section."""
+        if use_sidecar:
+            matrix = read_sidecar(self.file_path, self.vertices)
+            if matrix is not None:
+                return matrix
+        if 'EDGE COSTS' not in self._sections:
+            self._read(full=True)
+        rows = np.array(self._section_rows('EDGE COSTS'), dtype=float)
+        i = self.rows(rows[:, 0].astype(np.int64))
+        j = self.rows(rows[:, 1].astype(np.int64))
+        matrix = np.zeros((self.num_vertices, self.num_vertices))
+        matrix[i, j] = rows[:, 2]
+        matrix[j, i] = rows[:, 2]
+        return matrix
+
+    def euclidean_matrix(self):
+        diff = self.coords[:, None, :] - self.coords[None, :, :]
+        return np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+
+    def compute_distances(self):
+        """Distance matrix rounded like InstanceDto.getEdgeLength (ties to even)."""
+        if self.edge_weight_type == 'EXPLICIT':
+            matrix = self.explicit_matrix()
+        elif self.edge_weight_type == 'GIVEN':
+            matrix = self.given_matrix()
+        else:
+            matrix = self.euclidean_matrix()
+        return np.rint(matrix)
+
+
+def read_instance(file_path: str) -> Instance:
+    """Parse header, vertices and coordinates of an instance file."""
+    if not os.path.isfile(file_path):
+        raise InstanceException(f'instance file {file_path} does not exist')
+    instance = Instance(file_path)
+    instance._read(full=not os.path.isfile(get_sidecar_path(file_path)))
+    instance._parse_vertices()
+    return instance
+
+
+def load_distance_matrix(instance: Instance, use_cache: bool = True, cache_path: str = None):
+    """
+    Return the distance matrix of an instance.
+
+    With use_cache the matrix is read memory-mapped from
+    <cache_path>/<sha1 of file>.npy, and computed and stored there first if
+    missing. Edits to an instance file change its hash, so stale matrices are
+    never picked up.
+    """
+    if not use_cache:
+        return instance.compute_distances()
+    cache_path = cache_path or get_cache_path(os.path.dirname(os.path.abspath(instance.file_path)))
+    npy_path = os.path.join(cache_path, f'{file_hash(instance.file_path)}.npy')
+    if not os.path.isfile(npy_path):
+        os.makedirs(cache_path, exist_ok=True)
+        matrix = instance.compute_distances()
+        tmp_path = f'{npy_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f_out:
+            np.save(f_out, matrix)
+        os.replace(tmp_path, npy_path)
+        log.debug(f'cached distance matrix of {instance.file_name} in {npy_path}')
+    return np.load(npy_path, mmap_mode='r')
+
+
+def load_instance(name: str, data_path: str = None, use_cache: bool = True) -> Instance:
+    """Read an instance of the data folder and attach its distance matrix."""
+    instance = read_instance(os.path.join(data_path or get_data_path(), name))
+    instance.distances(use_cache=use_cache)
+    return instance
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser(description="instance tools")
+    parser.add_argument('--sidecar', nargs='+', required=True,
+                        help='write the binary edge cost sidecar of these GIVEN instances')
+    parser.add_argument('-d', '--data', default=None, help='data folder (default: app/data)')
+    args = parser.parse_args()
+    for name in args.sidecar:
+        instance = read_instance(os.path.join(args.data or get_data_path(), name))
+        if instance.edge_weight_type != 'GIVEN':
+            log.error(f'{name} has no EDGE COSTS section, skipped')
+            continue
+        log.info(f'wrote {write_sidecar(instance.file_path, instance.vertices, instance.given_matrix(use_sidecar=False))}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Fairness indices of tour lengths, vectorized over rows, as in BranchAndCutSolver.getResult."""
+import numpy as np
+
+
+def sort_lengths(lengths):
+    """Tour lengths ordered by decreasing length, the vehicle order of the solver."""
+    return -np.sort(-np.abs(np.asarray(lengths, dtype=float)), axis=-1)
+
+
+def jain_index(lengths):
+    lengths = sort_lengths(lengths)
+    k = lengths.shape[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return lengths.sum(axis=-1) ** 2 / (lengths ** 2).sum(axis=-1) / k
+
+
+def gini_index(lengths):
+    lengths = sort_lengths(lengths)
+    k = lengths.shape[-1]
+    weights = k + 1.0 - 2.0 * np.arange(1, k + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (lengths * weights).sum(axis=-1) / lengths.sum(axis=-1) / (k - 1.0)
+
+
+def norm_index(lengths):
+    lengths = sort_lengths(lengths)
+    k = lengths.shape[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (lengths.sum(axis=-1) / np.sqrt((lengths ** 2).sum(axis=-1)) - 1.0) / (np.sqrt(k) - 1.0)
+
+
+def fairness_indices(lengths):
+    """
+    Jain, Gini and norm index of each row of tour lengths.
+
+    Args:
+        lengths: array of shape (..., num vehicles)
+
+    Returns:
+        Tuple of three arrays (jain, gini, norm) with one value per row
+    """
+    return jain_index(lengths), gini_index(lengths), norm_index(lengths)
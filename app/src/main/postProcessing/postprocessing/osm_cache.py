@@ -0,0 +1,103 @@
+"""
+Local cache of OpenStreetMap road graphs.
+
+Graphs downloaded with osmnx.graph_from_bbox are pickled to
+app/data/.cache/osm/<key>.pkl, where the key is derived from the bbox, the
+network type and the simplify flag. Later runs, e.g. on compute nodes
+without internet access, load the pickle instead of downloading and
+simplifying the graph again. Copy the cache folder along with app/data to
+regenerate instances or plots offline.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+
+log = logging.getLogger(__name__)
+
+
+class GraphCacheException(Exception):
+    """Custom exception class with message for this module."""
+
+    def __init__(self, value):
+        self.value = value
+        super().__init__(value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+def get_graph_cache_path(data_path: str = None) -> str:
+    # instance imports numpy, plot_seattle imports this module before parsing --help
+    from postprocessing.instance import get_cache_path
+
+    return os.path.join(get_cache_path(data_path), 'osm')
+
+
+def graph_key(bbox, network_type: str = 'drive', simplify: bool = True) -> str:
+    """Cache key of a graph; the bbox is rounded to 1e-7 degrees (about 1 cm)."""
+    settings = {'bbox': [round(float(v), 7) for v in bbox], 'network_type': network_type, 'simplify': bool(simplify)}
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_graph(bbox, network_type: str = 'drive', simplify: bool = True, cache_path: str = None,
+               offline: bool = False, refresh: bool = False):
+    """
+    Return the road graph of a bbox (north, south, east, west) as given by osmnx.
+
+    Args:
+        cache_path: folder of the pickles (default: app/data/.cache/osm)
+        offline: raise instead of downloading when the graph is not cached
+        refresh: download again and overwrite the cached graph
+    """
+    cache_path = cache_path or get_graph_cache_path()
+    pkl_path = os.path.join(cache_path, f'{graph_key(bbox, network_type, simplify)}.pkl')
+    if os.path.isfile(pkl_path) and not refresh:
+        log.info(f'loading road graph from {pkl_path}')
+        with open(pkl_path, 'rb') as fin:
+            return pickle.load(fin)
+    if offline:
+        raise GraphCacheException(f'road graph of bbox {bbox} ({network_type}, simplify={simplify}) '
+                                  f'is not cached in {cache_path}')
+
+    # osmnx is slow to import and only needed to download
+    import osmnx as ox
+
+    log.info(f'downloading road graph of bbox {bbox}')
+    graph = ox.graph_from_bbox(bbox=bbox, network_type=network_type, simplify=simplify)
+    os.makedirs(cache_path, exist_ok=True)
+    tmp_path = f'{pkl_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f_out:
+        pickle.dump(graph, f_out, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, pkl_path)
+    with open(f'{pkl_path[:-4]}.json', 'w') as f_out:
+        json.dump({'bbox': list(bbox), 'network_type': network_type, 'simplify': simplify,
+                   'osmnx': ox.__version__, 'nodes': graph.number_of_nodes(), 'edges': graph.number_of_edges()},
+                  f_out, indent=1)
+    log.info(f'cached road graph in {pkl_path}')
+    return graph
+
+
+def place_bbox(place: str, cache_path: str = None, offline: bool = False):
+    """bbox (north, south, east, west) of a place name, geocoded once and kept in places.json."""
+    cache_path = cache_path or get_graph_cache_path()
+    places_path = os.path.join(cache_path, 'places.json')
+    places = {}
+    if os.path.isfile(places_path):
+        with open(places_path, 'r') as fin:
+            places = json.load(fin)
+    if place in places:
+        return tuple(places[place])
+    if offline:
+        raise GraphCacheException(f'place {place} is not cached in {places_path}')
+
+    import osmnx as ox
+
+    west, south, east, north = ox.geocode_to_gdf(place).total_bounds
+    places[place] = [float(north), float(south), float(east), float(west)]
+    os.makedirs(cache_path, exist_ok=True)
+    with open(places_path, 'w') as f_out:
+        json.dump(places, f_out, indent=1)
+    log.info(f'geocoded {place} to bbox {places[place]}')
+    return tuple(places[place])
@@ -0,0 +1,220 @@
+"""
+Pareto fronts, cost of fairness and hypervolume of the fairness sweeps.
+
+All eps-fair and delta-fair runs of the results database are read with one
+query per vehicle table and grouped by (instance, vehicles). For every
+group the trade-off between the sum of tour lengths and the achieved
+fairness index (norm index for eps-fair, 1 - Gini index for delta-fair) is
+evaluated with array operations:
+
+- the non-dominated points (lower cost and higher fairness are better),
+- the cost of fairness COF = (cost - min cost) / min cost,
+- the hypervolume dominated by the front in the (fairness, COF) plane,
+  w.r.t. the reference point (fairness 0, COF of the min-max solution), so
+  that the eps-fair and delta-fair fronts of a group are comparable.
+
+    python -m postprocessing.pareto -db results/store.db -r round-2
+"""
+import argparse
+import csv
+import logging
+import os
+
+import numpy as np
+
+from postprocessing import profiling, store
+
+log = logging.getLogger(__name__)
+
+FAIR_OBJECTIVES = ['eps-fair', 'delta-fair']
+FRONT_FILE = 'paretoFront_all.csv'
+SUMMARY_FILE = 'paretoSummary_all.csv'
+FRONT_FIELDS = ['instanceName', 'numVehicles', 'objective', 'fairnessCoefficient', 'cost', 'COF',
+                'fairnessIndex', 'gapToOpt', 'paretoOptimal']
+SUMMARY_FIELDS = ['instanceName', 'numVehicles', 'minCost', 'minmaxCost', 'minmaxCOF', 'minmaxFairness',
+                  'epsFrontSize', 'epsHypervolume', 'deltaFrontSize', 'deltaHypervolume']
+
+
+def get_base_path():
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../../..'))
+
+
+def load_sweeps(db_path, round_name=None):
+    """
+    Read the min, min-max and fairness runs with p = 1 of all vehicle tables (of a round of the store).
+
+    Returns:
+        Dictionary {(instance, vehicles): {objective: structured array}} with
+        fields fc, cost, norm, gini, gap sorted by fairness coefficient
+    """
+    connection = store.connect(db_path, round_name)
+    profiling.trace_queries(connection)
+    cursor = connection.cursor()
+    tables = store.vehicle_tables(connection)
+    rows = []
+    for table in tables:
+        cursor.execute(f"""
+            SELECT instanceName, numVehicles, objective, fairnessCoefficient, SumOfTours, normIndex, GiniIndex, GapToOpt
+            FROM {table}
+            WHERE objective IN ('min', 'min-max', 'eps-fair', 'delta-fair') AND pNorm = '1'
+            """)
+        rows.extend(cursor.fetchall())
+    cursor.close()
+    connection.close()
+
+    dtype = [('fc', float), ('cost', float), ('norm', float), ('gini', float), ('gap', float)]
+    groups = {}
+    for instance_name, vehicles, objective, *values in rows:
+        groups.setdefault((instance_name, int(vehicles)), {}).setdefault(objective, []).append(
+            tuple(float(v) for v in values))
+    sweeps = {}
+    for key, objectives in groups.items():
+        sweeps[key] = {}
+        for objective, values in objectives.items():
+            data = np.array(values, dtype=dtype)
+            sweeps[key][objective] = np.sort(data, order='fc')
+    return sweeps
+
+
+def fairness_of(objective, data):
+    """Achieved fairness in [0, 1], higher is fairer: norm index or 1 - Gini index."""
+    return data['norm'] if objective == 'eps-fair' else 1.0 - data['gini']
+
+
+def pareto_mask(cost, fairness):
+    """
+    Non-dominated points when minimizing cost and maximizing fairness.
+
+    A point is dominated if another point is at least as good in both and
+    strictly better in one; duplicates of a non-dominated point are kept.
+    """
+    cost = np.asarray(cost, dtype=float)
+    fairness = np.asarray(fairness, dtype=float)
+    no_worse = (cost[None, :] <= cost[:, None]) & (fairness[None, :] >= fairness[:, None])
+    better = (cost[None, :] < cost[:, None]) | (fairness[None, :] > fairness[:, None])
+    return ~np.any(no_worse & better, axis=1)
+
+
+def hypervolume(cof, fairness, reference_cof):
+    """Area dominated by the points in the (fairness, COF) plane up to (0, reference_cof)."""
+    cof = np.asarray(cof, dtype=float)
+    fairness = np.asarray(fairness, dtype=float)
+    mask = pareto_mask(cof, fairness) & (cof <= reference_cof) & (fairness >= 0.0)
+    if not np.any(mask):
+        return 0.0
+    order = np.argsort(-fairness[mask], kind='stable')
+    x, y = fairness[mask][order], cof[mask][order]
+    # the front sorted by decreasing fairness has decreasing COF; each point adds a slab
+    # between its fairness and the fairness of the next point
+    widths = x - np.append(x[1:], 0.0)
+    return float(np.sum(widths * (reference_cof - y)))
+
+
+def analyse_group(key, objectives):
+    """Front rows and summary row of one (instance, vehicles) group."""
+    instance_name, vehicles = key
+    if 'min' not in objectives:
+        log.warning(f'no min run for {instance_name} with {vehicles} vehicles, skipped')
+        return [], None
+    min_cost = float(objectives['min']['cost'].min())
+    minmax = objectives.get('min-max')
+    minmax_cost = float(minmax['cost'][0]) if minmax is not None else np.nan
+    minmax_cof = (minmax_cost - min_cost) / min_cost
+
+    if np.isnan(minmax_cof):
+        # without a min-max run, fall back to the largest COF of a fair front
+        candidates = [(data['cost'][pareto_mask(data['cost'], fairness_of(objective, data))].max() - min_cost) / min_cost
+                      for objective, data in objectives.items() if objective in FAIR_OBJECTIVES]
+        reference_cof = max(candidates, default=0.0)
+    else:
+        reference_cof = minmax_cof
+    summary = {'instanceName': instance_name, 'numVehicles': vehicles, 'minCost': min_cost,
+               'minmaxCost': minmax_cost, 'minmaxCOF': round(minmax_cof, 4),
+               'minmaxFairness': float(minmax['norm'][0]) if minmax is not None else np.nan}
+    rows = []
+    for objective in FAIR_OBJECTIVES:
+        prefix = objective.split('-')[0]
+        data = objectives.get(objective)
+        if data is None:
+            summary[f'{prefix}FrontSize'] = 0
+            summary[f'{prefix}Hypervolume'] = np.nan
+            continue
+        cof = (data['cost'] - min_cost) / min_cost
+        fairness = fairness_of(objective, data)
+        mask = pareto_mask(data['cost'], fairness)
+        summary[f'{prefix}FrontSize'] = int(mask.sum())
+        summary[f'{prefix}Hypervolume'] = round(hypervolume(cof, fairness, reference_cof), 6)
+        rows.extend({'instanceName': instance_name, 'numVehicles': vehicles, 'objective': objective,
+                     'fairnessCoefficient': fc, 'cost': cost, 'COF': round(c, 4), 'fairnessIndex': round(f, 6),
+                     'gapToOpt': gap, 'paretoOptimal': int(m)}
+                    for fc, cost, c, f, gap, m in zip(data['fc'].tolist(), data['cost'].tolist(), cof.tolist(),
+                                                      fairness.tolist(), data['gap'].tolist(), mask.tolist()))
+    return rows, summary
+
+
+def export_pareto_data(db_path, results_path, round_name=None):
+    """Write the fronts and the per-group summary of all instances in one pass."""
+    with profiling.stage('query'):
+        sweeps = load_sweeps(db_path, round_name)
+    front_rows, summary_rows = [], []
+    with profiling.stage('analyse'):
+        for key in sorted(sweeps):
+            rows, summary = analyse_group(key, sweeps[key])
+            front_rows.extend(rows)
+            if summary is not None:
+                summary_rows.append(summary)
+
+    front_path = os.path.join(results_path, FRONT_FILE)
+    with open(front_path, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=FRONT_FIELDS)
+        writer.writeheader()
+        writer.writerows(front_rows)
+    summary_path = os.path.join(results_path, SUMMARY_FILE)
+    with open(summary_path, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(summary_rows)
+    log.info(f'wrote {len(front_rows)} front points of {len(summary_rows)} instance/vehicle pairs '
+             f'to {front_path} and {summary_path}')
+    return front_path, summary_path
+
+
+def read_pareto_data(results_path):
+    """
+    Read the exported fronts and summary back, grouped for plotting.
+
+    Returns:
+        Dictionary {(instance, vehicles): {'summary': row, objective: list of rows}}
+    """
+    cases = {}
+    with open(os.path.join(results_path, SUMMARY_FILE), 'r') as fin:
+        for row in csv.DictReader(fin):
+            cases[(row['instanceName'], int(row['numVehicles']))] = {'summary': row}
+    with open(os.path.join(results_path, FRONT_FILE), 'r') as fin:
+        for row in csv.DictReader(fin):
+            case = cases.get((row['instanceName'], int(row['numVehicles'])))
+            if case is not None:
+                case.setdefault(row['objective'], []).append(row)
+    return cases
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.INFO)
+    results_path = os.path.join(get_base_path(), 'results', 'round-2')
+    parser = argparse.ArgumentParser(description="Pareto fronts, COF and hypervolume of all fairness sweeps")
+    parser.add_argument('-db', '--database', default=store.default_database(),
+                        help='results store or per-round results database')
+    parser.add_argument('-r', '--round', default=None, help='round of the store (default: latest run of every case)')
+    parser.add_argument('-o', '--output', default=results_path, help='folder for the CSV files')
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args, 'pareto')
+    try:
+        export_pareto_data(args.database, args.output, args.round)
+    except store.StoreException as se:
+        log.error(se)
+
+
+if __name__ == '__main__':
+    main()
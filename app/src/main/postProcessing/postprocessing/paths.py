@@ -0,0 +1,81 @@
+"""
+Street geometry of road network instances.
+
+The generators store the shortest path between every pair of terminals
+(depot and targets) next to the instance as <name>.paths.npz with
+
+- terminals: vertex ids of the .tsp, i.e. node labels of the relabeled road graph,
+- offsets: start of the path of terminal pair p in nodes, for the pairs i < j
+  in row-major upper-triangle order, plus the end of the last path,
+- nodes: the concatenated node sequences, from terminal i to terminal j.
+
+A tour is expanded into its node sequence by table lookup, without the road
+graph or any shortest path search.
+"""
+import os
+
+import numpy as np
+
+
+def get_paths_file(tsp_path: str) -> str:
+    return f'{os.path.splitext(tsp_path)[0]}.paths.npz'
+
+
+def pair_index(i, j, n):
+    """Position of the terminal pair (i, j), i < j, in row-major upper-triangle order."""
+    i, j = np.asarray(i), np.asarray(j)
+    return i * n - i * (i + 1) // 2 + (j - i - 1)
+
+
+def save_paths(file_path: str, terminals, paths: dict):
+    """
+    Pack and write the paths of all terminal pairs.
+
+    Args:
+        terminals: vertex ids in the order of the instance file
+        paths: {(i, j): node sequence} for all rows i < j of terminals
+    """
+    n = len(terminals)
+    rows, cols = np.triu_indices(n, k=1)
+    sequences = [np.asarray(paths[(i, j)], dtype=np.int32) for i, j in zip(rows.tolist(), cols.tolist())]
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(s) for s in sequences])
+    tmp_path = f'{file_path}.{os.getpid()}.tmp.npz'
+    np.savez_compressed(tmp_path, terminals=np.asarray(terminals, dtype=np.int64), offsets=offsets,
+                        nodes=np.concatenate(sequences) if sequences else np.zeros(0, dtype=np.int32))
+    os.replace(tmp_path, file_path)
+
+
+class PathTable:
+    """Shortest paths between terminals, looked up by vertex id."""
+
+    def __init__(self, terminals, offsets, nodes):
+        self.terminals = terminals
+        self.offsets = offsets
+        self.nodes = nodes
+        self._row = {int(t): row for row, t in enumerate(terminals.tolist())}
+
+    def leg(self, source, target):
+        """Node sequence from source to target, both included."""
+        i, j = self._row[int(source)], self._row[int(target)]
+        if i == j:
+            return np.array([source], dtype=self.nodes.dtype)
+        p = pair_index(min(i, j), max(i, j), len(self.terminals))
+        sequence = self.nodes[self.offsets[p]:self.offsets[p + 1]]
+        return sequence if i < j else sequence[::-1]
+
+    def expand(self, tour):
+        """Node sequence of a closed tour given by vertex ids, consecutive legs joined."""
+        if len(tour) < 2:
+            return [int(v) for v in tour]
+        legs = [self.leg(s, t)[:-1] for s, t in zip(tour[:-1], tour[1:])]
+        return np.concatenate(legs + [np.array([tour[-1]])]).tolist()
+
+
+def load_paths(tsp_path: str):
+    """PathTable of an instance, None if the generator did not store paths for it."""
+    file_path = get_paths_file(tsp_path)
+    if not os.path.isfile(file_path):
+        return None
+    with np.load(file_path) as data:
+        return PathTable(data['terminals'], data['offsets'], data['nodes'])
@@ -1,11 +1,15 @@
 import csv, os
-import matplotlib
-import matplotlib.pyplot as plt
-import argparse, logging, subprocess
+import argparse, logging
+from concurrent.futures import ProcessPoolExecutor
+
+from postprocessing import profiling
+from postprocessing.figure_cache import FigureCache, figure_digest, save_figure
 
 
 log = logging.getLogger(__name__)
 
+# matplotlib is imported where it is used, so that --help starts fast
+
 class PlotException(Exception):
     """Custom exception class with message for this module."""
 
@@ -25,13 +29,115 @@ def handle_command_line():
     parser.add_argument('-g', '--plotgrid', action='store_true',
                         help='generate the grid plot')
     parser.add_argument('-c', '--pdfcrop', action='store_true', 
-                        help='crop figures after generating them')
+                        help='crop figures to the bounding box of their content')
     parser.add_argument('-o', '--option', choices=['all', 'COF', 'paretoFront'],
                         help='plot all/COF/paretoFront')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='plot the curves of every instance from paretoFront_all.csv')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of worker processes of the batch mode')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild all figures, even if their inputs did not change')
+    profiling.add_arguments(parser)
     config = parser.parse_args()
     return config
 
 
+def rc_params(target):
+    if target == 'paper':
+        return {
+            'text.usetex': True,
+            'font.family': 'serif',
+            'text.latex.preamble': r'\usepackage[scaled=0.9]{newpxtext}\usepackage[scaled=0.9]{newpxmath}\usepackage{bm}',
+            'font.size' : 10,
+            'pgf.rcfonts': False,
+            }
+    else: 
+        return {
+            'text.usetex': True,
+            'font.family': 'sans-serif',
+            'text.latex.preamble': r'\usepackage{sourcesanspro,eulervm}',
+            'font.size' : 11,
+            'pgf.rcfonts': False,
+            }
+
+
+def set_rc_params(target):
+    import matplotlib
+    matplotlib.rcParams.update(rc_params(target))
+
+
+def _init_worker(target, profile=False):
+    import matplotlib
+    matplotlib.use('Agg')
+    set_rc_params(target)
+    profiling.enable(profile)
+
+
+def case_name(case):
+    summary = case['summary']
+    return f"{summary['instanceName'].split('.')[0]}-v-{summary['numVehicles']}"
+
+
+def plot_case(target, case, out_path, crop, profile=False):
+    """
+    COF and Pareto-front figure of one instance and vehicle count, run in a worker process.
+
+    Returns:
+        Tuple (case name, profiling stats of the worker)
+    """
+    import matplotlib
+    import matplotlib.pyplot as plt
+    matplotlib.use('Agg')
+    set_rc_params(target)
+    profiling.enable(profile)
+    summary = case['summary']
+    name = case_name(case)
+    minmax_cof = float(summary['minmaxCOF'])
+    styles = {'eps-fair': ('xkcd:green', '-', r'$\mathcal{F}^{\varepsilon}$'),
+              'delta-fair': ('xkcd:rose', 'dashdot', r'$\mathcal{F}^{\Delta}$')}
+    with profiling.stage('render'):
+        fig, ax = plt.subplots()
+        fig.set_size_inches(3, 3)
+        ax.grid(alpha=0.1)
+        for objective, (color, linestyle, label) in styles.items():
+            rows = case.get(objective, [])
+            ax.plot([float(r['fairnessCoefficient']) for r in rows], [float(r['COF']) for r in rows], color=color,
+                    linestyle=linestyle, marker='.', markersize=1.8, linewidth=1, label=f'COF({label})')
+        ax.axhline(y=minmax_cof, color='xkcd:orange', linestyle='--', linewidth=1, label=r'COF$(\mathcal{F}_{\infty})$')
+        ax.set_xlabel(r'$\varepsilon, \Delta$')
+        ax.set_ylabel('Cost of Fairness')
+        ax.legend(loc='best', frameon=False, fontsize=9)
+        fig.tight_layout()
+    save_figure(fig, os.path.join(out_path, f'{name}-COF'), crop)
+    plt.close(fig)
+
+    with profiling.stage('render'):
+        fig, ax = plt.subplots()
+        fig.set_size_inches(4, 3)
+        ax.grid(alpha=0.1)
+        for objective, (color, linestyle, label) in styles.items():
+            rows = sorted((r for r in case.get(objective, []) if r['paretoOptimal'] == '1'),
+                          key=lambda r: float(r['fairnessIndex']))
+            dominated = [r for r in case.get(objective, []) if r['paretoOptimal'] != '1']
+            ax.plot([float(r['fairnessIndex']) for r in rows], [float(r['cost']) for r in rows], color=color,
+                    linestyle=linestyle, marker='.', markersize=1.8, linewidth=1, label=label)
+            ax.plot([float(r['fairnessIndex']) for r in dominated], [float(r['cost']) for r in dominated],
+                    color=color, linestyle='none', marker='x', markersize=2.5)
+        ax.axhline(y=float(summary['minmaxCost']), color='xkcd:orange', linestyle=':', linewidth=1,
+                   label=r'$(\mathcal{F}_{\infty})$')
+        ax.axhline(y=float(summary['minCost']), color='xkcd:bright red', linestyle='--', linewidth=1,
+                   label=r'$(\mathcal{F}_1)$')
+        ax.set_xlabel(r'$\varepsilon\mathrm{FI}(\bm l), 1 - \mathrm{GC}(\bm l)$' if target == 'paper'
+                      else r'$\varepsilon$FI, 1 - GC')
+        ax.set_ylabel('sum of tour lengths')
+        ax.legend(loc='best', frameon=False, fontsize=9)
+        fig.tight_layout()
+    save_figure(fig, os.path.join(out_path, f'{name}-paretoFront'), crop)
+    plt.close(fig)
+    return name, profiling.collect()
+
+
 class Controller: 
     """class that manages the functionality of the entire plotting script"""
     
@@ -58,40 +164,74 @@ class Controller:
     def get_data_file_path(basepath):
         return os.path.join(basepath, 'results', 'COF_plotdata.csv')
     
-    @staticmethod 
-    def crop(file): 
-        log.info(f'cropping figure {file}')
-        subprocess.run(['pdfcrop', f'{file}.pdf'])
-        subprocess.run(['rm', '-rf', f'{file}.pdf'])
-        subprocess.run(['mv', f'{file}-crop.pdf', f'{file}.pdf'])
-        log.info(f'cropping figure {file} complete')
-    
     def _set_rc_params(self):
-        if self.config.target == 'paper':
-            matplotlib.rcParams.update({
-                'text.usetex': True,
-                'font.family': 'serif',
-                'text.latex.preamble': r'\usepackage[scaled=0.9]{newpxtext}\usepackage[scaled=0.9]{newpxmath}\usepackage{bm}',
-                'font.size' : 10,
-                'pgf.rcfonts': False,
-                })
-        else: 
-            matplotlib.rcParams.update({
-                'text.usetex': True,
-                'font.family': 'sans-serif',
-                'text.latex.preamble': r'\usepackage{sourcesanspro,eulervm}',
-                'font.size' : 11,
-                'pgf.rcfonts': False,
-                })
+        set_rc_params(self.config.target)
 
     def plot(self):
-        if self.config.option == 'COF':
-            self.plot_cof()
-        elif self.config.option == 'paretoFront':
-            self.plot_pareto_front()
-        else:    
-            self.plot_cof()
-            self.plot_pareto_front()
+        if self.config.batch:
+            self.plot_batch()
+            return
+        base_path = self.get_base_path()
+        figures = {
+            'COF': (self.plot_cof, self.get_data_file_path(base_path)),
+            'paretoFront': (self.plot_pareto_front, os.path.join(base_path, 'results', 'ParetoFront_plotdata.csv')),
+        }
+        names = [self.config.option] if self.config.option in figures else list(figures)
+        out_path = f'../plots/{self.config.target}'
+        cache = FigureCache(out_path, self.config.force)
+        stale = {}
+        for name in names:
+            plot_function, data_file = figures[name]
+            digest = figure_digest(self.config.target, rc_params(self.config.target), [data_file, __file__])
+            if cache.is_current(name, digest, [os.path.join(out_path, f'{name}.pdf')]):
+                log.info(f'figure {name} is up to date')
+                continue
+            stale[name] = (plot_function, digest)
+        with ProcessPoolExecutor(max_workers=self.config.workers, initializer=_init_worker,
+                                 initargs=(self.config.target, profiling.is_enabled())) as executor:
+            futures = {name: executor.submit(plot_function) for name, (plot_function, _) in stale.items()}
+            for name, future in futures.items():
+                profiling.merge(future.result())
+                cache.record(name, stale[name][1])
+                log.info(f'plotted {name}')
+        cache.save()
+
+    def plot_batch(self):
+        """Render the COF and Pareto-front figures of all instances in parallel."""
+        # pareto imports numpy
+        from postprocessing.pareto import read_pareto_data
+
+        results_path = os.path.join(self.get_base_path(), 'results', 'round-2')
+        try:
+            with profiling.stage('read'):
+                cases = read_pareto_data(results_path)
+        except FileNotFoundError:
+            raise PlotException(f'no Pareto data in {results_path}, run "python queries.py -t ParetoAll" first')
+        out_path = f'../plots/{self.config.target}/pareto'
+        os.makedirs(out_path, exist_ok=True)
+        cache = FigureCache(out_path, self.config.force)
+        stale = {}
+        for _, case in sorted(cases.items()):
+            name = case_name(case)
+            digest = figure_digest(self.config.target, rc_params(self.config.target), [__file__],
+                                   {'case': case, 'crop': self.config.pdfcrop})
+            outputs = [os.path.join(out_path, f'{name}-{kind}.pdf') for kind in ['COF', 'paretoFront']]
+            if not cache.is_current(name, digest, outputs):
+                stale[name] = (case, digest)
+        log.info(f'plotting {len(stale)} of {len(cases)} instance/vehicle pairs to {out_path}, '
+                 f'the others are up to date')
+        try:
+            with ProcessPoolExecutor(max_workers=self.config.workers) as executor:
+                futures = {name: executor.submit(plot_case, self.config.target, case, out_path, self.config.pdfcrop,
+                                                 profiling.is_enabled())
+                           for name, (case, _) in stale.items()}
+                for name, future in futures.items():
+                    _, stats = future.result()
+                    profiling.merge(stats)
+                    cache.record(name, stale[name][1])
+                    log.info(f'plotted {name}')
+        finally:
+            cache.save()
 
     def get_cof_data(self):
         COF_filepath = self.get_data_file_path(self.get_base_path())
@@ -116,35 +256,38 @@ class Controller:
         return fairness_coefficient, eps_cof, delta_cof, minmax_cof
         
     def plot_cof(self):
-        fairness_coefficient, eps_cof, delta_cof, minmax_cof = self.get_cof_data()
-        fig, ax = plt.subplots()
-        params = self.get_plot_params(self.config.target)
-        fs=params['fig_size']
-        fig.set_size_inches(fs[0], fs[1])
-        fig.set_size_inches(3,3)
-        ax.grid(alpha=0.1)
-        ax.grid(alpha=0.1)
-        ax.plot(fairness_coefficient, eps_cof, color = 'xkcd:green', 
-                linestyle='-', marker = '.', markersize = 1.8, linewidth = 1, 
-                label=r'COF$(\mathcal{F}^{\varepsilon})$')
-        ax.plot(fairness_coefficient, delta_cof, color = 'xkcd:rose', 
-                linestyle='dashdot', marker = '.', markersize = 1.8, linewidth = 1, 
-                label=r'COF$(\mathcal{F}^{\Delta})$')
-
-        # Plot the constant line for minmax_cof
-        ax.axhline(y=minmax_cof, color='xkcd:orange', linestyle='--', linewidth = 1, label=r'COF$(\mathcal{F}_{\infty})$')
-
-        plt.xlabel(r'$\varepsilon, \Delta$')
-        plt.ylabel('Cost of Fairness')
-        if self.config.target == 'presentation':
-            plt.legend(loc='best', frameon=False, bbox_to_anchor=(0.55, 0.9))
-        else:
-            plt.legend(loc='best', frameon=False, fontsize=9, bbox_to_anchor=(0.55, 0.5))
-        plt.tight_layout()       
-        plt.grid(True)
-        filename = f'../plots/{self.config.target}/COF'
-        plt.savefig(f'{filename}.pdf', format='pdf')
-        self.crop(filename)
+        import matplotlib.pyplot as plt
+        with profiling.stage('read'):
+            fairness_coefficient, eps_cof, delta_cof, minmax_cof = self.get_cof_data()
+        with profiling.stage('render'):
+            fig, ax = plt.subplots()
+            params = self.get_plot_params(self.config.target)
+            fs=params['fig_size']
+            fig.set_size_inches(fs[0], fs[1])
+            fig.set_size_inches(3,3)
+            ax.grid(alpha=0.1)
+            ax.grid(alpha=0.1)
+            ax.plot(fairness_coefficient, eps_cof, color = 'xkcd:green', 
+                    linestyle='-', marker = '.', markersize = 1.8, linewidth = 1, 
+                    label=r'COF$(\mathcal{F}^{\varepsilon})$')
+            ax.plot(fairness_coefficient, delta_cof, color = 'xkcd:rose', 
+                    linestyle='dashdot', marker = '.', markersize = 1.8, linewidth = 1, 
+                    label=r'COF$(\mathcal{F}^{\Delta})$')
+
+            # Plot the constant line for minmax_cof
+            ax.axhline(y=minmax_cof, color='xkcd:orange', linestyle='--', linewidth = 1, label=r'COF$(\mathcal{F}_{\infty})$')
+
+            plt.xlabel(r'$\varepsilon, \Delta$')
+            plt.ylabel('Cost of Fairness')
+            if self.config.target == 'presentation':
+                plt.legend(loc='best', frameon=False, bbox_to_anchor=(0.55, 0.9))
+            else:
+                plt.legend(loc='best', frameon=False, fontsize=9, bbox_to_anchor=(0.55, 0.5))
+            plt.tight_layout()       
+            plt.grid(True)
+        save_figure(fig, f'../plots/{self.config.target}/COF', crop=True)
+        plt.close(fig)
+        return profiling.collect()
     
     def get_pareto_front_data(self):
         pareto_front_filepath = os.path.join(self.get_base_path(), 'results', 'ParetoFront_plotdata.csv') 
@@ -174,35 +317,38 @@ class Controller:
         return fairness_coefficient, eps_cost, delta_cost, minmax_cost, min_cost
     
     def plot_pareto_front(self):
-        fairness_coefficient, eps_cost, delta_cost, minmax_cost, min_cost = self.get_pareto_front_data()
-        fig, ax = plt.subplots()
-        params = self.get_plot_params(self.config.target)
-        fs = params['fig_size']
-        fig.set_size_inches(fs[0], fs[1])
-        # fig.set_size_inches(6,4)
-        ax.grid(alpha=0.1)
-        ax.plot(fairness_coefficient, eps_cost, color = 'xkcd:green', 
-                linestyle='-', marker = '.', markersize = 1.8, linewidth = 1, 
-                label=r'$\left(\mathcal{F}^{\varepsilon}_{\mathrm{bi-obj}}\right)$')
-        ax.plot(fairness_coefficient, delta_cost, color = 'xkcd:rose', 
-                linestyle='dashdot', marker = '.', markersize = 1.8, linewidth = 1, 
-                label=r'$\left(\mathcal{F}^{\Delta}_{\mathrm{bi-obj}}\right)$')
-        # where = 'post')
-
-        # Plot the constant line for minmax_cof
-        ax.axhline(y=minmax_cost, color='xkcd:orange', linestyle=':', linewidth = 1, label=r'$(\mathcal{F}_{\infty})$')
-        ax.axhline(y=min_cost, color='xkcd:bright red', linestyle='--', linewidth = 1, label=r'$(\mathcal{F}_1)$')
-
-        plt.xlabel(r'$\varepsilon\mathrm{FI}(\bm l), \mathrm{GC}(\bm l)$', fontsize = 12)
-        plt.ylabel(r'$$\left(\sum_{1 \leqslant v \leqslant m} l_v\right)$$', fontsize = 12, rotation=0)
-        ax.yaxis.set_label_coords(-0.3, 0.4)
-        plt.legend(loc='upper center', bbox_to_anchor=(0.55, 0.99), frameon=False)
-        plt.tight_layout()       
-        plt.grid(True)
+        import matplotlib.pyplot as plt
+        with profiling.stage('read'):
+            fairness_coefficient, eps_cost, delta_cost, minmax_cost, min_cost = self.get_pareto_front_data()
+        with profiling.stage('render'):
+            fig, ax = plt.subplots()
+            params = self.get_plot_params(self.config.target)
+            fs = params['fig_size']
+            fig.set_size_inches(fs[0], fs[1])
+            # fig.set_size_inches(6,4)
+            ax.grid(alpha=0.1)
+            ax.plot(fairness_coefficient, eps_cost, color = 'xkcd:green', 
+                    linestyle='-', marker = '.', markersize = 1.8, linewidth = 1, 
+                    label=r'$\left(\mathcal{F}^{\varepsilon}_{\mathrm{bi-obj}}\right)$')
+            ax.plot(fairness_coefficient, delta_cost, color = 'xkcd:rose', 
+                    linestyle='dashdot', marker = '.', markersize = 1.8, linewidth = 1, 
+                    label=r'$\left(\mathcal{F}^{\Delta}_{\mathrm{bi-obj}}\right)$')
+            # where = 'post')
+
+            # Plot the constant line for minmax_cof
+            ax.axhline(y=minmax_cost, color='xkcd:orange', linestyle=':', linewidth = 1, label=r'$(\mathcal{F}_{\infty})$')
+            ax.axhline(y=min_cost, color='xkcd:bright red', linestyle='--', linewidth = 1, label=r'$(\mathcal{F}_1)$')
+
+            plt.xlabel(r'$\varepsilon\mathrm{FI}(\bm l), \mathrm{GC}(\bm l)$', fontsize = 12)
+            plt.ylabel(r'$$\left(\sum_{1 \leqslant v \leqslant m} l_v\right)$$', fontsize = 12, rotation=0)
+            ax.yaxis.set_label_coords(-0.3, 0.4)
+            plt.legend(loc='upper center', bbox_to_anchor=(0.55, 0.99), frameon=False)
+            plt.tight_layout()       
+            plt.grid(True)
         
-        filename = f'../plots/{self.config.target}/paretoFront'
-        plt.savefig(f'{filename}.pdf', format='pdf')
-        self.crop(filename)
+        save_figure(fig, f'../plots/{self.config.target}/paretoFront', crop=True)
+        plt.close(fig)
+        return profiling.collect()
 
 
 def main():
@@ -211,6 +357,7 @@ def main():
     
     try:
         config = handle_command_line()
+        profiling.setup(config, 'plot_pareto_COF')
         controller = Controller(config)
         controller._set_rc_params()
         controller.plot()
@@ -1,14 +1,22 @@
 import argparse 
-import osmnx as ox
-import matplotlib
-import matplotlib.pyplot as plt
-import networkx as nx
 import logging
-import subprocess
+import hashlib
 import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from postprocessing import archive, osm_cache, profiling
+from postprocessing.figure_cache import FigureCache, figure_digest, save_figure
 
 log = logging.getLogger(__name__)
 
+# numpy, matplotlib, networkx and the modules using them (render, paths, spatial, instance) are
+# imported where they are used, so that --help starts fast
+
+# network, terminals and plot settings shared by all figures, set once per worker by _init_scene
+_scene = None
+
 class PlotException(Exception):
     """Custom exception class with message for this module."""
 
@@ -29,10 +37,90 @@ def handle_command_line():
     parser.add_argument('-g', '--plotgrid', action='store_true',
                         help='generate the grid plot')
     parser.add_argument('-c', '--pdfcrop', action='store_true', 
-                        help='crop figures after generating them')
+                        help='crop figures to the bounding box of their content')
+    parser.add_argument('--offline', action='store_true',
+                        help='only use the cached road graph, never download')
+    parser.add_argument('--graphCache', default=None,
+                        help='folder of the cached road graphs (default: app/data/.cache/osm)')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of worker processes for the figures')
+    parser.add_argument('--rasterBase', action='store_true',
+                        help='render the street network once as an image under all figures')
+    parser.add_argument('--dpi', type=int, default=300,
+                        help='resolution of the rasterized street network')
+    profiling.add_arguments(parser)
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild all figures, even if their inputs did not change')
     config = parser.parse_args()
     return config
 
+
+def rc_params(target):
+    if target == 'paper':
+        return {
+            'text.usetex': True,
+            'font.family': 'serif',
+            'font.size' : 10,
+            'pgf.rcfonts': False,
+            }
+    else: 
+        return {
+            'text.usetex': True,
+            'font.family': 'sans-serif',
+            'text.latex.preamble': r'\usepackage{sourcesanspro,eulervm}',
+            'font.size' : 11,
+            'pgf.rcfonts': False,
+            }
+
+
+def set_rc_params(target):
+    import matplotlib
+    matplotlib.rcParams.update(rc_params(target))
+
+
+def _init_scene(scene):
+    global _scene
+    import matplotlib
+    matplotlib.use('Agg')
+    set_rc_params(scene['target'])
+    profiling.enable(scene['profile'])
+    _scene = scene
+
+
+def render_figure(spec):
+    """
+    Draw the network, terminals and routes of a figure spec and save it (worker process).
+
+    Returns:
+        Tuple (figure name, seconds to render and save it, profiling stats of the worker)
+    """
+    import matplotlib.pyplot as plt
+    from postprocessing.render import draw_base_image, draw_lines, draw_network
+
+    start = time.perf_counter()
+    params = _scene['params']
+    with profiling.stage('render'):
+        fig, ax = plt.subplots()
+        if _scene['base_image'] is not None:
+            draw_base_image(ax, *_scene['base_image'], params.get('bgcolor', 'white'))
+        else:
+            draw_network(ax, _scene['geometry'], params)
+        if spec['terminals']:
+            # Plot the depot and the targets with different colors
+            depot_x, depot_y = _scene['depot']
+            ax.scatter(depot_x, depot_y, c = 'red', s = params['scatter_s'], zorder = 5, alpha = spec['terminal_alpha'])
+            target_x, target_y = zip(*_scene['targets'])
+            ax.scatter(target_x, target_y, c = 'blue', s = params['scatter_s'], zorder = 5, alpha = spec['terminal_alpha'])
+        if spec['lines']:
+            colors = ['xkcd:green', 'xkcd:magenta', 'xkcd:orange red', 'xkcd:brown']
+            draw_lines(ax, spec['lines'], colors, params)
+        fig.set_tight_layout(True)
+        fs = params['fig_size']
+        fig.set_size_inches(fs[0], fs[1])
+    save_figure(fig, os.path.join(_scene['out_path'], spec['name']), _scene['crop'])
+    plt.close(fig)
+    return spec['name'], time.perf_counter() - start, profiling.collect()
+
 class Controller:
     """class that manages the functionality of the entire plotting script"""
 
@@ -42,6 +130,8 @@ class Controller:
         self.targets = None 
         self.depot = None
         self.coordinates = None
+        self.paths = None
+        self.geometry = None
         
     @staticmethod
     def get_plot_params(target):
@@ -76,14 +166,6 @@ class Controller:
                 'route_linewidth': 2.4
             }
 
-    @staticmethod 
-    def crop(file): 
-        log.info(f'cropping figure {file}')
-        subprocess.run(['pdfcrop', f'{file}.pdf'])
-        subprocess.run(['rm', '-rf', f'{file}.pdf'])
-        subprocess.run(['mv', f'{file}-crop.pdf', f'{file}.pdf'])
-        log.info(f'cropping figure {file} complete')
-        
     @staticmethod
     def get_fair_filename(num_vehicles, obj_type, fc): 
         return f'../../../../../results/seattle/seattle-v-{num_vehicles}-{obj_type}-p-2-fc-{fc}.json'
@@ -96,236 +178,165 @@ class Controller:
     def get_two_vehicle_filename():
         return f'../../../../../app/logs/seattle-v-2-eps-fair-p-2-fc-10.json'
         
-    def _set_rc_params(self):
-        if self.config.target == 'paper':
-            matplotlib.rcParams.update({
-                'text.usetex': True,
-                'font.family': 'serif',
-                'font.size' : 10,
-                'pgf.rcfonts': False,
-                })
-        else: 
-            matplotlib.rcParams.update({
-                'text.usetex': True,
-                'font.family': 'sans-serif',
-                'text.latex.preamble': r'\usepackage{sourcesanspro,eulervm}',
-                'font.size' : 11,
-                'pgf.rcfonts': False,
-                })
-    
     def _populate_graph(self):
+        import networkx as nx
+        from postprocessing.instance import get_data_path
+        from postprocessing.paths import load_paths
+        from postprocessing.render import RoadGeometry
+        from postprocessing.spatial import SpatialException, match_nodes
+
         bbox = {'Seattle': (47.619, 47.604, -122.320, -122.355)}
         city = 'Seattle'
-        G_ = ox.graph_from_bbox(bbox=bbox[city], network_type='drive', simplify=True).to_undirected()
-        if self.config.plotgrid == True: 
-            log.info('generating grid plot')
-            params = self.get_plot_params(self.config.target) 
-            fig, ax = plt.subplots()
-            ox.plot_graph(G_, ax = ax,
-                          node_color = params.get('node_color', 'black'), 
-                          edge_color = params.get('edge_color', 'gray'), 
-                          node_size = params.get('node_size', 1),
-                          bgcolor = params.get('bgcolor', 'white'),
-                          edge_linewidth = params.get('edge_linewidth', 1.0),
-                          node_alpha = params.get('node_alpha', 0.3), 
-                          edge_alpha = params.get('edge_alpha', 0.4),
-                          show = False
-                          )
-            fig.set_tight_layout(True)
-            fs = params['fig_size']
-            log.info(f'setting grid fig size: {fs} sq. inches')
-            fig.set_size_inches(fs[0], fs[1])
-            plt.savefig(f'../plots/{self.config.target}/seattle_network.pdf', format='pdf')
-            if self.config.pdfcrop == True:
-                self.crop(f'../plots/{self.config.target}/seattle_network')
+        try:
+            G_ = osm_cache.load_graph(bbox[city], network_type='drive', simplify=True,
+                                      cache_path=self.config.graphCache,
+                                      offline=self.config.offline).to_undirected()
+        except osm_cache.GraphCacheException as ge:
+            raise PlotException(ge.value)
         f = open('seattle.json')
         json_data = json.load(f)
         node_data = json_data['node_data']
         original_to_new_node = json_data['original_to_new_node_labels']
         f.close()
-        relabel_map = {}
-        for node, data in G_.nodes(data = True):
-            x, y = data['x'], data['y']
-            matched_node_data = tuple(filter(lambda it: it[1]['x'] == x and it[1]['y'] == y, node_data.items()))[0]
-            relabel_map[node] = original_to_new_node[matched_node_data[0]]
+        try:
+            relabel_map, num_snapped, unmatched = match_nodes(G_.nodes(data = True), original_to_new_node, node_data)
+        except SpatialException as se:
+            # relabel_nodes would merge the nodes of a label silently
+            raise PlotException(f'{se.value} in seattle.json; rerun create_seattle.py')
+        if num_snapped > 0:
+            log.warning(f'{num_snapped} graph nodes not found by OSM id or coordinates, snapped to the nearest node')
+        if len(unmatched) > 0:
+            raise PlotException(f'{len(unmatched)} graph nodes are not in seattle.json, e.g. {unmatched[:5]}; '
+                                'rerun create_seattle.py')
         self.G = nx.relabel_nodes(G_, relabel_map)
         self.coordinates = {node: [data['x'], data['y']] for node, data in self.G.nodes(data = True)}
+        self.geometry = RoadGeometry.from_graph(self.G)
         self.depot = json_data['depot_on_new_node_labels']
         self.targets = json_data['targets_on_new_node_labels']
+        self.paths = load_paths(os.path.join(get_data_path(), 'seattle.tsp'))
+        if self.paths is None:
+            log.warning('no stored terminal paths for seattle.tsp, tours are expanded with shortest path searches')
 
-        
-    def _plot_graph_with_targets(self): 
-        log.info('generating target plot')
-        params = self.get_plot_params(self.config.target)
-        fig, ax = plt.subplots() 
-        ox.plot_graph(self.G, ax = ax,
-                      node_color = params.get('node_color', 'black'), 
-                      edge_color = params.get('edge_color', 'gray'), 
-                      node_size = params.get('node_size', 1),
-                      bgcolor = params.get('bgcolor', 'white'),
-                      edge_linewidth = params.get('edge_linewidth', 1.0),
-                      node_alpha = params.get('node_alpha', 0.3), 
-                      edge_alpha = params.get('edge_alpha', 0.4),
-                      show = False)
-        # Plot the depot with a different color
-        depot_x, depot_y = self.coordinates[self.depot]
-        ax.scatter(depot_x, depot_y, 
-                   c = 'red', 
-                   s = params['scatter_s'], 
-                   zorder = 5, 
-                   alpha=0.8)
-        # Plot the targets with a different color
-        target_x, target_y = zip(*[self.coordinates[target] for target in self.targets])
-        ax.scatter(target_x, target_y, 
-                   c = 'blue', 
-                   s = params['scatter_s'], 
-                   zorder = 5, 
-                   alpha = 0.8)
-        fig.set_tight_layout(True)
-        fs = params['fig_size']
-        log.info(f'setting grid fig size: {fs} sq. inches')
-        fig.set_size_inches(fs[0], fs[1])
-        plt.savefig(f'../plots/{self.config.target}/seattle_graph.pdf', format='pdf')
-        if self.config.pdfcrop == True:
-            self.crop(f'../plots/{self.config.target}/seattle_graph')
-            
-    def _add_graph(self, axes):
-        params = self.get_plot_params(self.config.target) 
-        ox.plot_graph(self.G, ax = axes,
-                      node_color = params.get('node_color', 'black'), 
-                      edge_color = params.get('edge_color', 'gray'), 
-                      node_size = params.get('node_size', 1),
-                      bgcolor = params.get('bgcolor', 'white'),
-                      edge_linewidth = params.get('edge_linewidth', 1.0),
-                      node_alpha = params.get('node_alpha', 0.3), 
-                      edge_alpha = params.get('edge_alpha', 0.4),
-                      show = False, close = False
-                      )
-        # Plot the depot with a different color
-        depot_x, depot_y = self.coordinates[self.depot]
-        axes.scatter(depot_x, depot_y, 
-                   c = 'red', 
-                   s = params['scatter_s'], 
-                   zorder = 5, 
-                   alpha = 0.5)
-        # Plot the targets with a different color
-        target_x, target_y = zip(*[self.coordinates[target] for target in self.targets])
-        axes.scatter(target_x, target_y, 
-                   c = 'blue', 
-                   s = params['scatter_s'], 
-                   zorder = 5, 
-                   alpha = 0.5)
-
-    def _add_route(self, axes, routes, color):
-        params = self.get_plot_params(self.config.target) 
-        for (i, j) in zip(routes[:-1], routes[1:]):
-            ox.plot_graph_route(self.G, [i, j], 
-                                ax = axes, 
-                                route_color = color, 
-                                orig_dest_size = params.get('orig_dest_size', 0.0), 
-                                route_linewidth = params.get('route_linewidth', 1.5), 
-                                edge_alpha = None,
-                                show = False,
-                                close = False
-                                )
+    def _tour_path(self, tour):
+        """Street node sequence of a tour, from the stored terminal paths if available."""
+        if self.paths is not None:
+            return self.paths.expand(tour)
+        import networkx as nx
+        path = []
+        for i in range(len(tour)-1):
+            path.extend(nx.shortest_path(self.G, source=tour[i], target=tour[i+1], weight='length')[:-1])
+        path.extend([tour[0]])
+        return path
 
-            
-    def _plot_fair_solutions(self, fc, obj_type): 
-        num_vehicles = 4
-        colors = ['xkcd:green', 'xkcd:magenta', 'xkcd:orange red', 'xkcd:brown']
-        for (_, c) in enumerate(fc): 
-            file = self.get_fair_filename(num_vehicles, obj_type, c)
-            fig, ax = plt.subplots() 
-            self._add_graph(ax)
-            data = {} 
-            with open(file, 'r') as jsonfile: 
-                data = json.load(jsonfile)
-            tours = data['tours']
-            for vehicle in range(num_vehicles):
-                path = [] 
-                tour = tours[vehicle]
-                for i in range(len(tour)-1):
-                    s = tour[i] 
-                    t = tour[i+1]
-                    path.extend(nx.shortest_path(self.G, source=s, target=t, weight='length')[:-1])
-                path.extend([tour[0]])
-                self._add_route(ax, path, colors[vehicle])
-            params = self.get_plot_params(self.config.target) 
-            fig.set_tight_layout(True)
-            fs = params['fig_size']
-            log.info(f'setting {obj_type} with {c} fig size: {fs} sq. inches')
-            fig.set_size_inches(fs[0], fs[1])
-            plt.savefig(f'../plots/{self.config.target}/seattle_{obj_type}_{c}.pdf', format='pdf')
-            if self.config.pdfcrop == True:
-                self.crop(f'../plots/{self.config.target}/seattle_{obj_type}_{c}')
-    
-    def _plot_other_solutions(self):
+    def _solution_figure(self, name, file, num_vehicles):
+        """Figure spec of the tours of a result file, with the routes as coordinate arrays."""
+        data = archive.load_result(file)
+        tours = data['tours'][:num_vehicles]
+        lines = [self.geometry.route_coordinates(self._tour_path(tour)) for tour in tours]
+        return {'name': name, 'terminals': True, 'terminal_alpha': 0.5, 'lines': lines}
+
+    def _figure_specs(self):
+        """Specs of all figures; the shared network and terminals are passed to the workers once."""
         num_vehicles = 4
-        colors = ['xkcd:green', 'xkcd:magenta', 'xkcd:orange red', 'xkcd:brown']
-        obj_types = ['min-max', 'min', 'p-norm']
-        for obj_type in obj_types:
-            file = self.get_filename(num_vehicles, obj_type) 
-            fig, ax = plt.subplots() 
-            self._add_graph(ax)
-            data = {} 
-            with open(file, 'r') as jsonfile: 
-                data = json.load(jsonfile)
-            tours = data['tours']
-            for vehicle in range(num_vehicles):
-                path = [] 
-                tour = tours[vehicle]
-                for i in range(len(tour)-1):
-                    s = tour[i] 
-                    t = tour[i+1]
-                    path.extend(nx.shortest_path(self.G, source=s, target=t, weight='length')[:-1])
-                path.extend([tour[0]])
-                self._add_route(ax, path, colors[vehicle])
-            params = self.get_plot_params(self.config.target) 
-            fig.set_tight_layout(True)
-            fs = params['fig_size']
-            log.info(f'setting {obj_type} fig size: {fs} sq. inches')
-            fig.set_size_inches(fs[0], fs[1])
-            plt.savefig(f'../plots/{self.config.target}/seattle_{obj_type}.pdf', format='pdf')
-            if self.config.pdfcrop == True:
-                self.crop(f'../plots/{self.config.target}/seattle_{obj_type}')
-                
-    def _plot_two_vehicle_solution(self):
-        file = self.get_two_vehicle_filename()
-        colors = ['xkcd:green', 'xkcd:magenta', 'xkcd:orange red', 'xkcd:brown']
-        fig, ax = plt.subplots() 
-        self._add_graph(ax)
-        data = {} 
-        with open(file, 'r') as jsonfile: 
-            data = json.load(jsonfile)
-        tours = data['tours']
-        for vehicle in range(2):
-            path = [] 
-            tour = tours[vehicle]
-            for i in range(len(tour)-1):
-                s = tour[i] 
-                t = tour[i+1]
-                path.extend(nx.shortest_path(self.G, source=s, target=t, weight='length')[:-1])
-            path.extend([tour[0]])
-            self._add_route(ax, path, colors[vehicle])
-        params = self.get_plot_params(self.config.target) 
-        fig.set_tight_layout(True)
-        fs = params['fig_size']
-        log.info(f'setting two vehicle fig size: {fs} sq. inches')
-        fig.set_size_inches(fs[0], fs[1])
-        plt.savefig(f'../plots/{self.config.target}/seattle_2_min.pdf', format='pdf')
-        if self.config.pdfcrop == True:
-            self.crop(f'../plots/{self.config.target}/seattle_2_min')
-    
+        fc = [10, 50, 90]
+        specs = []
+        if self.config.plotgrid == True:
+            specs.append({'name': 'seattle_network', 'terminals': False, 'lines': []})
+        specs.append({'name': 'seattle_graph', 'terminals': True, 'terminal_alpha': 0.8, 'lines': []})
+        for obj_type in ['delta-fair', 'eps-fair']:
+            for c in fc:
+                specs.append(self._solution_figure(f'seattle_{obj_type}_{c}',
+                                                   self.get_fair_filename(num_vehicles, obj_type, c), num_vehicles))
+        for obj_type in ['min-max', 'min', 'p-norm']:
+            specs.append(self._solution_figure(f'seattle_{obj_type}',
+                                               self.get_filename(num_vehicles, obj_type), num_vehicles))
+        specs.append(self._solution_figure('seattle_2_min', self.get_two_vehicle_filename(), 2))
+        return specs
+
+    @staticmethod
+    def _array_digest(arrays):
+        import numpy as np
+
+        sha = hashlib.sha1()
+        for array in arrays:
+            sha.update(np.ascontiguousarray(array, dtype=float).tobytes())
+        return sha.hexdigest()
+
+    def _figure_digest(self, spec, network_digest):
+        """Digest of everything a figure is drawn from: network, terminals, routes, settings and code."""
+        from postprocessing import render
+
+        data = {
+            'spec': {key: value for key, value in spec.items() if key != 'lines'},
+            'routes': self._array_digest(spec['lines']),
+            'network': network_digest,
+            'depot': self.coordinates[self.depot],
+            'targets': [self.coordinates[target] for target in self.targets],
+            'params': self.get_plot_params(self.config.target),
+            'crop': self.config.pdfcrop,
+            'rasterBase': self.config.rasterBase and self.config.dpi,
+        }
+        return figure_digest(self.config.target, rc_params(self.config.target), [__file__, render.__file__], data)
+
+    def _scene(self, out_path):
+        from postprocessing.render import render_base_image
+
+        params = self.get_plot_params(self.config.target)
+        scene = {
+            'target': self.config.target,
+            'params': params,
+            'out_path': out_path,
+            'crop': self.config.pdfcrop,
+            'geometry': self.geometry,
+            'depot': self.coordinates[self.depot],
+            'targets': [self.coordinates[target] for target in self.targets],
+            'base_image': None,
+            'profile': profiling.is_enabled(),
+        }
+        if self.config.rasterBase:
+            start = time.perf_counter()
+            with profiling.stage('base image'):
+                scene['base_image'] = render_base_image(self.geometry, params, params['fig_size'], self.config.dpi)
+            log.info(f'rendered base network at {self.config.dpi} dpi in {time.perf_counter() - start:.2f}s')
+        return scene
             
     def run(self): 
-        self._set_rc_params()
-        self._populate_graph()
-        self._plot_graph_with_targets()
-        fc = [10, 50, 90]
-        self._plot_fair_solutions(fc,'delta-fair') 
-        self._plot_fair_solutions(fc, 'eps-fair')
-        self._plot_other_solutions()
-        self._plot_two_vehicle_solution()
+        start = time.perf_counter()
+        with profiling.stage('load'):
+            self._populate_graph()
+        with profiling.stage('prepare'):
+            specs = self._figure_specs()
+            out_path = f'../plots/{self.config.target}'
+            cache = FigureCache(out_path, self.config.force)
+            network_digest = self._array_digest([self.geometry.xy] + self.geometry.segments)
+            digests = {spec['name']: self._figure_digest(spec, network_digest) for spec in specs}
+            stale = [spec for spec in specs
+                     if not cache.is_current(spec['name'], digests[spec['name']],
+                                             [os.path.join(out_path, f"{spec['name']}.pdf")])]
+        profiling.count('figures up to date', len(specs) - len(stale))
+        log.info(f'prepared {len(specs)} figures in {time.perf_counter() - start:.2f}s, '
+                 f'{len(specs) - len(stale)} are up to date')
+        if not stale:
+            return
+        scene = self._scene(out_path)
+        executor = None
+        try:
+            if self.config.workers == 1:
+                _init_scene(scene)
+                timings = map(render_figure, stale)
+            else:
+                executor = ProcessPoolExecutor(max_workers=self.config.workers, initializer=_init_scene,
+                                               initargs=(scene,))
+                timings = executor.map(render_figure, stale)
+            for name, seconds, stats in timings:
+                profiling.merge(stats)
+                cache.record(name, digests[name])
+                log.info(f'figure {name}: {seconds:.2f}s')
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            cache.save()
+        log.info(f'generated {len(stale)} figures in {time.perf_counter() - start:.2f}s')
         
 
 def main():
@@ -334,6 +345,7 @@ def main():
     
     try:
         config = handle_command_line()
+        profiling.setup(config, 'plot_seattle')
         controller = Controller(config)
         controller.run()
     except PlotException as pe:
@@ -0,0 +1,312 @@
+"""
+Batch tour plots of solver results of any instance.
+
+Every result JSON carries the vertex coordinates (vertexCoords) and the
+tours, so a tour figure needs neither the instance file nor a road graph.
+The results to plot are either all result files below a folder or the rows
+of a query on the results database (the rows name instance, vehicles,
+objective, p-norm and fairness coefficient; the files are looked up by the
+solver's file name). Figures keep the sub-folder of their result file and
+are drawn in worker processes, each vehicle a single polyline of one
+LineCollection with colors from a colormap, so any number of vehicles works. With --raster the figures are PNGs with
+rasterized artists, which keeps sweeps of thousands of solutions fast to
+write and to browse. Archived rounds (postprocessing.archive) are plotted
+from the archive file or from the round folder it replaced. EXPLICIT
+instances without coordinates (all vertices at the origin) and results
+without tours are skipped.
+
+    python -m postprocessing.plot_tours ../../../../results/round-2 -o ../plots/tours --raster
+    python -m postprocessing.plot_tours ../../../../results/round-2 -db ../../../../results/store.db --round round-2 \
+        --query "SELECT * FROM vehi4 WHERE objective = 'eps-fair'"
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from postprocessing import archive, profiling, shards, store
+
+log = logging.getLogger(__name__)
+
+# numpy and matplotlib are imported where they are used, so that --help starts fast
+
+# output settings shared by all figures, set once per worker by _init_worker
+_settings = None
+
+
+class PlotException(Exception):
+    """Custom exception class with message for this module."""
+
+    def __init__(self, value):
+        self.value = value
+        super().__init__(value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+def index_results(results_path):
+    """
+    All result JSON files below results_path, or the results of its archive.
+
+    Files are keyed by their path relative to results_path with '/'
+    separators, e.g. deltaFair/<name>.json: the folders of a round can hold
+    the same file name, e.g. delta-fair runs of deltaFair and minmaxFair
+    whose fairness coefficients truncate to the same percentage.
+
+    Returns:
+        {relative path: path} in path order
+    """
+    index = {}
+    for folder, dir_names, files in os.walk(results_path):
+        dir_names.sort()
+        for f in sorted(files):
+            if f.endswith('.json'):
+                path = os.path.join(folder, f)
+                index[os.path.relpath(path, results_path).replace(os.sep, '/')] = path
+    archive_path = results_path
+    if not archive_path.endswith(archive.ARCHIVE_SUFFIX):
+        archive_path = os.path.normpath(results_path) + archive.ARCHIVE_SUFFIX
+    if not index and os.path.isfile(archive_path):
+        root = archive_path[:-len(archive.ARCHIVE_SUFFIX)]
+        for path in archive.member_paths(archive_path):
+            index[os.path.relpath(path, root).replace(os.sep, '/')] = path
+    return index
+
+
+def query_results(db_path, query, index, round_name=None):
+    """
+    Result files of the rows of a query on the results database (of a round of the store).
+
+    A file name in several folders of the index is resolved by the fairness
+    coefficient the results hold, which the name truncates to a percentage.
+
+    Returns:
+        List of (relative path, path) in row order
+    """
+    try:
+        connection = store.connect(db_path, round_name)
+    except store.StoreException as se:
+        raise PlotException(se.value)
+    connection.row_factory = sqlite3.Row
+    profiling.trace_queries(connection)
+    try:
+        with profiling.stage('query'):
+            rows = connection.execute(query).fetchall()
+    except sqlite3.Error as e:
+        raise PlotException(f'query failed on {db_path}: {e}')
+    finally:
+        connection.close()
+    by_name = {}
+    for member, path in index.items():
+        by_name.setdefault(member.rsplit('/', 1)[-1], []).append((member, path))
+    paths = []
+    for row in rows:
+        try:
+            name = shards.result_file_name(row['instanceName'], row['numVehicles'], row['objective'], row['pNorm'],
+                                           float(row['fairnessCoefficient']))
+        except IndexError:
+            raise PlotException('query rows need instanceName, numVehicles, objective, pNorm and '
+                                'fairnessCoefficient columns')
+        candidates = by_name.get(name, [])
+        if len(candidates) > 1:
+            fc = round(float(row['fairnessCoefficient']), 4)
+            candidates = [(member, path) for member, path in candidates
+                          if round(float(archive.load_result(path)['fairnessCoefficient']), 4) == fc]
+        if not candidates:
+            log.warning(f'no result file {name} for a query row')
+            continue
+        if len(candidates) > 1:
+            log.warning(f'query row of {name} matches {[member for member, _ in candidates]}, plotting all of them')
+        paths.extend(candidates)
+    return paths
+
+
+def vehicle_colors(num_vehicles):
+    """Distinct colors of tab10 up to ten vehicles, evenly spaced over turbo beyond."""
+    import matplotlib
+    import numpy as np
+
+    if num_vehicles <= 10:
+        return [matplotlib.colormaps['tab10'](i) for i in range(num_vehicles)]
+    return [matplotlib.colormaps['turbo'](v) for v in np.linspace(0.05, 0.95, num_vehicles)]
+
+
+def tour_lines(result):
+    """
+    Coordinate arrays of the tours of a result and of all its vertices.
+
+    Returns:
+        Tuple (list of (m, 2) arrays, one per vehicle, (n, 2) vertex array, depot coordinates),
+        None if the instance has no coordinates or the result no tours
+    """
+    import numpy as np
+
+    coords = result.get('vertexCoords', {})
+    ids = list(coords)
+    xy = np.array([[coords[i]['x'], coords[i]['y']] for i in ids], dtype=float)
+    if len(xy) == 0 or not np.any(xy) or not result.get('tours'):
+        return None
+    row = {int(i): r for r, i in enumerate(ids)}
+    lines = []
+    for tour in result['tours']:
+        if len(tour) < 2:
+            continue
+        closed = list(tour) if tour[0] == tour[-1] else list(tour) + [tour[0]]
+        lines.append(xy[[row[v] for v in closed]])
+    return lines, xy, xy[row[int(result['depot'])]]
+
+
+def _init_worker(settings):
+    global _settings
+    import matplotlib
+    matplotlib.use('Agg')
+    if settings['target'] is not None:
+        from postprocessing.plot_pareto_COF import set_rc_params
+        set_rc_params(settings['target'])
+    profiling.enable(settings['profile'])
+    _settings = settings
+
+
+def plot_result(item):
+    """
+    Tour figure of one result file (worker process).
+
+    Args:
+        item: (path relative to the results folder, path) of the result file; the figure
+            is written to <out_path>/<instance>/<folder of the file>/<name>
+
+    Returns:
+        Tuple (output file or None if skipped, seconds, profiling stats of the worker)
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+
+    member, file_path = item
+    start = time.perf_counter()
+    with profiling.stage('parse'):
+        result = archive.load_result(file_path)
+    drawn = tour_lines(result)
+    if drawn is None:
+        return None, time.perf_counter() - start, profiling.collect()
+    lines, xy, depot = drawn
+    raster = _settings['raster']
+
+    with profiling.stage('render'):
+        fig, ax = plt.subplots(figsize=_settings['fig_size'])
+        ax.scatter(xy[:, 0], xy[:, 1], s=_settings['node_size'], c='black', alpha=0.6, linewidths=0, zorder=2,
+                   rasterized=raster)
+        ax.scatter([depot[0]], [depot[1]], s=6 * _settings['node_size'], c='red', marker='s', zorder=4)
+        ax.add_collection(LineCollection(lines, colors=vehicle_colors(len(lines)), linewidths=_settings['linewidth'],
+                                         alpha=0.8, zorder=3, rasterized=raster))
+        ax.set_aspect('equal')
+        ax.autoscale_view()
+        ax.axis('off')
+        if _settings['title']:
+            ax.set_title(f'{result["instanceName"].split(".")[0]}, {result["numVehicles"]} vehicles, '
+                         f'{result["objectiveType"]} (fc {result["fairnessCoefficient"]}, p {result["pNorm"]})',
+                         fontsize=7)
+
+    instance = result['instanceName'].split('.')[0]
+    folder, _, name = member.rpartition('/')
+    out_path = os.path.join(_settings['out_path'], instance, *folder.split('/'))
+    os.makedirs(out_path, exist_ok=True)
+    extension = 'png' if raster else 'pdf'
+    out_file = os.path.join(out_path, f'{os.path.splitext(name)[0]}.{extension}')
+    with profiling.stage('save'):
+        fig.savefig(out_file, format=extension, dpi=_settings['dpi'], bbox_inches='tight')
+    plt.close(fig)
+    return out_file, time.perf_counter() - start, profiling.collect()
+
+
+def plot_results(paths, out_path, workers=None, raster=False, dpi=150, target=None, title=True):
+    """
+    Plot the tours of all result files in parallel.
+
+    Args:
+        paths: list of (path relative to the results folder, path) of the result files
+
+    Returns:
+        Tuple (number of written figures, number of skipped results)
+    """
+    settings = {
+        'out_path': out_path,
+        'raster': raster,
+        'dpi': dpi,
+        'target': target,
+        'title': title,
+        'fig_size': (3, 3),
+        'node_size': 2,
+        'linewidth': 0.8,
+        'profile': profiling.is_enabled(),
+    }
+    os.makedirs(out_path, exist_ok=True)
+    written, skipped = 0, 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(settings,)) as executor:
+        chunksize = max(1, len(paths) // (8 * (workers or os.cpu_count() or 1)))
+        for (_, file_path), (out_file, seconds, stats) in zip(paths, executor.map(plot_result, paths,
+                                                                                  chunksize=chunksize)):
+            profiling.merge(stats)
+            if out_file is None:
+                skipped += 1
+                log.debug(f'skipped {file_path}, no coordinates or no tours')
+                continue
+            written += 1
+            log.debug(f'wrote {out_file} in {seconds:.2f}s')
+    return written, skipped
+
+
+def handle_command_line():
+    parser = argparse.ArgumentParser(description='plot the tours of solver results')
+    parser.add_argument('results', help='folder with result JSON files, searched recursively, or a round archive')
+    parser.add_argument('-o', '--output', default='../plots/tours', help='output folder')
+    parser.add_argument('-db', '--database', default=None,
+                        help='results database; with --query only the files of the query rows are plotted')
+    parser.add_argument('--round', default=None,
+                        help='round of the store the query reads (default: latest result of every case)')
+    parser.add_argument('-q', '--query', default=None,
+                        help='SQL query returning instanceName, numVehicles, objective, pNorm, fairnessCoefficient')
+    parser.add_argument('-i', '--instance', default=None, help='only plot results of this instance name')
+    parser.add_argument('-r', '--raster', action='store_true', help='write rasterized PNG figures')
+    parser.add_argument('--dpi', type=int, default=150, help='resolution of the raster figures')
+    parser.add_argument('-t', '--target', choices=['paper', 'presentation'], default=None,
+                        help='use the LaTeX rc params of the paper/presentation figures')
+    parser.add_argument('--noTitle', action='store_true', help='omit the figure titles')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of worker processes')
+    profiling.add_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.INFO)
+    try:
+        config = handle_command_line()
+        profiling.setup(config, 'plot_tours')
+        with profiling.stage('scan'):
+            index = index_results(config.results)
+        if config.query is not None:
+            if config.database is None:
+                raise PlotException('--query needs the results database (-db)')
+            paths = query_results(config.database, config.query, index, config.round)
+        else:
+            paths = list(index.items())
+        if config.instance is not None:
+            prefix = f'{config.instance.split(".")[0]}-v-'
+            paths = [(member, path) for member, path in paths if member.rsplit('/', 1)[-1].startswith(prefix)]
+        start = time.perf_counter()
+        log.info(f'plotting {len(paths)} results to {config.output}')
+        written, skipped = plot_results(paths, config.output, config.workers, config.raster, config.dpi,
+                                        config.target, not config.noTitle)
+        profiling.count('figures written', written)
+        profiling.count('results skipped', skipped)
+        log.info(f'wrote {written} figures, skipped {skipped} results without coordinates or tours '
+                 f'in {time.perf_counter() - start:.1f}s')
+    except PlotException as pe:
+        log.error(pe)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Opt-in stage timing, counters and cProfile dumps of the scripts.
+
+Scripts add the flags with add_arguments(parser) and call setup(config,
+name) after parsing. Without --profile every hook is a no-op; with it,
+
+    with profiling.stage('parse'):
+        ...
+    profiling.count('files parsed')
+
+accumulate wall and CPU time per stage and named counters, and a JSON report
+(stages, counters, total time, peak RSS) is written and summarized in the log
+at exit. --cprofile <file> additionally dumps cProfile statistics of the main
+process, to be read with pstats or snakeviz. Stage times are inclusive, a
+stage nested in another is counted in both.
+
+Worker processes keep their own stats: the initializer calls
+enable(profiling.is_enabled() of the parent), the worker function returns
+collect() with its result and the parent merges it with merge(). A forked
+worker inherits the stats of the parent; enable() replaces them with empty
+ones, so that merge() does not add the stages of the parent again.
+"""
+import atexit
+import contextlib
+import functools
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from datetime import datetime, timezone
+
+log = logging.getLogger(__name__)
+
+# stats of this process, None unless profiling is enabled
+_profile = None
+# end marker of iterate()
+_DONE = object()
+
+
+class Profile:
+    """Wall and CPU seconds and calls per stage, and named counters."""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.start = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.pid = os.getpid()
+
+    def add(self, name, wall, cpu, calls=1):
+        stage = self.stages.setdefault(name, {'calls': 0, 'wallSeconds': 0.0, 'cpuSeconds': 0.0})
+        stage['calls'] += calls
+        stage['wallSeconds'] += wall
+        stage['cpuSeconds'] += cpu
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self):
+        return {'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'counters': dict(self.counters)}
+
+
+def is_enabled():
+    return _profile is not None
+
+
+def enable(enabled=True):
+    """Start collecting stats in this process (e.g. in the initializer of a worker)."""
+    global _profile
+    if enabled and (_profile is None or _profile.pid != os.getpid()):
+        _profile = Profile()
+
+
+@contextlib.contextmanager
+def _timed(name):
+    start, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        _profile.add(name, time.perf_counter() - start, time.process_time() - start_cpu)
+
+
+def stage(name):
+    """Context manager timing a stage; does nothing unless profiling is enabled."""
+    if _profile is None:
+        return contextlib.nullcontext()
+    return _timed(name)
+
+
+def timed(name):
+    """Decorator timing every call of a function as stage name."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profile is None:
+                return function(*args, **kwargs)
+            with _timed(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def iterate(name, iterable):
+    """Yield the items of iterable, timing the production of every item as stage name."""
+    if _profile is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        with _timed(name):
+            item = next(iterator, _DONE)
+        if item is _DONE:
+            return
+        yield item
+
+
+def count(name, n=1):
+    if _profile is not None:
+        _profile.count(name, n)
+
+
+def record(name, wall, cpu=0.0):
+    """Add a stage time measured elsewhere, e.g. reported by a worker."""
+    if _profile is not None:
+        _profile.add(name, wall, cpu)
+
+
+def collect():
+    """Stats of this process since the last collect (None if profiling is disabled), for merge() in the parent."""
+    if _profile is None:
+        return None
+    data = _profile.as_dict()
+    _profile.stages, _profile.counters = {}, {}
+    return data
+
+
+def merge(data):
+    """Add the stats returned by collect() in a worker process."""
+    if _profile is None or data is None:
+        return
+    for name, stage_stats in data['stages'].items():
+        _profile.add(name, stage_stats['wallSeconds'], stage_stats['cpuSeconds'], stage_stats['calls'])
+    for name, n in data['counters'].items():
+        _profile.count(name, n)
+
+
+def trace_queries(connection):
+    """Count the SQL statements run on a sqlite3 connection as counter 'queries'."""
+    if _profile is not None:
+        connection.set_trace_callback(lambda statement: count('queries'))
+
+
+def add_arguments(parser):
+    parser.add_argument('--profile', nargs='?', const='', default=None, metavar='REPORT',
+                        help='record stage times and counters and write them as JSON to REPORT '
+                             '(default <script>-profile.json) at exit')
+    parser.add_argument('--cprofile', default=None, metavar='FILE',
+                        help='also dump cProfile statistics of the main process to FILE')
+
+
+def _peak_rss_mb(who):
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(resource.getrusage(who).ru_maxrss / scale, 1)
+
+
+def report(script):
+    """Report of the stats of this process and the merged workers."""
+    data = _profile.as_dict()
+    for stage_stats in data['stages'].values():
+        stage_stats['wallSeconds'] = round(stage_stats['wallSeconds'], 4)
+        stage_stats['cpuSeconds'] = round(stage_stats['cpuSeconds'], 4)
+    return {
+        'script': script,
+        'argv': sys.argv,
+        'finished': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'wallSeconds': round(time.perf_counter() - _profile.start, 4),
+        'cpuSeconds': round(time.process_time() - _profile.start_cpu, 4),
+        'peakRssMB': _peak_rss_mb(resource.RUSAGE_SELF),
+        'peakChildRssMB': _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        **data,
+    }
+
+
+def _finish(script, report_path, profiler, cprofile_path):
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(cprofile_path)
+        log.info(f'wrote cProfile statistics to {cprofile_path}')
+    data = report(script)
+    tmp_path = f'{report_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f_out:
+        json.dump(data, f_out, indent=1)
+    os.replace(tmp_path, report_path)
+    lines = [f'{"stage":<24} {"calls":>8} {"wall (s)":>10} {"cpu (s)":>10}']
+    for name, stats in sorted(data['stages'].items(), key=lambda item: -item[1]['wallSeconds']):
+        lines.append(f'{name:<24} {stats["calls"]:>8} {stats["wallSeconds"]:>10.3f} {stats["cpuSeconds"]:>10.3f}')
+    lines.extend(f'{name:<24} {n:>8}' for name, n in sorted(data['counters'].items()))
+    log.info(f'{script} took {data["wallSeconds"]:.2f}s wall, {data["cpuSeconds"]:.2f}s cpu, '
+             f'{data["peakRssMB"]} MB peak RSS; report in {report_path}\n' + '\n'.join(lines))
+
+
+def setup(config, script):
+    """Enable profiling if the command line asks for it and write the report at exit."""
+    if getattr(config, 'profile', None) is None and getattr(config, 'cprofile', None) is None:
+        return
+    enable()
+    report_path = config.profile or f'{script}-profile.json'
+    profiler = None
+    if config.cprofile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    atexit.register(_finish, script, os.path.abspath(report_path), profiler, config.cprofile)
@@ -0,0 +1,169 @@
+"""
+Collection-based drawing of road graphs and tours.
+
+osmnx draws routes with one artist per street segment, so a figure of four
+Seattle tours ended up with thousands of artists. Here the road network is
+one LineCollection plus one scatter of the nodes, and every vehicle route is
+a single polyline; all routes of a figure share one LineCollection. Streets
+follow the edge 'geometry' of the simplified OSM graph when it is present,
+as in osmnx.plot_graph. matplotlib is only imported by the drawing
+functions, RoadGeometry works without it.
+"""
+import numpy as np
+
+
+def _edge_points(G, u, v, data):
+    """Coordinates of an edge from u to v, including the end nodes."""
+    start = (G.nodes[u]['x'], G.nodes[u]['y'])
+    end = (G.nodes[v]['x'], G.nodes[v]['y'])
+    if 'geometry' not in data:
+        return np.array([start, end])
+    points = np.asarray(data['geometry'].coords, dtype=float)
+    # undirected graphs keep the geometry in the direction of the original OSM way
+    if np.sum((points[0] - start) ** 2) > np.sum((points[-1] - start) ** 2):
+        points = points[::-1]
+    return points
+
+
+class RoadGeometry:
+    """
+    Node coordinates and street shapes of a road graph as arrays.
+
+    Attributes:
+        nodes: node labels, row i of xy belongs to nodes[i]
+        xy: array of shape (number of nodes, 2) with lon/lat
+        segments: list of (m, 2) arrays, one per edge, for the network layer
+        shapes: {(u, v): interior points} of edges with a geometry, used
+            to draw routes along the streets; the shortest parallel edge is kept
+    """
+
+    def __init__(self, nodes, xy, segments, shapes):
+        self.nodes = nodes
+        self.xy = xy
+        self.segments = segments
+        self.shapes = shapes
+        self._row = {node: row for row, node in enumerate(nodes)}
+
+    @classmethod
+    def from_graph(cls, G):
+        nodes = list(G.nodes())
+        xy = np.array([[G.nodes[node]['x'], G.nodes[node]['y']] for node in nodes], dtype=float)
+        segments, shapes, lengths = [], {}, {}
+        for u, v, data in G.edges(data=True):
+            points = _edge_points(G, u, v, data)
+            segments.append(points)
+            length = data.get('length', np.inf)
+            if (u, v) in lengths and lengths[(u, v)] <= length:
+                continue
+            lengths[(u, v)] = lengths[(v, u)] = length
+            if len(points) > 2:
+                shapes[(u, v)] = points[1:-1]
+                shapes[(v, u)] = points[-2:0:-1]
+            else:
+                shapes.pop((u, v), None)
+                shapes.pop((v, u), None)
+        return cls(nodes, xy, segments, shapes)
+
+    def bounds(self):
+        """(west, south, east, north) of all nodes and street shapes."""
+        points = np.concatenate([self.xy] + self.segments) if self.segments else self.xy
+        return (*points.min(axis=0), *points.max(axis=0))
+
+    def route_coordinates(self, path):
+        """Polyline of a street node sequence, along the edge shapes."""
+        rows = np.fromiter((self._row[node] for node in path), dtype=np.int64, count=len(path))
+        coordinates = self.xy[rows]
+        if not self.shapes or len(path) < 2:
+            return coordinates
+        pieces, start = [], 0
+        for k, (u, v) in enumerate(zip(path[:-1], path[1:])):
+            shape = self.shapes.get((u, v))
+            if shape is not None:
+                pieces.extend([coordinates[start:k + 1], shape])
+                start = k + 1
+        if not pieces:
+            return coordinates
+        pieces.append(coordinates[start:])
+        return np.concatenate(pieces)
+
+
+def style_axes(ax, bounds, bgcolor='white', margin=0.02):
+    """Blank axes with equal ground distances in x and y, as osmnx.plot_graph sets them."""
+    west, south, east, north = bounds
+    dx, dy = (east - west) * margin, (north - south) * margin
+    ax.set_xlim(west - dx, east + dx)
+    ax.set_ylim(south - dy, north + dy)
+    ax.set_aspect(1.0 / np.cos(np.radians((south + north) / 2.0)))
+    ax.set_facecolor(bgcolor)
+    ax.figure.set_facecolor(bgcolor)
+    ax.axis('off')
+    ax.margins(0)
+
+
+def draw_network(ax, geometry, params, rasterized=False):
+    """Streets as one LineCollection and nodes as one scatter."""
+    from matplotlib.collections import LineCollection
+
+    streets = LineCollection(geometry.segments,
+                             colors=params.get('edge_color', 'gray'),
+                             linewidths=params.get('edge_linewidth', 1.0),
+                             alpha=params.get('edge_alpha', 0.4),
+                             zorder=1, rasterized=rasterized)
+    ax.add_collection(streets)
+    if params.get('node_size', 1) > 0:
+        ax.scatter(geometry.xy[:, 0], geometry.xy[:, 1],
+                   s=params.get('node_size', 1),
+                   c=params.get('node_color', 'black'),
+                   alpha=params.get('node_alpha', 0.3),
+                   linewidths=0, zorder=2, rasterized=rasterized)
+    style_axes(ax, geometry.bounds(), params.get('bgcolor', 'white'))
+
+
+def render_base_image(geometry, params, fig_size, dpi=300):
+    """
+    Network layer rasterized once, to be placed under many figures with draw_base_image.
+
+    Returns:
+        Tuple (RGBA array, (xmin, xmax, ymin, ymax) extent of the image in lon/lat)
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=fig_size, dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
+    draw_network(ax, geometry, params)
+    fig.patch.set_alpha(0)
+    ax.patch.set_alpha(0)
+    canvas.draw()
+    image = np.asarray(canvas.buffer_rgba())
+    # the equal aspect shrinks the axes box, keep only its pixels
+    x0, y0, x1, y1 = ax.get_window_extent().extents
+    height = image.shape[0]
+    image = image[int(round(height - y1)):int(round(height - y0)), int(round(x0)):int(round(x1))].copy()
+    return image, (*ax.get_xlim(), *ax.get_ylim())
+
+
+def draw_base_image(ax, image, extent, bgcolor='white'):
+    """Place a network layer of render_base_image on the axes."""
+    ax.imshow(image, extent=extent, origin='upper', interpolation='antialiased', zorder=1)
+    xmin, xmax, ymin, ymax = extent
+    style_axes(ax, (xmin, ymin, xmax, ymax), bgcolor, margin=0.0)
+
+
+def draw_lines(ax, lines, colors, params):
+    """Polylines given as (m, 2) coordinate arrays, all in a single LineCollection."""
+    from matplotlib.collections import LineCollection
+
+    routes = LineCollection(lines,
+                            colors=list(colors)[:len(lines)],
+                            linewidths=params.get('route_linewidth', 1.5),
+                            alpha=params.get('route_alpha', 0.5),
+                            capstyle='round', joinstyle='round', zorder=3)
+    ax.add_collection(routes)
+    return routes
+
+
+def draw_routes(ax, geometry, paths, colors, params):
+    """One polyline per street node sequence in paths, all in a single LineCollection."""
+    return draw_lines(ax, [geometry.route_coordinates(path) for path in paths], colors, params)
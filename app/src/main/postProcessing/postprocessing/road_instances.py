@@ -0,0 +1,207 @@
+"""
+Batch generator of road network instances in the format of seattle.tsp.
+
+Each instance is described by a spec:
+
+    {"name": "seattle-200", "bbox": [47.63, 47.595, -122.30, -122.36],
+     "targets": 200, "depot": "centroid", "seed": 1, "vehicles": [4]}
+
+with either "bbox" (north, south, east, west) or "place" (a name the OSM
+geocoder resolves, e.g. "Capitol Hill, Seattle"). The depot rule is
+"centroid" (node closest to the centroid of the graph, as for seattle.tsp),
+"random" (seeded random node) or an OSM node id. Specs of the same region
+share one cached road graph (see osm_cache.py); the instances of a region
+are built in parallel worker processes that receive the graph once. Every
+instance is written as <name>.tsp with its relabel data <name>.json and the
+terminal paths <name>.paths.npz (see paths.py) to the data folder and
+registered in the instance catalog, so that script_generator.py -road picks
+it up.
+
+    python -m postprocessing.road_instances app/data/road_specs.json
+    python -m postprocessing.road_instances -n seattle-100 --bbox 47.63 47.595 -122.30 -122.36 -k 100
+"""
+import argparse
+import json
+import logging
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from postprocessing import create_seattle, osm_cache
+from postprocessing.catalog import ROAD_VEHICLES, register_instance
+from postprocessing.instance import get_data_path
+from postprocessing.paths import get_paths_file, save_paths
+
+log = logging.getLogger(__name__)
+
+DEPOT_RULES = ['centroid', 'random']
+
+# relabeled road graph and label maps of the region, set once per worker by _init_region
+_region = None
+
+
+class SpecException(Exception):
+    """Custom exception class with message for this module."""
+
+    def __init__(self, value):
+        self.value = value
+        super().__init__(value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+def normalize_spec(spec: dict) -> dict:
+    """Check a spec and fill in the defaults."""
+    if 'name' not in spec:
+        raise SpecException(f'spec without name: {spec}')
+    if ('bbox' in spec) == ('place' in spec):
+        raise SpecException(f'spec {spec["name"]} needs exactly one of bbox and place')
+    if 'bbox' in spec and len(spec['bbox']) != 4:
+        raise SpecException(f'bbox of spec {spec["name"]} should be north, south, east, west')
+    depot = spec.get('depot', 'centroid')
+    if depot not in DEPOT_RULES and not str(depot).isdigit():
+        raise SpecException(f'depot of spec {spec["name"]} should be one of {DEPOT_RULES} or an OSM node id')
+    normalized = dict(spec)
+    normalized['name'] = spec['name'].split('.')[0]
+    normalized['targets'] = int(spec.get('targets', 50))
+    normalized['depot'] = depot
+    normalized['seed'] = int(spec.get('seed', 2024))
+    normalized['vehicles'] = list(spec.get('vehicles', ROAD_VEHICLES))
+    normalized['network_type'] = spec.get('network_type', 'drive')
+    return normalized
+
+
+def read_specs(file_path: str) -> list:
+    with open(file_path, 'r') as fin:
+        specs = json.load(fin)
+    return [normalize_spec(spec) for spec in (specs if isinstance(specs, list) else [specs])]
+
+
+def resolve_bbox(spec: dict, cache_path: str = None, offline: bool = False):
+    if 'bbox' in spec:
+        return tuple(float(v) for v in spec['bbox'])
+    return osm_cache.place_bbox(spec['place'], cache_path, offline)
+
+
+def pick_depot(rule, seed, original_to_new, coordinates, sorted_nodes):
+    if rule == 'centroid':
+        return sorted_nodes[0]
+    if rule == 'random':
+        return random.Random(f'depot-{seed}').choice(sorted(coordinates))
+    osm_id = int(rule)
+    if osm_id not in original_to_new:
+        raise SpecException(f'depot node {osm_id} is not in the road graph')
+    return original_to_new[osm_id]
+
+
+def build_instance(spec, bbox, data_path):
+    """Choose terminals, compute their distances and write .tsp and relabel JSON (worker process)."""
+    G, relabel_map, back_relabel_map, node_data = _region
+    if spec['targets'] >= G.number_of_nodes():
+        raise SpecException(f'{spec["name"]}: {spec["targets"]} targets requested, '
+                            f'road graph has {G.number_of_nodes()} nodes')
+    coordinates, sorted_nodes = create_seattle.nodes_by_centroid_distance(G)
+    depot = pick_depot(spec['depot'], spec['seed'], relabel_map, coordinates, sorted_nodes)
+    targets = create_seattle.sample_targets(sorted_nodes, depot, spec['targets'], spec['seed'])
+
+    with open(os.path.join(data_path, f'{spec["name"]}.json'), 'w') as outfile:
+        json.dump({
+            'node_data': node_data,
+            'original_to_new_node_labels': relabel_map,
+            'new_to_original_node_labels': back_relabel_map,
+            'targets_on_new_node_labels': targets,
+            'depot_on_new_node_labels': depot,
+            'bbox': list(bbox),
+            'spec': spec,
+        }, outfile)
+
+    all_nodes = [depot] + targets
+    distance_matrix, paths = create_seattle.terminal_distances(G, all_nodes, workers=1, with_paths=True)
+    tsp_path = os.path.join(data_path, f'{spec["name"]}.tsp')
+    create_seattle.write_tsp(tsp_path, spec['name'],
+                             f'Depot and {spec["targets"]} random targets (seed {spec["seed"]}) in bbox {list(bbox)}',
+                             {node: coordinates[node] for node in all_nodes}, distance_matrix)
+    save_paths(get_paths_file(tsp_path), all_nodes, paths)
+    return tsp_path
+
+
+def _init_region(region):
+    global _region
+    _region = region
+
+
+def generate(specs, data_path=None, workers=None, cache_path=None, offline=False):
+    """
+    Build all instances of specs, one process pool per region.
+
+    Returns:
+        List of the written .tsp paths
+    """
+    data_path = data_path or get_data_path()
+    regions = {}
+    for spec in specs:
+        bbox = resolve_bbox(spec, cache_path, offline)
+        regions.setdefault((bbox, spec['network_type']), []).append(spec)
+
+    written = []
+    for (bbox, network_type), region_specs in regions.items():
+        G_ = osm_cache.load_graph(bbox, network_type=network_type, simplify=True, cache_path=cache_path,
+                                  offline=offline).to_undirected()
+        region = create_seattle.relabel_graph(G_)
+        log.info(f'building {len(region_specs)} instances on a road graph with {G_.number_of_nodes()} nodes')
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_region, initargs=(region,)) as executor:
+            futures = {executor.submit(build_instance, spec, bbox, data_path): spec for spec in region_specs}
+            for future, spec in futures.items():
+                tsp_path = future.result()
+                # the catalog is written by the parent only, one instance at a time
+                register_instance(tsp_path, spec['vehicles'], data_path)
+                written.append(tsp_path)
+                log.info(f'wrote {tsp_path}')
+    return written
+
+
+def handle_command_line():
+    parser = argparse.ArgumentParser(description="generate road network instances from OpenStreetMap")
+    parser.add_argument('specs', nargs='?', default=None, help='JSON file with a list of instance specs')
+    parser.add_argument('-n', '--name', default=None, help='name of a single instance')
+    parser.add_argument('--bbox', type=float, nargs=4, default=None, metavar=('NORTH', 'SOUTH', 'EAST', 'WEST'),
+                        help='bbox of a single instance')
+    parser.add_argument('--place', default=None, help='place name of a single instance')
+    parser.add_argument('-k', '--targets', type=int, default=50, help='number of targets of a single instance')
+    parser.add_argument('--depot', default='centroid', help='depot rule: centroid, random or an OSM node id')
+    parser.add_argument('--seed', type=int, default=2024, help='seed of the target sampling')
+    parser.add_argument('-v', '--vehicles', type=int, nargs='+', default=ROAD_VEHICLES,
+                        help='vehicle counts of the sweeps')
+    parser.add_argument('-d', '--data', default=None, help='output data folder (default: app/data)')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--offline', action='store_true', help='only use cached road graphs and places')
+    parser.add_argument('--graphCache', default=None,
+                        help='folder of the cached road graphs (default: app/data/.cache/osm)')
+    args = parser.parse_args()
+
+    if args.specs is not None:
+        specs = read_specs(args.specs)
+    else:
+        spec = {'name': args.name, 'targets': args.targets, 'depot': args.depot, 'seed': args.seed,
+                'vehicles': args.vehicles}
+        if args.bbox is not None:
+            spec['bbox'] = args.bbox
+        if args.place is not None:
+            spec['place'] = args.place
+        specs = [normalize_spec({k: v for k, v in spec.items() if v is not None})]
+    return args, specs
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.INFO)
+    try:
+        args, specs = handle_command_line()
+        generate(specs, args.data, args.workers, args.graphCache, args.offline)
+    except (SpecException, osm_cache.GraphCacheException) as e:
+        log.error(e)
+
+
+if __name__ == '__main__':
+    main()
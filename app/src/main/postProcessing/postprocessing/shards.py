@@ -0,0 +1,342 @@
+"""
+JSONL result shards.
+
+With `-jsonl <shard>` the solver appends its result as one line
+
+    {"resultFile":"eil51-v-3-eps-fair-p-1-fc-50.json","writtenAt":1718000000000,"result":{...}}
+
+to a shard shared by the jobs of a node or array task, instead of writing
+the result file (see ResultSink.kt). resultFile, the name the result file
+would have had, is the key by which shards and result files are merged
+and deduplicated; it is always the first field, so the key of a line is
+read without parsing the record. writtenAt is the time of the append in
+epoch milliseconds. A line without newline is the fragment of a killed job
+and is skipped. Of several records of one key in a shard, e.g. of a
+re-run, the last one counts.
+
+merge_results() streams the records of any number of shards and result
+files in key order: every shard is indexed by (key, offset), sorted if it
+is not sorted already and read back record by record, and the streams are
+k-way merged with heapq.merge. Only the index of a shard is held in memory.
+Of a key in several sources, e.g. a re-run on another node, the record
+written last wins; result files count as written at their modification
+time. Records of shards written before writtenAt have no time, and a key
+they share with another source raises a ShardException instead of
+picking one of them.
+
+Old rounds are compacted into one sorted shard per results folder:
+
+    python -m postprocessing.shards results/round-2 [--delete]
+"""
+import argparse
+import heapq
+import json
+import logging
+import os
+import sys
+
+log = logging.getLogger(__name__)
+
+SHARD_SUFFIX = '.jsonl'
+COMPACT_NAME = 'results.jsonl'
+KEY_PREFIX = b'{"resultFile":"'
+
+
+class ShardException(Exception):
+    """Custom exception class with message for this module."""
+
+    def __init__(self, value):
+        self.value = value
+        super().__init__(value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+def record_line(name, result, written_at=None):
+    """Shard line of a result, in the format of the solver; written_at in epoch milliseconds, if known."""
+    record = {'resultFile': name}
+    if written_at is not None:
+        record['writtenAt'] = written_at
+    record['result'] = result
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def result_file_name(instance_name, num_vehicles, objective_type, p, fc):
+    """File name the solver uses for a result, the key of its shard records (see Controller.kt)."""
+    return f'{instance_name.split(".")[0]}-v-{num_vehicles}-{objective_type}-p-{p}-fc-{int(fc * 100)}.json'
+
+
+def _line_key(line):
+    if line.startswith(KEY_PREFIX):
+        end = line.find(b'"', len(KEY_PREFIX))
+        if end > 0:
+            return line[len(KEY_PREFIX):end].decode()
+    return json.loads(line)['resultFile']
+
+
+def index_shard(path):
+    """
+    Keys and offsets of the complete lines of a shard.
+
+    Returns:
+        Tuple (list of (key, byte offset) in file order, True if the keys are sorted)
+    """
+    index = []
+    in_order = True
+    offset = 0
+    with open(path, 'rb') as fin:
+        for line_number, line in enumerate(fin, start=1):
+            if not line.endswith(b'\n'):
+                log.warning(f'{path}:{line_number}: incomplete last line, skipping')
+            elif line.strip():
+                try:
+                    key = _line_key(line)
+                except (ValueError, KeyError):
+                    log.warning(f'{path}:{line_number}: no result record, skipping')
+                else:
+                    if index and key < index[-1][0]:
+                        in_order = False
+                    index.append((key, offset))
+            offset += len(line)
+    return index, in_order
+
+
+def read_shard(path):
+    """
+    (key, result) of the records of a shard in key order.
+
+    Of the records of one key the last one is read: a re-run appends its
+    result, like it overwrites the result file of an earlier run.
+    """
+    for key, _, result in read_shard_records(path):
+        yield key, result
+
+
+def read_shard_records(path):
+    """(key, writtenAt or None, result) of the records of a shard in key order, as read_shard()."""
+    index, in_order = index_shard(path)
+    # the last offset of every key
+    latest = dict(index)
+    if len(latest) < len(index):
+        log.info(f'{path}: {len(index) - len(latest)} records replaced by later records of their key')
+    index = list(latest.items())
+    if not in_order:
+        index.sort(key=lambda item: item[0])
+    with open(path, 'rb') as fin:
+        for key, offset in index:
+            fin.seek(offset)
+            try:
+                record = json.loads(fin.readline())
+                result = record['result']
+            except (ValueError, KeyError):
+                log.warning(f'{path}: broken record of {key} at byte {offset}, skipping')
+                continue
+            yield key, record.get('writtenAt'), result
+
+
+def follow_shard(path, offset=0):
+    """
+    Keys of the lines completed in a shard since offset, for following a shard while jobs append to it.
+
+    Returns:
+        Tuple (list of keys, offset after the last complete line)
+    """
+    keys = []
+    with open(path, 'rb') as fin:
+        fin.seek(offset)
+        for line in fin:
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            if line.strip():
+                try:
+                    keys.append(_line_key(line))
+                except (ValueError, KeyError):
+                    log.warning(f'{path}: no result record at byte {offset - len(line)}, skipping')
+    return keys, offset
+
+
+def read_result_files(folder):
+    """(file name, result) of the result JSON files of a folder in name order."""
+    for f, _, result in read_result_file_records(folder):
+        yield f, result
+
+
+def read_result_file_records(folder):
+    """(file name, modification time in epoch milliseconds, result) of the result JSON files of a folder."""
+    for f in sorted(os.listdir(folder)):
+        if f.endswith('.json'):
+            path = os.path.join(folder, f)
+            written_at = os.stat(path).st_mtime_ns // 1000000
+            with open(path, 'r') as fin:
+                yield f, written_at, json.load(fin)
+
+
+def _tagged(records, source):
+    for key, written_at, result in records:
+        yield key, written_at, source, result
+
+
+def merge_records(sources):
+    """
+    k-way merge of shards and result file folders into one stream in key order.
+
+    Args:
+        sources: shard paths and folders of result files; of a key found in
+            several sources, the record written last wins, within a shard
+            the last record of the key
+
+    Returns:
+        Generator of (key, writtenAt, result)
+
+    Raises:
+        ShardException: a key is in several sources and one of them has no write time
+    """
+    streams = [_tagged(read_result_file_records(source) if os.path.isdir(source) else read_shard_records(source),
+                       source) for source in sources]
+    group = []
+    for record in heapq.merge(*streams, key=lambda item: item[0]):
+        if group and record[0] != group[0][0]:
+            yield _latest(group)
+            group = []
+        group.append(record)
+    if group:
+        yield _latest(group)
+
+
+def _latest(group):
+    key = group[0][0]
+    if len(group) > 1:
+        untimed = [source for _, written_at, source, _ in group if written_at is None]
+        if untimed:
+            raise ShardException(f'result {key} is in {[source for _, _, source, _ in group]}, and '
+                                 f'{untimed} have no write time to tell the latest; remove the stale records')
+        log.warning(f'duplicate result {key} in {len(group)} sources, keeping the latest')
+    # the first source of equal write times
+    _, written_at, _, result = max(group, key=lambda record: record[1])
+    return key, written_at, result
+
+
+def merge_results(sources):
+    """(key, result) of merge_records(), the latest record of every key in key order."""
+    for key, _, result in merge_records(sources):
+        yield key, result
+
+
+def shard_files(folder):
+    """JSONL shards of a folder in name order."""
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.endswith(SHARD_SUFFIX)]
+
+
+def shard_keys(folder):
+    """Keys of all records in the shards of a folder."""
+    return {key for path in shard_files(folder) for key, _ in index_shard(path)[0]}
+
+
+def shard_folders(folder):
+    """A results folder and its shard-<i>-of-<n> sub-folders."""
+    return [folder] + [os.path.join(folder, d) for d in sorted(os.listdir(folder))
+                       if d.startswith('shard-') and os.path.isdir(os.path.join(folder, d))]
+
+
+def folder_sources(folder):
+    """
+    Sources of merge_results() for all results of a folder.
+
+    Result files come before shards and the folder before its shard
+    sub-folders; of duplicates written at the same time the first wins.
+    """
+    sources = []
+    for path in shard_folders(folder):
+        sources.append(path)
+        sources.extend(shard_files(path))
+    return sources
+
+
+def has_results(folder):
+    """True if a folder or its shard sub-folders hold result files or shards."""
+    if not os.path.isdir(folder):
+        return False
+    return any(f.endswith('.json') or f.endswith(SHARD_SUFFIX)
+               for path in shard_folders(folder) for f in os.listdir(path))
+
+
+def result_folders(root):
+    """
+    Folders below root that hold result files or shards.
+
+    shard-<i>-of-<n> folders belong to their parent, which is listed even if
+    all its results are in its shard folders.
+    """
+    folders = []
+    for dir_path, dir_names, _ in os.walk(root):
+        dir_names[:] = sorted(d for d in dir_names if not d.startswith('shard-'))
+        if has_results(dir_path):
+            folders.append(dir_path)
+    return folders
+
+
+def remove_results(folder, keep=None):
+    """Remove the result files and shards of a folder and its shard sub-folders except keep, and emptied shard folders."""
+    for path in shard_folders(folder):
+        for f in os.listdir(path):
+            file_path = os.path.join(path, f)
+            if file_path != keep and (f.endswith('.json') or f.endswith(SHARD_SUFFIX)):
+                os.remove(file_path)
+        if path != folder and not os.listdir(path):
+            os.rmdir(path)
+
+
+def compact_folder(folder, delete=False):
+    """
+    Merge the result files and shards of a folder and its shard sub-folders into one sorted shard.
+
+    The shard is written to <folder>/results.jsonl (atomically) with the
+    write times of the merged records; with delete, the merged result files,
+    other shards and emptied shard folders are removed.
+
+    Returns:
+        Number of records written
+    """
+    compact_path = os.path.join(folder, COMPACT_NAME)
+    tmp_path = f'{compact_path}.{os.getpid()}.tmp'
+    count = 0
+    with open(tmp_path, 'w') as f_out:
+        try:
+            for key, written_at, result in merge_records(folder_sources(folder)):
+                f_out.write(record_line(key, result, written_at))
+                count += 1
+        except ShardException:
+            f_out.close()
+            os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, compact_path)
+    log.info(f'compacted {count} results into {compact_path}')
+
+    if delete:
+        remove_results(folder, keep=compact_path)
+        log.info(f'removed the merged result files and shards of {folder}')
+    return count
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="compact the result files and JSONL shards of every results folder into one sorted shard")
+    parser.add_argument('root', help='results round folder, e.g. results/round-2')
+    parser.add_argument('-d', '--delete', action='store_true',
+                        help='remove the result files and shards that were merged')
+    args = parser.parse_args()
+    try:
+        total = sum(compact_folder(folder, args.delete) for folder in result_folders(args.root))
+    except ShardException as se:
+        log.error(se)
+        return 1
+    log.info(f'{total} results in total')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+Nearest-node lookups on road graphs.
+
+KDTree is a small NumPy k-d tree for snapping points to graph nodes, e.g.
+nodes of a re-downloaded OSM graph whose coordinates moved slightly, or
+arbitrary lat/lon points. Longitude/latitude pairs are projected with an
+equirectangular approximation around the mean latitude, which is accurate
+enough at city scale.
+"""
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+
+
+class SpatialException(Exception):
+    """Custom exception class with message for this module."""
+
+    def __init__(self, value):
+        self.value = value
+        super().__init__(value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+def project_lonlat(lonlat, reference_lat=None):
+    """Planar coordinates in meters of (lon, lat) rows."""
+    lonlat = np.asarray(lonlat, dtype=float).reshape(-1, 2)
+    reference_lat = np.mean(lonlat[:, 1]) if reference_lat is None else reference_lat
+    scale = np.pi / 180.0 * EARTH_RADIUS_M
+    return np.column_stack([lonlat[:, 0] * scale * np.cos(np.radians(reference_lat)), lonlat[:, 1] * scale])
+
+
+class KDTree:
+    """
+    k-d tree over the rows of points with leaves of up to leaf_size points.
+
+    The tree is stored in flat arrays: points are permuted so that every
+    node covers a contiguous range, split by the median of the wider axis.
+    """
+
+    def __init__(self, points, leaf_size: int = 16):
+        self.points = np.asarray(points, dtype=float)
+        self.leaf_size = leaf_size
+        n = len(self.points)
+        self.index = np.arange(n)
+        # per node: start, end, split axis (-1 for leaves), split value, left and right child
+        self.start, self.end, self.axis, self.split, self.left, self.right = [], [], [], [], [], []
+        if n:
+            self._build(0, n)
+        self.start = np.array(self.start)
+        self.end = np.array(self.end)
+        self.axis = np.array(self.axis)
+        self.split = np.array(self.split)
+        self.left = np.array(self.left)
+        self.right = np.array(self.right)
+
+    def _new_node(self, start, end):
+        self.start.append(start)
+        self.end.append(end)
+        self.axis.append(-1)
+        self.split.append(0.0)
+        self.left.append(-1)
+        self.right.append(-1)
+        return len(self.start) - 1
+
+    def _build(self, start, end):
+        root = self._new_node(start, end)
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            start, end = self.start[node], self.end[node]
+            if end - start <= self.leaf_size:
+                continue
+            block = self.points[self.index[start:end]]
+            axis = int(np.argmax(block.max(axis=0) - block.min(axis=0)))
+            middle = (end - start) // 2
+            order = np.argpartition(block[:, axis], middle)
+            self.index[start:end] = self.index[start:end][order]
+            self.axis[node] = axis
+            self.split[node] = float(self.points[self.index[start + middle], axis])
+            self.left[node] = self._new_node(start, start + middle)
+            self.right[node] = self._new_node(start + middle, end)
+            stack.extend([self.left[node], self.right[node]])
+
+    def _query_one(self, point):
+        best_distance, best_index = np.inf, -1
+        stack = [(0, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if bound >= best_distance:
+                continue
+            if self.axis[node] < 0:
+                candidates = self.index[self.start[node]:self.end[node]]
+                distances = np.sum((self.points[candidates] - point) ** 2, axis=1)
+                nearest = int(np.argmin(distances))
+                if distances[nearest] < best_distance:
+                    best_distance, best_index = float(distances[nearest]), int(candidates[nearest])
+                continue
+            offset = point[self.axis[node]] - self.split[node]
+            near, far = (self.left[node], self.right[node]) if offset < 0 else (self.right[node], self.left[node])
+            # the far side is visited last, and only if it can still hold a closer point
+            stack.append((far, offset * offset))
+            stack.append((near, 0.0))
+        return np.sqrt(best_distance), best_index
+
+    def query(self, points):
+        """
+        Nearest stored point of each query point.
+
+        Returns:
+            Tuple (distances, indices) of arrays with one entry per query point
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, self.points.shape[1])
+        if len(self.points) == 0:
+            return np.full(len(points), np.inf), np.full(len(points), -1)
+        results = [self._query_one(point) for point in points]
+        return np.array([r[0] for r in results]), np.array([r[1] for r in results], dtype=np.int64)
+
+
+class NodeSnapper:
+    """Snaps lon/lat points to the nearest of a set of graph nodes."""
+
+    def __init__(self, node_ids, lonlat):
+        self.node_ids = np.asarray(node_ids)
+        lonlat = np.asarray(lonlat, dtype=float).reshape(-1, 2)
+        self.reference_lat = float(np.mean(lonlat[:, 1])) if len(lonlat) else 0.0
+        self.tree = KDTree(project_lonlat(lonlat, self.reference_lat))
+
+    def snap(self, lonlat, max_distance_m: float = np.inf):
+        """
+        Node ids nearest to the points, with their distances in meters.
+
+        Points farther than max_distance_m from every node get the id -1.
+        """
+        distances, indices = self.tree.query(project_lonlat(lonlat, self.reference_lat))
+        ids = np.where(indices >= 0, self.node_ids[np.maximum(indices, 0)], -1)
+        ids = np.where(distances <= max_distance_m, ids, -1)
+        return ids, distances
+
+
+def match_nodes(nodes, original_to_new, node_data, max_distance_m: float = 25.0):
+    """
+    Labels of graph nodes in the relabel data of an instance (seattle.json).
+
+    Nodes are looked up by OSM id, then by exact coordinates, and the
+    remaining ones (e.g. after OSM edits changed ids) are snapped to the
+    nearest stored node within max_distance_m. Keys of the relabel data are
+    strings, as written by json.dump. The map has to be injective, as
+    relabeling the graph merges nodes of the same label silently.
+
+    Args:
+        nodes: iterable of (OSM id, data) pairs with data['x'], data['y'] as lon/lat
+        original_to_new: {OSM id: label}
+        node_data: {OSM id: {'x': lon, 'y': lat, ...}}
+
+    Returns:
+        Tuple (relabel map {OSM id: label}, number of snapped nodes, list of unmatched OSM ids)
+
+    Raises:
+        SpatialException: several nodes match the same label
+    """
+    by_coordinates = {(data['x'], data['y']): osm_id for osm_id, data in node_data.items()}
+    matches, missing = [], []
+    for node, data in nodes:
+        osm_id = str(node)
+        if osm_id not in original_to_new:
+            osm_id = by_coordinates.get((data['x'], data['y']))
+        if osm_id is None:
+            missing.append((node, data['x'], data['y']))
+        else:
+            matches.append((0.0, node, original_to_new[osm_id]))
+    unmatched = []
+    if missing:
+        stored = list(node_data)
+        snapper = NodeSnapper(np.arange(len(stored)), [[node_data[i]['x'], node_data[i]['y']] for i in stored])
+        rows, distances = snapper.snap([[x, y] for _, x, y in missing], max_distance_m)
+        for (node, _, _), row, distance in zip(missing, rows.tolist(), distances.tolist()):
+            if row < 0:
+                unmatched.append(node)
+            else:
+                matches.append((distance, node, original_to_new[stored[row]]))
+    relabel_map, matched_by, collisions = {}, {}, []
+    # closest match first, ties in graph order
+    for _, node, label in sorted(matches, key=lambda match: match[0]):
+        if label in matched_by:
+            collisions.append((node, matched_by[label], label))
+        else:
+            matched_by[label] = node
+            relabel_map[node] = label
+    if collisions:
+        raise SpatialException(f'{len(collisions)} graph nodes match the label of a closer node, e.g. '
+                               f'(OSM id, closer OSM id, label) {collisions[:5]}')
+    return relabel_map, len(missing) - len(unmatched), unmatched
@@ -0,0 +1,387 @@
+"""
+Results store of all rounds.
+
+results/store.db holds the results of every round in one table, partitioned
+by round, and the provenance of every round (jar hash, git commit, CPLEX
+settings, host and date of the run generation, and of the ingestion):
+
+    rounds(roundId, name, provenance, ingestedAt)
+    results(roundId, instanceName, numVehicles, ..., normIndex, numNodes, resultFile)
+
+Values are text, as in the per-round results.db of update_db. An index on
+(instanceName, numVehicles, objective, pNorm, fairnessCoefficient, roundId)
+serves both the lookups of a round and the latest run of every key.
+
+connect() opens the store with the tables of the per-round databases,
+vehi3 ... vehi7, as temporary views of one round or of the latest round of
+every key, so the queries of queries.py, pareto.py and the run generator
+work on any round without copying data. A per-round results.db (e.g. the
+published results/round-2/results.db) is opened as it is.
+
+    python -m postprocessing.store rounds
+    python -m postprocessing.store import ../../../../results/round-2/results.db -r round-2
+    python -m postprocessing.store compare round-2 round-3
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime, timezone
+from statistics import median
+
+log = logging.getLogger(__name__)
+
+STORE_FILE = 'store.db'
+PROVENANCE_FILE = 'PROVENANCE'
+RESULT_COLUMNS = ['instanceName', 'numVehicles', 'numTargets', 'objective', 'pNorm', 'fairnessCoefficient',
+                  'LengthOfTours', 'SumOfTours', 'GapToOpt', 'computationTimeInSec', 'GiniIndex', 'JainIndex',
+                  'normIndex']
+KEY_COLUMNS = ['instanceName', 'numVehicles', 'objective', 'pNorm', 'fairnessCoefficient']
+VEHICLE_TABLES = [3, 4, 5, 6, 7]
+LATEST = 'latest'
+# gap (in percent, as rounded by the solver) up to which a run counts as solved to optimality
+OPTIMAL_GAP = 0.01
+
+
+class StoreException(Exception):
+    """Custom exception class with message for this module."""
+
+    def __init__(self, value):
+        self.value = value
+        super().__init__(value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+def get_base_path() -> str:
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../../..'))
+
+
+def get_store_path() -> str:
+    return os.path.join(get_base_path(), 'results', STORE_FILE)
+
+
+def default_database() -> str:
+    """The store if it exists, the published results/round-2/results.db otherwise."""
+    store_path = get_store_path()
+    if os.path.isfile(store_path):
+        return store_path
+    return os.path.join(get_base_path(), 'results', 'round-2', 'results.db')
+
+
+def create_schema(connection):
+    connection.executescript(f"""
+        CREATE TABLE IF NOT EXISTS rounds (
+            roundId INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, provenance TEXT, ingestedAt TEXT);
+        CREATE TABLE IF NOT EXISTS results (
+            roundId INTEGER NOT NULL, {', '.join(RESULT_COLUMNS)}, numNodes, resultFile);
+        CREATE INDEX IF NOT EXISTS results_key ON results ({', '.join(KEY_COLUMNS)}, roundId);
+        CREATE INDEX IF NOT EXISTS results_round ON results (roundId, numVehicles);
+        """)
+
+
+def is_store(connection):
+    return connection.execute(
+        "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN ('rounds', 'results')").fetchone()[0] == 2
+
+
+def get_round_id(connection, name):
+    row = connection.execute('SELECT roundId FROM rounds WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        known = [r[0] for r in connection.execute('SELECT name FROM rounds ORDER BY roundId')]
+        raise StoreException(f'no round {name} in the store, rounds are {known}')
+    return row[0]
+
+
+def begin_round(connection, name, provenance):
+    """
+    Empty the partition of a round for a new ingestion and record its provenance.
+
+    A round keeps its id, i.e. its place in the order of rounds that decides
+    which run of a key is the latest, when it is ingested again.
+
+    Returns:
+        roundId of the round
+    """
+    create_schema(connection)
+    ingested_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    row = connection.execute('SELECT roundId FROM rounds WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        cursor = connection.execute('INSERT INTO rounds (name, provenance, ingestedAt) VALUES (?, ?, ?)',
+                                    (name, json.dumps(provenance), ingested_at))
+        return cursor.lastrowid
+    connection.execute('DELETE FROM results WHERE roundId = ?', (row[0],))
+    connection.execute('UPDATE rounds SET provenance = ?, ingestedAt = ? WHERE roundId = ?',
+                       (json.dumps(provenance), ingested_at, row[0]))
+    return row[0]
+
+
+def insert_results(connection, round_id, rows):
+    """Insert rows of RESULT_COLUMNS values plus numNodes and resultFile; values are stored as text."""
+    placeholders = ', '.join('?' * (len(RESULT_COLUMNS) + 3))
+    connection.executemany(f'INSERT INTO results VALUES ({placeholders})',
+                           ([round_id] + [None if v is None else str(v) for v in row] for row in rows))
+
+
+def _view_sql(num_vehicles, round_id):
+    columns = ', '.join(f'r.{c}' for c in RESULT_COLUMNS)
+    if round_id is not None:
+        partition = f'r.roundId = {int(round_id)}'
+    else:
+        same_key = ' AND '.join(f's.{c} = r.{c}' for c in KEY_COLUMNS)
+        partition = f'r.roundId = (SELECT max(s.roundId) FROM results AS s WHERE {same_key})'
+    return (f"CREATE TEMP VIEW vehi{num_vehicles} AS SELECT {columns} FROM results AS r "
+            f"WHERE r.numVehicles = '{num_vehicles}' AND {partition}")
+
+
+def connect(db_path, round_name=None):
+    """
+    Connection to a results database with tables vehi3 ... vehi7.
+
+    Args:
+        db_path: the store or a per-round results.db
+        round_name: round of the store to read, None or 'latest' for the
+            latest round of every key; ignored for a per-round database
+
+    Returns:
+        sqlite3 connection
+    """
+    if not os.path.isfile(db_path):
+        raise StoreException(f'no results database {db_path}')
+    connection = sqlite3.connect(db_path)
+    if not is_store(connection):
+        if round_name not in (None, LATEST):
+            log.warning(f'{db_path} holds a single round, --round {round_name} is ignored')
+        return connection
+    selected = None if round_name in (None, LATEST) else get_round_id(connection, round_name)
+    counts = {int(row[0]) for row in connection.execute('SELECT DISTINCT numVehicles FROM results')}
+    for num_vehicles in sorted(set(VEHICLE_TABLES) | counts):
+        connection.execute(_view_sql(num_vehicles, selected))
+    return connection
+
+
+def vehicle_tables(connection):
+    """Names of the vehi<n> tables of a per-round database or the vehi<n> views of connect()."""
+    rows = connection.execute("""
+        SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'vehi%'
+        UNION SELECT name FROM sqlite_temp_master WHERE type = 'view' AND name LIKE 'vehi%'""").fetchall()
+    return sorted(row[0] for row in rows)
+
+
+def _git(*args):
+    try:
+        completed = subprocess.run(['git', *args], cwd=get_base_path(), capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return completed.stdout.strip() if completed.returncode == 0 else None
+
+
+def git_commit():
+    """Commit of the checkout, with a -dirty suffix if tracked files were changed; None without git."""
+    commit = _git('rev-parse', 'HEAD')
+    status = _git('status', '--porcelain', '--untracked-files=no')
+    if commit is not None and status:
+        commit += '-dirty'
+    return commit
+
+
+def cplex_parameters(solver_source=None):
+    """CPLEX parameters set in BranchAndCutSolver.kt (lines not commented out)."""
+    solver_source = solver_source or os.path.join(get_base_path(), 'app', 'src', 'main', 'kotlin', 'fairMTSP',
+                                                  'solver', 'BranchAndCutSolver.kt')
+    if not os.path.isfile(solver_source):
+        return None
+    parameters = {}
+    with open(solver_source, 'r') as fin:
+        for line in fin:
+            match = re.match(r'\s*cplex\.setParam\(IloCplex\.Param\.([\w.]+),\s*(.+)\)\s*$', line)
+            if match is not None:
+                parameters[match.group(1)] = match.group(2).strip()
+    return parameters
+
+
+def provenance(jar_path=None, cplex_lib_path=None, settings=None):
+    """
+    Provenance of a sweep generated now: jar hash, git commit, CPLEX settings, host and date.
+
+    Args:
+        jar_path: solver jar of the runs
+        cplex_lib_path: CPLEX library folder of the runs (its version is part of the path)
+        settings: further settings of the runs, e.g. time limit and JVM heaps
+    """
+    from postprocessing.instance import file_hash
+
+    version = re.search(r'CPLEX_Studio(\d+)', cplex_lib_path or '')
+    return {
+        'jarSha1': file_hash(jar_path) if jar_path is not None and os.path.isfile(jar_path) else None,
+        'gitCommit': git_commit(),
+        'cplex': {
+            'version': version.group(1) if version else None,
+            'libraryPath': cplex_lib_path,
+            'parameters': cplex_parameters(),
+        },
+        'settings': settings or {},
+        'host': platform.node(),
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+
+
+def write_provenance(folder, data):
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, PROVENANCE_FILE), 'w') as f_out:
+        json.dump(data, f_out, indent=1)
+
+
+def read_provenance(folder):
+    """Contents of the PROVENANCE file of a folder, None if it has none."""
+    path = os.path.join(folder, PROVENANCE_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as fin:
+        return json.load(fin)
+
+
+def rounds(connection):
+    """[(name, number of results, provenance, ingestedAt)] in round order."""
+    rows = connection.execute("""
+        SELECT name, (SELECT count(*) FROM results WHERE results.roundId = rounds.roundId), provenance, ingestedAt
+        FROM rounds ORDER BY roundId""").fetchall()
+    return [(name, count, json.loads(data) if data else {}, ingested_at) for name, count, data, ingested_at in rows]
+
+
+def import_database(connection, legacy_path, name, provenance_data=None):
+    """Copy the vehi<n> tables of a per-round results.db into a round of the store."""
+    legacy = sqlite3.connect(legacy_path)
+    try:
+        tables = vehicle_tables(legacy)
+        round_id = begin_round(connection, name, provenance_data or {'importedFrom': os.path.abspath(legacy_path)})
+        count = 0
+        for table in tables:
+            rows = legacy.execute(f'SELECT {", ".join(RESULT_COLUMNS)} FROM {table}').fetchall()
+            insert_results(connection, round_id, [list(row) + [None, None] for row in rows])
+            count += len(rows)
+    finally:
+        legacy.close()
+    connection.commit()
+    return count
+
+
+def is_optimal(gap_percent):
+    """True if a run with this optimality gap (in percent) counts as solved to optimality."""
+    return gap_percent is not None and float(gap_percent) <= OPTIMAL_GAP
+
+
+def _round_rows(connection, name):
+    """{key: (GapToOpt, SumOfTours, computationTimeInSec)} of a round, the first ingested row of a key."""
+    rows = connection.execute(f"""
+        SELECT {', '.join(KEY_COLUMNS)}, GapToOpt, SumOfTours, computationTimeInSec
+        FROM results WHERE roundId = ? ORDER BY rowid""", (get_round_id(connection, name),)).fetchall()
+    by_key = {}
+    for row in rows:
+        # a round can hold a key twice, e.g. delta-fair fc 0.0 runs of the deltaFair and minmaxFair folders
+        by_key.setdefault(tuple(row[:len(KEY_COLUMNS)]), row[len(KEY_COLUMNS):])
+    return by_key
+
+
+def compare_rounds(connection, old, new):
+    """
+    Runs of the keys that both rounds solved, e.g. of two solver versions.
+
+    Every round contributes one run per key, the first ingested one. A run is
+    optimal by is_optimal(), and two optimal sums of tours differ when they are
+    further apart than that gap.
+
+    Returns:
+        Dictionary with the number of common keys, keys solved to optimality
+        in only one of them, keys with a different optimal sum of tours and
+        the median ratio of the computation times new / old
+    """
+    old_rows, new_rows = _round_rows(connection, old), _round_rows(connection, new)
+    common = sorted(set(old_rows) & set(new_rows))
+    only_old, only_new, different, ratios = [], [], [], []
+    for key in common:
+        (gap_old, sum_old, time_old), (gap_new, sum_new, time_new) = old_rows[key], new_rows[key]
+        # GapToOpt is a fraction, OPTIMAL_GAP a percentage
+        solved_old, solved_new = is_optimal(float(gap_old) * 100), is_optimal(float(gap_new) * 100)
+        if solved_old and not solved_new:
+            only_old.append(key)
+        elif solved_new and not solved_old:
+            only_new.append(key)
+        elif solved_old and abs(float(sum_old) - float(sum_new)) > OPTIMAL_GAP / 100 * max(1.0, abs(float(sum_old))):
+            different.append(key)
+        if float(time_old) > 0.0:
+            ratios.append(float(time_new) / float(time_old))
+    return {'common': len(common), 'solvedOnlyOld': only_old, 'solvedOnlyNew': only_new,
+            'differentOptimum': different, 'medianTimeRatio': median(ratios) if ratios else None}
+
+
+def _print_rounds(connection):
+    for name, count, data, ingested_at in rounds(connection):
+        runs = data.get('runs', {}) if isinstance(data, dict) else {}
+        commits = sorted({p.get('gitCommit', '')[:10] for p in runs.values() if p.get('gitCommit')})
+        jars = sorted({p.get('jarSha1', '')[:10] for p in runs.values() if p.get('jarSha1')})
+        print(f'{name:<16} {count:>8} results  ingested {ingested_at}  commits {",".join(commits) or "-"}  '
+              f'jars {",".join(jars) or "-"}')
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.INFO)
+    parser = argparse.ArgumentParser(description="rounds, provenance and comparisons of the results store")
+    parser.add_argument('-s', '--store', default=None, help='results store (default: results/store.db)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rounds', help='rounds of the store with their provenance')
+    show = commands.add_parser('provenance', help='print the provenance of a round')
+    show.add_argument('round')
+    importing = commands.add_parser('import', help='import a per-round results.db as a round')
+    importing.add_argument('database')
+    importing.add_argument('-r', '--round', required=True, help='name of the round')
+    compare = commands.add_parser('compare', help='compare the runs of two rounds')
+    compare.add_argument('old')
+    compare.add_argument('new')
+    compare.add_argument('-l', '--list', action='store_true', help='list the keys that differ')
+    args = parser.parse_args()
+    store_path = args.store or get_store_path()
+
+    try:
+        if args.command != 'import' and not os.path.isfile(store_path):
+            raise StoreException(f'no results store {store_path}')
+        connection = sqlite3.connect(store_path)
+        try:
+            if args.command == 'import':
+                create_schema(connection)
+                count = import_database(connection, args.database, args.round)
+                log.info(f'imported {count} results of {args.database} as round {args.round} into {store_path}')
+            elif args.command == 'rounds':
+                _print_rounds(connection)
+            elif args.command == 'provenance':
+                data = connection.execute('SELECT provenance FROM rounds WHERE roundId = ?',
+                                          (get_round_id(connection, args.round),)).fetchone()[0]
+                print(json.dumps(json.loads(data), indent=1))
+            else:
+                comparison = compare_rounds(connection, args.old, args.new)
+                print(f"{comparison['common']} keys in both rounds, median time ratio "
+                      f"{args.new}/{args.old}: {comparison['medianTimeRatio']}")
+                for field in ['solvedOnlyOld', 'solvedOnlyNew', 'differentOptimum']:
+                    print(f'{field:<18} {len(comparison[field]):>6}')
+                    if args.list:
+                        for key in comparison[field]:
+                            print(f'    {key}')
+                if comparison['differentOptimum']:
+                    return 1
+        finally:
+            connection.close()
+    except StoreException as se:
+        log.error(se)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
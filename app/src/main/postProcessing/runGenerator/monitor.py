@@ -0,0 +1,466 @@
+"""
+Live progress of running sweeps.
+
+Follows the run folders (runs/<type>) of a sweep while it runs: the runs
+files name the cases, result files and JSONL shards in the results folders
+of the runs lines mark them completed, and SLURM outputs (output/slurm-*.out)
+and run-local.sh outputs (output/local-*.out) mark them started or failed
+with the failure classes of triage.py. Folders are polled cheaply: a folder
+is listed again only when its modification time changed, outputs and shards
+are read from the offset of the last poll, and completed cases are not
+looked at any more.
+
+A case is completed with a result, failed when its latest output shows a
+failure or its task ended without a result, running while its SLURM task is
+in squeue (without SLURM: while its output changed within the walltime of
+slurm-batch-job.sh) and pending otherwise. The monitor reports these counts
+per run type, the solves per hour of the last --window hours, the predicted
+remaining run time (sharding.RuntimePredictor, less the elapsed time of
+running cases), the ETA with the running tasks as slots and the slowest
+outstanding cases, as a terminal view and, with --json, as a JSON snapshot
+rewritten on every poll. Elapsed times come from squeue; without SLURM they
+count from the first poll that saw the output.
+
+    python monitor.py                                   # all run folders below runs/
+    python monitor.py ../../../../runs/eps-fair --once --json progress.json
+"""
+import argparse
+import getpass
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from sharding import TIME_LIMIT, RuntimePredictor, case_key, load_runtime_history, parse_runs_line
+from triage import GET_LINE_PATTERN, OUTPUT_FILE_PATTERN, classify_output, read_walltime, result_file_name, \
+    walltime_seconds
+from postprocessing import shards, store
+
+log = logging.getLogger(__name__)
+
+LOCAL_OUTPUT_PATTERN = re.compile(r'local-(\d+)\.out$')
+RUNS_FILE_SUFFIX = '_runs.txt'
+STATUSES = ['completed', 'running', 'failed', 'pending']
+# characters of an output kept between polls, so that patterns split by a poll are found
+OUTPUT_TAIL = 256
+
+
+class MonitorException(Exception):
+    """Custom exception class with message for this module."""
+
+    def __init__(self, value):
+        self.value = value
+        super().__init__(value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+def slurm_running_tasks():
+    """
+    {(job, task): elapsed seconds} of the running array tasks of the user.
+
+    Returns:
+        None without SLURM or if squeue fails
+    """
+    if shutil.which('squeue') is None:
+        return None
+    try:
+        text = subprocess.run(['squeue', '-h', '-t', 'R', '-u', getpass.getuser(), '-o', '%i %M'],
+                              capture_output=True, text=True, timeout=30, check=True).stdout
+    except (subprocess.SubprocessError, OSError) as e:
+        log.warning(f'squeue failed: {e}')
+        return None
+    running = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) == 2 and re.fullmatch(r'\d+_\d+', fields[0]):
+            job, task = fields[0].split('_')
+            running[(int(job), int(task))] = walltime_seconds(fields[1])
+    return running
+
+
+class ResultWatcher:
+    """Result file names and shard keys of a results folder with the time they appeared."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.done = {}
+        self._mtime = None
+        self._offsets = {}
+
+    def poll(self, now, first):
+        """Pick up new results; results found on the first poll in shards have no time (None)."""
+        try:
+            mtime = os.stat(self.folder).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            self._mtime = mtime
+            for f in os.listdir(self.folder):
+                if f.endswith('.json') and f not in self.done:
+                    try:
+                        self.done[f] = os.stat(os.path.join(self.folder, f)).st_mtime
+                    except FileNotFoundError:
+                        continue
+                elif f.endswith(shards.SHARD_SUFFIX):
+                    self._offsets.setdefault(os.path.join(self.folder, f), 0)
+        for path, offset in self._offsets.items():
+            try:
+                size = os.stat(path).st_size
+            except FileNotFoundError:
+                continue
+            if size < offset:
+                # rewritten, e.g. compacted
+                offset = self._offsets[path] = 0
+            if size > offset:
+                keys, self._offsets[path] = shards.follow_shard(path, offset)
+                for key in keys:
+                    self.done.setdefault(key, None if first else now)
+
+
+class RunFolder:
+    """Cases, results and outputs of one run folder (runs/<type>)."""
+
+    def __init__(self, path, predictor, runs_file=None):
+        self.path = path
+        self.run_type = os.path.basename(os.path.normpath(path))
+        self.predictor = predictor
+        self.runs_file = runs_file
+        self.cases = {}
+        self.lines = {}
+        self.watchers = {}
+        self.outputs = {}
+        self.statuses = {}
+        self.predicted = {}
+        job_script = os.path.join(path, 'slurm-batch-job.sh')
+        # without SLURM, a task whose output did not change for a walltime has ended
+        self.stale_after = walltime_seconds((os.path.isfile(job_script) and read_walltime(job_script)) or '2:15:00')
+        self._runs_mtimes = {}
+        self._output_mtime = None
+        self._warned_local = False
+
+    def _read_runs_files(self):
+        for f in sorted(os.listdir(self.path)):
+            if not f.endswith(RUNS_FILE_SUFFIX):
+                continue
+            file_path = os.path.join(self.path, f)
+            mtime = os.stat(file_path).st_mtime_ns
+            if self._runs_mtimes.get(f) == mtime:
+                continue
+            self._runs_mtimes[f] = mtime
+            with open(file_path, 'r') as fin:
+                for line_number, line in enumerate(fin, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        case = parse_runs_line(line)
+                    except ValueError as e:
+                        log.warning(f'{file_path}:{line_number}: {e}')
+                        continue
+                    tokens = line.split()
+                    key = case_key(*case)
+                    results_path = os.path.normpath(os.path.join(self.path, tokens[tokens.index('-r') + 1]))
+                    self.cases.setdefault(key, {'case': case, 'results': results_path,
+                                                'name': result_file_name(case)})
+                    self.lines[(f, line_number)] = key
+                    if results_path not in self.watchers:
+                        self.watchers[results_path] = ResultWatcher(results_path)
+
+    def _local_runs_file(self):
+        if self.runs_file is not None:
+            return self.runs_file
+        runs_files = [f for f in self._runs_mtimes if not f.startswith('requeue_')]
+        if len(runs_files) == 1:
+            return runs_files[0]
+        if not self._warned_local:
+            log.warning(f'{self.path}: local outputs do not name their runs file, pass --runs')
+            self._warned_local = True
+        return None
+
+    def _scan_outputs(self, now):
+        output_path = os.path.join(self.path, 'output')
+        try:
+            mtime = os.stat(output_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._output_mtime:
+            self._output_mtime = mtime
+            for f in os.listdir(output_path):
+                if f in self.outputs:
+                    continue
+                slurm, local = OUTPUT_FILE_PATTERN.search(f), LOCAL_OUTPUT_PATTERN.search(f)
+                if slurm:
+                    job, task = int(slurm.group(1)), int(slurm.group(2))
+                    runs_file = None
+                elif local:
+                    job, task = 0, int(local.group(1))
+                    runs_file = self._local_runs_file()
+                else:
+                    continue
+                self.outputs[f] = {'path': os.path.join(output_path, f), 'job': job, 'task': task,
+                                   'slurm': bool(slurm), 'runs_file': runs_file, 'line': task, 'failure': None,
+                                   'offset': 0, 'tail': '', 'mtime': None, 'first_seen': now}
+
+    def _follow_output(self, entry):
+        try:
+            stat = os.stat(entry['path'])
+        except FileNotFoundError:
+            return
+        entry['mtime'] = stat.st_mtime
+        if stat.st_size <= entry['offset']:
+            return
+        with open(entry['path'], 'rb') as fin:
+            fin.seek(entry['offset'])
+            chunk = fin.read()
+        entry['offset'] += len(chunk)
+        text = entry['tail'] + chunk.decode(errors='replace')
+        if entry['slurm'] and entry['runs_file'] is None:
+            match = GET_LINE_PATTERN.search(text)
+            if match:
+                entry['line'] = int(match.group(1))
+                entry['runs_file'] = os.path.basename(match.group(2))
+        if entry['failure'] is None:
+            entry['failure'] = classify_output(text)
+        entry['tail'] = text[-OUTPUT_TAIL:]
+
+    def _predict(self, key):
+        if key not in self.predicted:
+            try:
+                self.predicted[key] = self.predictor.predict(self.cases[key]['case'])
+            except (OSError, ValueError):
+                self.predicted[key] = TIME_LIMIT
+        return self.predicted[key]
+
+    def poll(self, now, first, slurm_tasks):
+        """Update the status of every case: (status, failure class, elapsed seconds, completion time)."""
+        self._read_runs_files()
+        for watcher in self.watchers.values():
+            watcher.poll(now, first)
+        self._scan_outputs(now)
+
+        # latest output of every case that has no result yet; requeued tasks leave older outputs behind
+        latest = {}
+        for entry in self.outputs.values():
+            key = self.lines.get((entry['runs_file'], entry['line'])) if entry['runs_file'] else None
+            if entry['slurm'] and entry['runs_file'] is None:
+                # the header with the runs line is not written yet
+                self._follow_output(entry)
+                key = self.lines.get((entry['runs_file'], entry['line'])) if entry['runs_file'] else None
+            if key is None or self.cases[key]['name'] in self.watchers[self.cases[key]['results']].done:
+                continue
+            order = (entry['job'], entry['first_seen'])
+            if key not in latest or order > (latest[key]['job'], latest[key]['first_seen']):
+                latest[key] = entry
+
+        self.statuses = {}
+        for key, case in self.cases.items():
+            done = self.watchers[case['results']].done
+            if case['name'] in done:
+                self.statuses[key] = ('completed', None, None, done[case['name']])
+                continue
+            entry = latest.get(key)
+            if entry is None:
+                self.statuses[key] = ('pending', None, None, None)
+                continue
+            self._follow_output(entry)
+            if entry['failure'] is not None:
+                self.statuses[key] = ('failed', entry['failure'], None, None)
+            elif entry['slurm'] and slurm_tasks is not None:
+                if (entry['job'], entry['task']) in slurm_tasks:
+                    self.statuses[key] = ('running', None, slurm_tasks[(entry['job'], entry['task'])], None)
+                else:
+                    self.statuses[key] = ('failed', 'missing-result', None, None)
+            elif entry['mtime'] is not None and now - entry['mtime'] > self.stale_after:
+                self.statuses[key] = ('failed', 'missing-result', None, None)
+            else:
+                self.statuses[key] = ('running', None, now - entry['first_seen'], None)
+
+    def counts(self):
+        counts = Counter(status for status, _, _, _ in self.statuses.values())
+        summary = {status: counts.get(status, 0) for status in STATUSES}
+        summary['total'] = len(self.statuses)
+        summary['failures'] = dict(Counter(failure for status, failure, _, _ in self.statuses.values()
+                                           if status == 'failed').most_common())
+        return summary
+
+    def outstanding(self):
+        """(key, status, elapsed seconds, predicted seconds) of the running and pending cases."""
+        return [(key, status, elapsed, self._predict(key))
+                for key, (status, _, elapsed, _) in self.statuses.items() if status in ('running', 'pending')]
+
+
+class Controller:
+    def __init__(self, config):
+        self.config = config
+        self.folders = []
+        self.started = None
+
+    def run(self):
+        history = load_runtime_history(self.config.history_db)
+        for path in self.config.run_paths:
+            data_path = os.path.join(path, 'data')
+            predictor = RuntimePredictor(data_path if os.path.isdir(data_path) else self.config.data_path, history)
+            self.folders.append(RunFolder(path, predictor, self.config.runs_file))
+        self.started = time.time()
+        first = True
+        try:
+            while True:
+                now = time.time()
+                slurm_tasks = slurm_running_tasks()
+                for folder in self.folders:
+                    folder.poll(now, first, slurm_tasks)
+                snapshot = self.snapshot(now, first)
+                if self.config.json_path is not None:
+                    self._write_snapshot(snapshot)
+                self._print_view(snapshot, clear=not self.config.once and sys.stdout.isatty())
+                first = False
+                if self.config.once:
+                    break
+                time.sleep(self.config.interval)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    def snapshot(self, now, first=False):
+        """Progress of all run folders as a JSON-serializable dictionary."""
+        run_types = {folder.run_type: folder.counts() for folder in self.folders}
+        total = {status: sum(counts[status] for counts in run_types.values()) for status in STATUSES + ['total']}
+
+        times = [t for folder in self.folders for _, _, _, t in folder.statuses.values() if t is not None]
+        observed = now - self.config.window * 3600
+        untimed = any(t is None for folder in self.folders for status, _, _, t in folder.statuses.values()
+                      if status == 'completed')
+        if untimed:
+            # shard records found on the first poll have no time, count from the start of the monitor
+            observed = max(observed, self.started)
+        span = now - observed
+        recent = sum(1 for t in times if t >= observed)
+        rate = None if untimed and first else recent * 3600 / span
+
+        outstanding = [(folder.run_type, key, status, elapsed, predicted)
+                       for folder in self.folders for key, status, elapsed, predicted in folder.outstanding()]
+        remaining = sum(max(predicted - (elapsed or 0.0), 0.0) for _, _, _, elapsed, predicted in outstanding)
+        slots = self.config.slots or max(total['running'], 1)
+        left = total['running'] + total['pending']
+        slowest = sorted(outstanding, key=lambda it: (-max(it[4], it[3] or 0.0), it[0], it[1]))[:self.config.top]
+        return {
+            'time': datetime.fromtimestamp(now, timezone.utc).isoformat(timespec='seconds'),
+            'runTypes': run_types,
+            'total': total,
+            'solvesPerHour': None if rate is None else round(rate, 2),
+            'windowHours': round(span / 3600, 3),
+            'remainingHours': round(remaining / 3600, 3),
+            'slots': slots,
+            'etaHours': round(remaining / 3600 / slots, 3) if left else 0.0,
+            'etaHoursAtRate': round(left / rate, 3) if rate else None,
+            'slowest': [{'runType': run_type, 'instanceName': key[0], 'numVehicles': key[1], 'objective': key[2],
+                         'fairnessCoefficient': key[3], 'pNorm': key[4], 'status': status,
+                         'elapsedSeconds': None if elapsed is None else round(elapsed),
+                         'predictedSeconds': round(predicted)}
+                        for run_type, key, status, elapsed, predicted in slowest],
+        }
+
+    def _write_snapshot(self, snapshot):
+        tmp_path = f'{self.config.json_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f_out:
+            json.dump(snapshot, f_out, indent=1)
+        os.replace(tmp_path, self.config.json_path)
+
+    @staticmethod
+    def _print_view(snapshot, clear):
+        lines = []
+        width = max([len(name) for name in snapshot['runTypes']] + [len('run type')])
+        header = f'{"run type":<{width}}  ' + '  '.join(f'{status:>9}' for status in STATUSES + ['total']) + '       %'
+        lines.append(f'{snapshot["time"]}')
+        lines.append(header)
+        lines.append('-' * len(header))
+        for name, counts in list(snapshot['runTypes'].items()) + [('total', snapshot['total'])]:
+            done = 100.0 * counts['completed'] / counts['total'] if counts['total'] else 0.0
+            lines.append(f'{name:<{width}}  ' + '  '.join(f'{counts[status]:>9}' for status in STATUSES + ['total'])
+                         + f'  {done:6.1f}')
+        failures = Counter()
+        for counts in snapshot['runTypes'].values():
+            failures.update(counts['failures'])
+        if failures:
+            lines.append('failures: ' + ', '.join(f'{name} {count}' for name, count in failures.most_common()))
+        at_rate = '' if snapshot['etaHoursAtRate'] is None else f', {snapshot["etaHoursAtRate"]:.1f} h at this rate'
+        rate = '-' if snapshot['solvesPerHour'] is None else f'{snapshot["solvesPerHour"]:.1f}'
+        lines.append(f'{rate} solves/h over the last {snapshot["windowHours"]:.2f} h, '
+                     f'{snapshot["remainingHours"]:.1f} h of predicted run time left, '
+                     f'ETA {snapshot["etaHours"]:.1f} h on {snapshot["slots"]} slots{at_rate}')
+        if snapshot['slowest']:
+            lines.append('')
+            lines.append(f'{"slowest outstanding":<{max(width, 19)}}  {"case":<40} {"status":>8} {"elapsed":>9} '
+                         f'{"predicted":>9}')
+            for case in snapshot['slowest']:
+                label = (f'{case["instanceName"]} v{case["numVehicles"]} {case["objective"]} '
+                         f'fc {case["fairnessCoefficient"]} p {case["pNorm"]}')
+                elapsed = '-' if case['elapsedSeconds'] is None else f'{case["elapsedSeconds"] / 3600:.2f} h'
+                lines.append(f'{case["runType"]:<{max(width, 19)}}  {label:<40} {case["status"]:>8} {elapsed:>9} '
+                             f'{case["predictedSeconds"] / 3600:7.2f} h')
+        if clear:
+            print('\033[H\033[J', end='')
+        print('\n'.join(lines), flush=True)
+
+
+def handle_command_line():
+    parser = argparse.ArgumentParser(description="follow the progress and throughput of running sweeps")
+    parser.add_argument("run_paths", nargs='*',
+                        help="run folders (runs/<type>) to follow, default all run folders below runs/")
+    parser.add_argument("-i", "--interval", type=float, default=30.0, help="seconds between polls")
+    parser.add_argument("--once", action="store_true", help="print the progress once and exit")
+    parser.add_argument("-j", "--json", default=None, help="JSON snapshot file, rewritten on every poll")
+    parser.add_argument("-w", "--window", type=float, default=1.0, help="hours of the solves per hour")
+    parser.add_argument("-s", "--slots", type=int, default=None,
+                        help="parallel runs of the ETA, default the number of running cases")
+    parser.add_argument("-t", "--top", type=int, default=10, help="number of slowest outstanding cases")
+    parser.add_argument("-r", "--runs", default=None,
+                        help="runs file of the run-local.sh outputs if a run folder holds several")
+    parser.add_argument("-d", "--data", default=None,
+                        help="instance folder for run folders without data/ (default: app/data)")
+    parser.add_argument("-db", "--history", default=None,
+                        help="results database with earlier run times")
+    args = parser.parse_args()
+
+    base_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../../..'))
+    run_paths = [os.path.abspath(path) for path in args.run_paths]
+    if not run_paths:
+        runs_path = os.path.join(base_path, 'runs')
+        if os.path.isdir(runs_path):
+            run_paths = [os.path.join(runs_path, d) for d in sorted(os.listdir(runs_path))
+                         if os.path.isdir(os.path.join(runs_path, d))
+                         and any(f.endswith(RUNS_FILE_SUFFIX) for f in os.listdir(os.path.join(runs_path, d)))]
+    if not run_paths:
+        raise MonitorException('no run folders with runs files, pass runs/<type> folders')
+    for path in run_paths:
+        if not os.path.isdir(path):
+            raise MonitorException(f'{path} is not a folder')
+
+    config = argparse.Namespace(
+        run_paths=run_paths, interval=args.interval, once=args.once, json_path=args.json, window=args.window,
+        slots=args.slots, top=args.top, runs_file=args.runs,
+        data_path=args.data or os.path.join(base_path, 'app', 'data'),
+        history_db=args.history or store.default_database())
+    return config
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.INFO)
+    try:
+        controller = Controller(handle_command_line())
+        return controller.run()
+    except MonitorException as me:
+        log.error(me)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
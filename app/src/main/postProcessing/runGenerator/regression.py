@@ -0,0 +1,353 @@
+"""
+Regression runs of the solver on a quick set of small instances.
+
+Every case of the quick set (small TSPLIB and CVRPLIB instances with all five
+objectives) is solved several times with the uber.jar, in parallel, and the
+computation time, wall time, branch-and-bound node count, gap and objective
+value of each run are collected. With --save the runs are stored as the
+baseline database; otherwise they are compared with it:
+
+- a case whose optimal objective value differs from the baseline by more
+  than the relative gap of either run, or that the baseline solved and that
+  fails now, is a correctness failure,
+- a case is slower when a one-sided Mann-Whitney U test over the repeated
+  runs rejects "not slower" at level --alpha and the median slowed down by
+  more than --minSlowdown; node counts are tested the same way.
+
+Parallel runs compete for the cores, keep --jobs and CPLEX threads fixed
+between the baseline and the comparison.
+
+    python regression.py --save -n 5
+    python regression.py -n 5
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from statistics import median
+
+from script_generator import ScriptException, get_base_path, get_data_path, guess_cplex_library_path
+from triage import result_file_name
+from postprocessing.instance import file_hash
+from postprocessing.store import is_optimal
+
+log = logging.getLogger(__name__)
+
+# (instance, vehicles) pairs of the quick set
+QUICK_PAIRS = [('burma14.tsp', 3), ('burma14.tsp', 4), ('gr17.tsp', 3), ('gr21.tsp', 4),
+               ('E-n13-k4.vrp', 4), ('E-n22-k4.vrp', 4), ('E-n23-k3.vrp', 3)]
+
+# (objective, fairness coefficient, p) of every pair
+QUICK_OBJECTIVES = [('min', 0.0, 1), ('min-max', 0.0, 1), ('p-norm', 0.0, 2), ('eps-fair', 0.5, 1),
+                    ('delta-fair', 0.5, 1)]
+
+RUN_FIELDS = ['instanceName', 'numVehicles', 'objective', 'pNorm', 'fairnessCoefficient', 'repeat', 'status',
+              'computationTimeInSec', 'wallTimeInSec', 'numNodes', 'gapPercent', 'objectiveValue']
+
+
+def quick_cases(objectives=None):
+    """Cases (instance, vehicles, objective, fc, p) of the quick set."""
+    return [(instance, vehicle, objective, fc, p) for instance, vehicle in QUICK_PAIRS
+            for objective, fc, p in QUICK_OBJECTIVES if objectives is None or objective in objectives]
+
+
+def run_case(case, repeat, config):
+    """
+    Solve one case with the uber.jar.
+
+    Returns:
+        Dictionary with the RUN_FIELDS of the run; status is 'ok', 'infeasible'
+        (result without tours), or 'failed' (no result, the solver output is logged)
+    """
+    instance, vehicle, objective, fc, p = case
+    out_path = os.path.join(config.work_path, f'repeat-{repeat}')
+    os.makedirs(out_path, exist_ok=True)
+    cmd = ['java', f'-Xmx{config.heap_gb}g', f'-Djava.library.path={config.cplex_lib_path}', '-jar',
+           config.jar_path, '-n', instance, '-path', config.data_path + os.sep, '-r', out_path + os.sep,
+           '-v', str(vehicle), '-obj', objective, '-fc', str(fc), '-p', str(p), '-t', str(config.time_limit)]
+    start = time.perf_counter()
+    completed = subprocess.run(cmd, cwd=out_path, capture_output=True, text=True, errors='replace')
+    wall_time = time.perf_counter() - start
+    run = {'instanceName': instance, 'numVehicles': vehicle, 'objective': objective, 'pNorm': p,
+           'fairnessCoefficient': fc, 'repeat': repeat, 'status': 'failed', 'computationTimeInSec': None,
+           'wallTimeInSec': round(wall_time, 3), 'numNodes': None, 'gapPercent': None, 'objectiveValue': None}
+    result_path = os.path.join(out_path, result_file_name(case))
+    if completed.returncode != 0 or not os.path.isfile(result_path):
+        log.error(f'{os.path.basename(result_path)} (repeat {repeat}) failed with exit code {completed.returncode}: '
+                  f'{completed.stdout[-2000:]}{completed.stderr[-2000:]}')
+        return run
+    with open(result_path, 'r') as fin:
+        result = json.load(fin)
+    os.remove(result_path)
+    run.update({'status': 'ok' if result.get('tours') else 'infeasible',
+                'computationTimeInSec': result['computationTimeInSec'],
+                'numNodes': result.get('numNodes'),
+                'gapPercent': result.get('optimalityGapPercent'),
+                'objectiveValue': result.get('objectiveValue')})
+    return run
+
+
+def run_cases(cases, config):
+    """All repeats of all cases, config.jobs solver processes at a time."""
+    jobs = [(case, repeat) for repeat in range(config.repeats) for case in cases]
+    log.info(f'running {len(cases)} cases {config.repeats} times with {config.jobs} parallel jobs')
+    runs = []
+    # threads suffice, every job waits for its own java process
+    with ThreadPoolExecutor(max_workers=config.jobs) as executor:
+        for run in executor.map(lambda job: run_case(job[0], job[1], config), jobs):
+            log.info(f'{run["instanceName"]} v {run["numVehicles"]} {run["objective"]} p {run["pNorm"]} '
+                     f'fc {run["fairnessCoefficient"]} #{run["repeat"]}: {run["status"]} '
+                     f'{run["computationTimeInSec"]}s {run["numNodes"]} nodes')
+            runs.append(run)
+    return runs
+
+
+def save_baseline(db_path, runs, metadata):
+    """Replace the baseline database with runs."""
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    tmp_path = f'{db_path}.{os.getpid()}.tmp'
+    connection = sqlite3.connect(tmp_path)
+    connection.execute(f'CREATE TABLE runs ({", ".join(RUN_FIELDS)})')
+    connection.executemany(f'INSERT INTO runs VALUES ({", ".join("?" * len(RUN_FIELDS))})',
+                           [[run[field] for field in RUN_FIELDS] for run in runs])
+    connection.execute('CREATE TABLE metadata (key, value)')
+    connection.executemany('INSERT INTO metadata VALUES (?, ?)', sorted(metadata.items()))
+    connection.commit()
+    connection.close()
+    os.replace(tmp_path, db_path)
+
+
+def load_baseline(db_path):
+    """Runs and metadata of the baseline database."""
+    if not os.path.isfile(db_path):
+        raise ScriptException(f'no baseline at {db_path}, create it with --save')
+    connection = sqlite3.connect(db_path)
+    connection.row_factory = sqlite3.Row
+    runs = [dict(row) for row in connection.execute('SELECT * FROM runs')]
+    metadata = dict(connection.execute('SELECT key, value FROM metadata').fetchall())
+    connection.close()
+    return runs, metadata
+
+
+def case_of(run):
+    return (run['instanceName'], int(run['numVehicles']), run['objective'], round(float(run['fairnessCoefficient']), 4),
+            int(run['pNorm']))
+
+
+def group_runs(runs):
+    groups = {}
+    for run in runs:
+        groups.setdefault(case_of(run), []).append(run)
+    return groups
+
+
+@lru_cache(maxsize=None)
+def _u_count(n1, n2, u):
+    """Number of orderings of n1 + n2 distinct values in which the first sample has statistic u."""
+    if u < 0 or u > n1 * n2:
+        return 0
+    if n1 == 0 or n2 == 0:
+        return 1 if u == 0 else 0
+    # the largest value belongs to the first sample (beating all n2 others) or to the second
+    return _u_count(n1 - 1, n2, u - n2) + _u_count(n1, n2 - 1, u)
+
+
+def mann_whitney_greater(x, y):
+    """
+    One-sided Mann-Whitney U test of "x tends to be greater than y".
+
+    The p-value is exact (by counting rank sums) for samples without ties and
+    from the normal approximation with tie correction otherwise.
+
+    Returns:
+        Tuple (U statistic of x, p-value)
+    """
+    n1, n2 = len(x), len(y)
+    values = sorted((v, i < n1) for i, v in enumerate(list(x) + list(y)))
+    ranks, ties, i = {}, [], 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1][0] == values[i][0]:
+            j += 1
+        ranks[values[i][0]] = (i + j + 2) / 2.0
+        ties.append(j - i + 1)
+        i = j + 1
+    u = sum(ranks[v] for v in x) - n1 * (n1 + 1) / 2.0
+    if all(t == 1 for t in ties):
+        total = math.comb(n1 + n2, n1)
+        return u, sum(_u_count(n1, n2, k) for k in range(int(u), n1 * n2 + 1)) / total
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12.0 * ((n + 1) - sum(t ** 3 - t for t in ties) / (n * (n - 1))))
+    if sigma == 0:
+        return u, 1.0
+    z = (u - n1 * n2 / 2.0 - 0.5) / sigma
+    return u, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def _solved(run):
+    return run['status'] == 'ok' and is_optimal(run['gapPercent'])
+
+
+def _slowdown(current, baseline, field, alpha, min_slowdown):
+    """(median ratio, p-value) if field got significantly larger, else None."""
+    x = [float(run[field]) for run in current if run[field] is not None]
+    y = [float(run[field]) for run in baseline if run[field] is not None]
+    if not x or not y or median(y) <= 0:
+        return None
+    ratio = median(x) / median(y)
+    _, p_value = mann_whitney_greater(x, y)
+    if p_value < alpha and ratio > 1.0 + min_slowdown:
+        return ratio, p_value
+    return None
+
+
+def compare_runs(runs, baseline_runs, alpha=0.05, min_slowdown=0.1, objective_tol=1e-6):
+    """
+    Compare runs with the baseline runs case by case.
+
+    Objective values are compared with a relative tolerance of the largest of
+    objective_tol and the relative gaps of the run and of the baseline runs.
+
+    Returns:
+        Tuple (list of (case, message) correctness failures, list of (case, message) slowdowns)
+    """
+    current, baseline = group_runs(runs), group_runs(baseline_runs)
+    failures, slowdowns = [], []
+    for case in sorted(current):
+        if case not in baseline:
+            log.warning(f'{case} is not in the baseline')
+            continue
+        now, before = current[case], baseline[case]
+        if any(run['status'] == 'ok' for run in before) and any(run['status'] != 'ok' for run in now):
+            failures.append((case, f'{sum(run["status"] != "ok" for run in now)} of {len(now)} runs '
+                                   f'{"/".join(sorted(set(run["status"] for run in now if run["status"] != "ok")))}'))
+        reference = [float(run['objectiveValue']) for run in before if _solved(run)]
+        if reference:
+            expected = median(reference)
+            reference_gap = max(float(run['gapPercent']) for run in before if _solved(run)) / 100
+            for run in filter(_solved, now):
+                value = float(run['objectiveValue'])
+                # optimal values may differ by the optimality gap of either run, e.g. after a new search path
+                tolerance = max(objective_tol, reference_gap, float(run['gapPercent']) / 100)
+                if abs(value - expected) > tolerance * max(1.0, abs(expected)):
+                    failures.append((case, f'objective {value} instead of {expected} (repeat {run["repeat"]})'))
+                    break
+            if not any(map(_solved, now)) and any(run['status'] == 'ok' for run in now):
+                slowdowns.append((case, 'no longer solved to optimality within the time limit'))
+        for field, label in [('computationTimeInSec', 'time'), ('numNodes', 'nodes')]:
+            slower = _slowdown([r for r in now if r['status'] == 'ok'], [r for r in before if r['status'] == 'ok'],
+                               field, alpha, min_slowdown)
+            if slower is not None:
+                slowdowns.append((case, f'{label} x{slower[0]:.2f} (p = {slower[1]:.3f})'))
+    return failures, slowdowns
+
+
+def print_summary(runs, baseline_runs):
+    current, baseline = group_runs(runs), group_runs(baseline_runs)
+    print(f'{"case":<44} {"time":>9} {"baseline":>9} {"nodes":>9} {"baseline":>9}')
+    for case in sorted(current):
+        instance, vehicle, objective, fc, p = case
+        label = f'{instance} v{vehicle} {objective} fc {fc} p {p}'
+        columns = []
+        for runs_of_case in [current[case], baseline.get(case, [])]:
+            times = [float(r['computationTimeInSec']) for r in runs_of_case if r['status'] == 'ok']
+            columns.append(f'{median(times):9.2f}' if times else f'{"-":>9}')
+        for runs_of_case in [current[case], baseline.get(case, [])]:
+            nodes = [float(r['numNodes']) for r in runs_of_case if r['status'] == 'ok' and r['numNodes'] is not None]
+            columns.append(f'{median(nodes):9.0f}' if nodes else f'{"-":>9}')
+        print(f'{label:<44} {columns[0]} {columns[1]} {columns[2]} {columns[3]}')
+
+
+class Controller:
+    def __init__(self, config):
+        self.config = config
+
+    def run(self):
+        if not os.path.isfile(self.config.jar_path):
+            raise ScriptException(f'no uber.jar at {self.config.jar_path}, build it with gradle uberjar')
+        cases = quick_cases(self.config.objectives)
+        self.config.work_path = tempfile.mkdtemp(prefix='regression-', dir=self.config.work_dir)
+        try:
+            runs = run_cases(cases, self.config)
+        finally:
+            shutil.rmtree(self.config.work_path, ignore_errors=True)
+
+        if self.config.save:
+            metadata = {'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                        'jarSha1': file_hash(self.config.jar_path), 'host': platform.node(),
+                        'cpus': str(os.cpu_count()), 'jobs': str(self.config.jobs),
+                        'repeats': str(self.config.repeats), 'timeLimit': str(self.config.time_limit)}
+            save_baseline(self.config.baseline_path, runs, metadata)
+            log.info(f'saved {len(runs)} runs as baseline {self.config.baseline_path}')
+            return 0
+
+        baseline_runs, metadata = load_baseline(self.config.baseline_path)
+        if metadata.get('jobs') != str(self.config.jobs) or metadata.get('host') != platform.node():
+            log.warning(f'the baseline ran on {metadata.get("host")} with {metadata.get("jobs")} parallel jobs, '
+                        f'timings are not comparable')
+        print_summary(runs, baseline_runs)
+        failures, slowdowns = compare_runs(runs, baseline_runs, self.config.alpha, self.config.min_slowdown)
+        for case, message in failures:
+            log.error(f'correctness failure {case}: {message}')
+        for case, message in slowdowns:
+            log.warning(f'slowdown {case}: {message}')
+        log.info(f'{len(failures)} correctness failures and {len(slowdowns)} slowdowns in {len(cases)} cases')
+        return 1 if failures or slowdowns else 0
+
+
+def handle_command_line():
+    parser = argparse.ArgumentParser(description="run the solver on the quick set and compare with a baseline")
+    parser.add_argument("--save", action="store_true", help="store the runs as the new baseline")
+    parser.add_argument("-b", "--baseline", default=None,
+                        help="baseline database, default results/regression/baseline.db")
+    parser.add_argument("-j", "--jobs", type=int, default=max(1, (os.cpu_count() or 1) // 4),
+                        help="number of solver processes at a time")
+    parser.add_argument("-n", "--repeats", type=int, default=5, help="runs of every case")
+    parser.add_argument("-t", "--timeLimit", type=float, default=300.0, help="time limit of a run in seconds")
+    parser.add_argument("-obj", "--objectives", nargs='+', default=None,
+                        choices=[objective for objective, _, _ in QUICK_OBJECTIVES], help="only these objectives")
+    parser.add_argument("--jar", default=None, help="solver jar, default app/build/libs/uber.jar")
+    parser.add_argument("--cplexLib", default=None, help="CPLEX library folder, default from gradle.properties")
+    parser.add_argument("--heap", type=int, default=2, help="JVM heap of a run in GB")
+    parser.add_argument("--alpha", type=float, default=0.05, help="significance level of the slowdown tests")
+    parser.add_argument("--minSlowdown", type=float, default=0.1,
+                        help="relative slowdown of the median below which a case is not reported")
+    parser.add_argument("--workDir", default=None, help="folder for the result files of the runs")
+    args = parser.parse_args()
+
+    base_path = get_base_path()
+    config = argparse.Namespace(
+        save=args.save,
+        baseline_path=args.baseline or os.path.join(base_path, 'results', 'regression', 'baseline.db'),
+        jobs=args.jobs, repeats=args.repeats, time_limit=args.timeLimit, objectives=args.objectives,
+        jar_path=os.path.abspath(args.jar or os.path.join(base_path, 'app', 'build', 'libs', 'uber.jar')),
+        cplex_lib_path=args.cplexLib or guess_cplex_library_path(),
+        data_path=get_data_path(), heap_gb=args.heap, alpha=args.alpha, min_slowdown=args.minSlowdown,
+        work_dir=args.workDir, work_path=None)
+    return config
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.INFO)
+    try:
+        controller = Controller(handle_command_line())
+        return controller.run()
+    except ScriptException as se:
+        log.error(se)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
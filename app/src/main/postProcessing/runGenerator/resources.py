@@ -0,0 +1,126 @@
+import csv
+import logging
+import os
+
+from sharding import read_dimension
+
+log = logging.getLogger(__name__)
+
+# (name, JVM heap in GB, SLURM --mem in GB, SLURM --cpus-per-task); CPLEX keeps
+# its branch-and-bound tree in native memory, so --mem leaves room above the heap
+RESOURCE_CLASSES = [
+    ('small', 4, 8, 4),
+    ('medium', 12, 20, 8),
+    ('large', 32, 48, 16),
+]
+
+# relative memory footprint of each objective with respect to 'min'; p-norm and
+# eps-fair add conic auxiliary variables and outer-approximation cuts
+OBJECTIVE_MEMORY_FACTOR = {'min': 1.0, 'min-max': 1.2, 'p-norm': 2.0, 'eps-fair': 2.0, 'delta-fair': 1.5}
+JVM_BASE_MB = 512
+MB_PER_EDGE_VARIABLE = 0.25
+SAFETY_FACTOR = 1.5
+
+
+def load_rss_history(csv_path: str):
+    """
+    Read peak resident set sizes of earlier runs.
+
+    The CSV needs the columns instanceName, numVehicles, objective and
+    peakRssMB, e.g. as collected from `sacct --format=MaxRSS`. For repeated
+    (instance, vehicles, objective) entries the largest peak is kept.
+
+    Returns:
+        Dictionary mapping (instance, vehicles, objective) to peak RSS in MB
+    """
+    history = {}
+    if csv_path is None or not os.path.isfile(csv_path):
+        return history
+    with open(csv_path, newline='') as fin:
+        for row in csv.DictReader(fin):
+            key = (row['instanceName'], int(row['numVehicles']), row['objective'])
+            history[key] = max(history.get(key, 0.0), float(row['peakRssMB']))
+    log.info(f'read {len(history)} peak RSS values from {csv_path}')
+    return history
+
+
+class MemoryEstimator:
+    """Estimates the peak memory of a case and maps it to a resource class."""
+
+    def __init__(self, data_path: str, rss_history: dict = None) -> None:
+        self.data_path = data_path
+        self.rss_history = rss_history if rss_history is not None else {}
+        self._dimensions = {}
+
+    def _dimension(self, instance: str) -> int:
+        if instance not in self._dimensions:
+            self._dimensions[instance] = read_dimension(os.path.join(self.data_path, instance))
+        return self._dimensions[instance]
+
+    def estimate_mb(self, case) -> float:
+        instance, vehicle, objective, _, _ = case
+        key = (instance, int(vehicle), objective)
+        if key in self.rss_history:
+            return self.rss_history[key] * SAFETY_FACTOR
+        dimension = self._dimension(instance)
+        num_edge_variables = int(vehicle) * dimension * (dimension - 1) / 2
+        model_mb = num_edge_variables * MB_PER_EDGE_VARIABLE * OBJECTIVE_MEMORY_FACTOR.get(objective, 1.0)
+        return (JVM_BASE_MB + model_mb) * SAFETY_FACTOR
+
+    def resource_class(self, case):
+        """Return the smallest resource class whose --mem covers the estimate."""
+        estimate_gb = self.estimate_mb(case) / 1024
+        for resource_class in RESOURCE_CLASSES:
+            if estimate_gb <= resource_class[2]:
+                return resource_class
+        return RESOURCE_CLASSES[-1]
+
+
+def get_resource_class(name: str):
+    for resource_class in RESOURCE_CLASSES:
+        if resource_class[0] == name:
+            return resource_class
+    raise ValueError(f"unknown resource class: {name}")
+
+
+def next_resource_class(name: str):
+    """Return the next larger resource class, or None for the largest one."""
+    names = [resource_class[0] for resource_class in RESOURCE_CLASSES]
+    index = names.index(name)
+    return RESOURCE_CLASSES[index + 1] if index + 1 < len(RESOURCE_CLASSES) else None
+
+
+def group_by_resource_class(cases, estimator: MemoryEstimator):
+    """
+    Group cases by resource class.
+
+    Returns:
+        Dictionary mapping resource class tuples to their cases, in the order
+        of RESOURCE_CLASSES; empty classes are left out
+    """
+    groups = {resource_class: [] for resource_class in RESOURCE_CLASSES}
+    for case in cases:
+        groups[estimator.resource_class(case)].append(case)
+    return {resource_class: group for resource_class, group in groups.items() if group}
+
+
+def write_slurm_job(template_path: str, out_path: str, resource_class, time: str = None):
+    """
+    Write a copy of slurm-batch-job.sh sized for a resource class.
+
+    The node-exclusive allocation of the template is replaced by --mem and
+    --cpus-per-task so that jobs of small classes can share a node.
+    """
+    _, _, mem_gb, cpus = resource_class
+    with open(template_path, 'r') as fin:
+        lines = fin.readlines()
+    with open(out_path, 'w') as f_out:
+        for line in lines:
+            if line.startswith('#SBATCH --exclusive'):
+                f_out.write(f'#SBATCH --mem={mem_gb}G\n')
+                f_out.write(f'#SBATCH --cpus-per-task={cpus}\n')
+            elif line.startswith('#SBATCH --time') and time is not None:
+                f_out.write(f'#SBATCH --time={time}\n')
+            else:
+                f_out.write(line)
+    os.chmod(out_path, 0o755)
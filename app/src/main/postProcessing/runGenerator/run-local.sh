@@ -0,0 +1,13 @@
+#!/bin/bash
+#
+# Runs every line of a runs file on this machine without a scheduler.
+# usage: ./run-local.sh <runs file> [number of parallel jobs]
+#
+
+jobs=${2:-1}
+lines=`wc -l < $1`
+
+echo "running: $lines commands from $1 with $jobs parallel jobs"
+
+for i in $(seq 1 $lines); do echo $i; done | \
+    xargs -P $jobs -I {} sh -c "sed -n '{} p' $1 | sh > output/local-{}.out 2>&1"
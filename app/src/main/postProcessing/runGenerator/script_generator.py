@@ -1,16 +1,23 @@
 
 import argparse
-import csv, sqlite3
+import csv
 import logging
 import os
-import re
 import shutil
 import subprocess
+import sys
 from math import floor, ceil
 
 log = logging.getLogger(__name__)
 import numpy as np
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from postprocessing import store
+from postprocessing.catalog import instance_vehicle_pairs
+
+from sharding import RuntimePredictor, load_runtime_history, select_shard, shard_name, shard_type
+from resources import MemoryEstimator, group_by_resource_class, load_rss_history, write_slurm_job
+
 class ScriptException(Exception):
     """Custom exception class with message for this module."""
 
@@ -30,6 +37,10 @@ class Config:
         self.data_path = get_data_path()
         self.jar_path = os.path.join(
             self.base_path, 'app', 'build', 'libs', 'uber.jar')
+        self.history_db_path = store.default_database()
+        self.rss_history_path = os.path.join(self.base_path, 'results', 'peak_rss.csv')
+        self.shard = None
+        self.jsonl = False
 
         self.min_runs = False
         self.minmax_runs = False
@@ -37,6 +48,7 @@ class Config:
         self.epsFair_runs = False
         self.deltaFair_runs = False
         self.seattle_runs = False
+        self.road_runs = False
         self.COF_runs = False
         self.minmaxFair = False
         self.pNormFair = False
@@ -50,6 +62,10 @@ def get_data_path() -> str:
 def get_all_instance_vehicle_pairs(data_path: str = None):
     """
     Get all instance-vehicle pairs for TSP and VRP instances.
+
+    The pairs come from the instance catalog (app/data/catalog.json): the
+    TSPLIB instances with 3, 4 and 5 vehicles and the CVRPLIB instances with
+    the vehicle count of their name.
     
     Args:
         data_path: Path to the data directory. If None, uses get_data_path().
@@ -59,25 +75,7 @@ def get_all_instance_vehicle_pairs(data_path: str = None):
     """
     if data_path is None:
         data_path = get_data_path()
-    
-    tsp_instances = ['burma14.tsp', 'gr17.tsp', 'gr21.tsp', 'gr24.tsp', 'fri26.tsp', 'bayg29.tsp',
-                    'bays29.tsp', 'dantzig42.tsp', 'gr48.tsp', 'att48.tsp', 'eil51.tsp', 'eil76.tsp']
-    vehicles_count = [3,4,5]
-    
-    # VRP instances - extract vehicle count from filename
-    vrp_cases = []
-    data_files = os.listdir(data_path)
-    for filename in data_files:
-        if filename.endswith('.vrp') and not os.path.isdir(os.path.join(data_path, filename)):
-            # Extract vehicle count from filename (e.g., A-n32-k5.vrp -> 5)
-            match = re.search(r'-k(\d+)\.vrp$', filename)
-            if match:
-                vehicle_count = int(match.group(1))
-                vrp_cases.append((filename, vehicle_count))
-
-    vrp_cases.sort(key=lambda x: x[0])
-    
-    return [(instance, vehicle) for instance in tsp_instances for vehicle in vehicles_count] + vrp_cases
+    return instance_vehicle_pairs(data_path)
 
 def guess_cplex_library_path():
     gp_path = os.path.join(os.path.expanduser(
@@ -99,10 +97,12 @@ class Controller:
         self.config = config
         self._base_cmd = None
         self.objective = None
+        # connection to the history database while the fair runs are collected
+        self._history = None
 
     def run(self):
         self._base_cmd = [
-            "java", "-Xms32m", "-Xmx32g",
+            "java", "-Xms32m",
             "-Djava.library.path={}".format(self.config.cplex_lib_path),
             "-jar", "./uber.jar",
         ]
@@ -110,6 +110,8 @@ class Controller:
 
         if self.config.seattle_runs:
             self._seattle_runs()
+        elif self.config.road_runs:
+            self._road_runs()
         elif self.config.COF_runs:
             self._COF_runs()
         elif self.config.minmaxFair:
@@ -133,46 +135,77 @@ class Controller:
         self._generate_setup(cases)
         
 
+    def _select_shard(self, cases):
+        predictor = RuntimePredictor(self.config.data_path, load_runtime_history(self.config.history_db_path))
+        selected = select_shard(cases, self.config.shard, predictor.predict)
+        log.info(f'{shard_name(self.config.shard)} holds {len(selected)} of {len(cases)} cases')
+        return selected
+
+    def _java_cmd(self, heap_gb):
+        cmd = [c for c in self._base_cmd]
+        cmd.insert(2, "-Xmx{}g".format(heap_gb))
+        return cmd
+
     def _generate_setup(self, cases, run_type = None):
         if run_type is None:
             run_type = self.objective
 
-        runs_file_path = os.path.join(
-            self.config.script_folder_path, run_type+'_runs.txt')
-
-        with open(runs_file_path, 'w') as f_out:
-            for instance, vehicle, objective, fc, p in cases:
-                cmd = [c for c in self._base_cmd]
-                cmd.extend([
-                    "-n", instance,
-                    "-path", "./data/ "
-                    "-r", "./results/ "
-                    "-v", str(vehicle),
-                    "-obj", str(objective),
-                    "-fc", str(fc),
-                    "-p", str(p),
-                    "-t", str(3600)
-                ])
-                f_out.write(' '.join(cmd))
-                f_out.write('\n')
-            
-        self._prepare_test_folder(cases, run_type)
-
-    def _prepare_test_folder(self, cases, run_type = None):
+        results_path = "./results/ "
+        if self.config.shard is not None:
+            cases = self._select_shard(cases)
+            run_type = f'{run_type}_{shard_name(self.config.shard)}'
+            results_path = f"./results/{shard_name(self.config.shard)}/ "
+
+        estimator = MemoryEstimator(self.config.data_path, load_rss_history(self.config.rss_history_path))
+        class_cases = group_by_resource_class(cases, estimator)
+
+        for (class_name, heap_gb, mem_gb, cpus), group in class_cases.items():
+            runs_file_path = os.path.join(
+                self.config.script_folder_path, f'{run_type}_{class_name}_runs.txt')
+            with open(runs_file_path, 'w') as f_out:
+                for instance, vehicle, objective, fc, p in group:
+                    cmd = self._java_cmd(heap_gb)
+                    cmd.extend([
+                        "-n", instance,
+                        "-path", "./data/ "
+                        "-r", results_path +
+                        "-v", str(vehicle),
+                        "-obj", str(objective),
+                        "-fc", str(fc),
+                        "-p", str(p),
+                        "-t", str(3600)
+                    ])
+                    if self.config.jsonl:
+                        # one shard per node; the shell running the line expands $(hostname)
+                        cmd.extend(["-jsonl", f"{results_path.strip()}{run_type}-$(hostname).jsonl"])
+                    f_out.write(' '.join(cmd))
+                    f_out.write('\n')
+            log.info(f'{class_name}: {len(group)} runs with {heap_gb}g heap, {mem_gb}G memory and {cpus} cpus')
+
+        self._prepare_test_folder(cases, run_type, list(class_cases.keys()))
+
+    def _prepare_test_folder(self, cases, run_type = None, resource_classes = None):
         if run_type is None:
             run_type = self.objective
 
         rt_path = os.path.join(self.config.base_path, 'runs', run_type)
         os.makedirs(rt_path, exist_ok=True)
         shutil.copy(self.config.jar_path, os.path.join(rt_path, 'uber.jar'))
-        runs_file_name = '{}_runs.txt'.format(run_type)
-        for f in [runs_file_name, 'submit-batch.sh', 'slurm-batch-job.sh']:
+        for f in ['submit-batch.sh', 'slurm-batch-job.sh', 'run-local.sh']:
             src_path = os.path.join(self.config.script_folder_path, f)
             dst_path = os.path.join(rt_path, f)
             shutil.copy(src_path, dst_path)
 
-        os.remove(os.path.join(self.config.script_folder_path, runs_file_name))
-        log.info('copied runs file and shell scripts to {}'.format(rt_path))
+        for resource_class in resource_classes:
+            class_name = resource_class[0]
+            runs_file_name = f'{run_type}_{class_name}_runs.txt'
+            shutil.copy(os.path.join(self.config.script_folder_path, runs_file_name),
+                        os.path.join(rt_path, runs_file_name))
+            os.remove(os.path.join(self.config.script_folder_path, runs_file_name))
+            write_slurm_job(os.path.join(self.config.script_folder_path, 'slurm-batch-job.sh'),
+                            os.path.join(rt_path, f'slurm-batch-job-{class_name}.sh'), resource_class)
+            log.info(f'submit with: ./submit-batch.sh {runs_file_name} slurm-batch-job-{class_name}.sh')
+        log.info('copied runs files and shell scripts to {}'.format(rt_path))
 
         test_data_path = os.path.join(rt_path, 'data')
         os.makedirs(test_data_path, exist_ok=True)
@@ -185,6 +218,17 @@ class Controller:
         for name in ['results', 'logs', 'output']:
             folder_path = os.path.join(rt_path, name)
             os.makedirs(folder_path, exist_ok=True)
+        results_path = os.path.join(rt_path, 'results')
+        if self.config.shard is not None:
+            results_path = os.path.join(results_path, shard_name(self.config.shard))
+        # copied into the round with the results; update_db keeps it in the results store
+        store.write_provenance(results_path, store.provenance(self.config.jar_path, self.config.cplex_lib_path, {
+            'runType': run_type,
+            'timeLimitInSeconds': 3600,
+            'resourceClasses': [{'name': c[0], 'heapGB': c[1], 'memGB': c[2], 'cpus': c[3]}
+                                for c in resource_classes or []],
+            'jsonl': self.config.jsonl,
+        }))
 
         log.info('Test folder completed')
 
@@ -223,14 +267,25 @@ class Controller:
 
         all_instance_vehicle_pairs = self._get_all_instance_vehicle_pairs()
         cases = []
-        for instance, numVehicle in all_instance_vehicle_pairs:
-            for objective in ['eps-fair', 'delta-fair']:
+        try:
+            self._history = store.connect(self.config.history_db_path)
+        except store.StoreException as se:
+            raise ScriptException(f'fair runs need the fairness indices of earlier runs: {se.value}')
+        try:
+            for instance, numVehicle in all_instance_vehicle_pairs:
                 fairnessIndex = self.getFairnessIndex(instance, numVehicle, objective_type, pNorm)
-                if objective == 'eps-fair':
-                    fc = round(floor(float(fairnessIndex['normIndex'])*10000)/10000,4)
-                elif objective == 'delta-fair':
-                    fc = round(ceil(float(fairnessIndex['giniIndex'])*10000)/10000,4)
-                cases.append((instance, numVehicle, objective, fc, 1))
+                if fairnessIndex is None:
+                    raise ScriptException(f'no {objective_type} run (p {pNorm}) of {instance} with {numVehicle} '
+                                          f'vehicles in {self.config.history_db_path}')
+                for objective in ['eps-fair', 'delta-fair']:
+                    if objective == 'eps-fair':
+                        fc = round(floor(float(fairnessIndex['normIndex'])*10000)/10000,4)
+                    elif objective == 'delta-fair':
+                        fc = round(ceil(float(fairnessIndex['giniIndex'])*10000)/10000,4)
+                    cases.append((instance, numVehicle, objective, fc, 1))
+        finally:
+            self._history.close()
+            self._history = None
         return cases
 
     def minmaxFair_runs(self):
@@ -244,9 +299,8 @@ class Controller:
         self._generate_setup(cases, 'pNormFair')
     
     def getFairnessIndex(self, instance_name, numVehicles, objective, pNorm = 1, fc = 0.0):
-        # returns jainIndex, giniIndex and normIndex corresponding to given instance 
-        connection = sqlite3.connect(os.path.join(get_base_path(), 'results/round2', 'results.db'))
-        cursor = connection.cursor()
+        # returns jainIndex, giniIndex and normIndex corresponding to given instance from the history database
+        cursor = self._history.cursor()
      
         cursor.execute(f"""
                 SELECT GiniIndex, JainIndex, normIndex
@@ -254,6 +308,7 @@ class Controller:
                 WHERE instanceName = ? AND numVehicles = ? AND objective = ? AND pNorm = ? AND fairnessCoefficient = ?
                 """,  (instance_name, str(numVehicles), objective, str(pNorm), str(fc)))
         result = cursor.fetchone()
+        cursor.close()
         fairIndex = {'giniIndex': result[0], 'jainIndex':result[1], 'normIndex':result[2]} if result else None 
         return fairIndex
 
@@ -265,6 +320,18 @@ class Controller:
 
         self._generate_setup(cases, 'seattle')
 
+    def _road_runs(self):
+        # generated road network instances, registered in the catalog by postprocessing/road_instances.py
+        objective = ['eps-fair','delta-fair']
+        fairnessCoefficient = [0.1, 0.3, 0.5, 0.7, 0.9]
+        pairs = [(instance, vehicle) for instance, vehicle in instance_vehicle_pairs(self.config.data_path, groups=('road',))
+                 if instance != 'seattle.tsp']
+        if not pairs:
+            raise ScriptException("no generated road instances in the catalog")
+        cases = [(instance, vehicle, obj, fc, 1) for instance, vehicle in pairs for obj in objective for fc in fairnessCoefficient]
+
+        self._generate_setup(cases, 'road')
+
     def _prepare_uberjar(self):
         os.chdir(self.config.base_path)
         subprocess.check_call(['gradle', 'clean', 'cleanlogs', 'uberjar'])
@@ -288,12 +355,20 @@ def handle_command_line():
                         help="generate runs for delta-fair objective")
     parser.add_argument("-seattle", "--seattle", action="store_true",
                         help="generate runs for Seattle instance")
+    parser.add_argument("-road", "--road", action="store_true",
+                        help="generate runs for the generated road network instances of the catalog")
     parser.add_argument("-COF", "--COF", action="store_true",
                         help="generate COF instance of eps/delta Fair")
     parser.add_argument("-minmaxFair", "--minmaxFair", action="store_true",
                         help="generate eps/delta fair instances for corresponding min-max fairness")
     parser.add_argument("-pNormFair", "--pNormFair", action="store_true",
                         help="generate eps/delta fair instances for corresponding p-norm fairness for p=2")
+    parser.add_argument("-rss", "--rssHistory", default=None,
+                        help="CSV with peak RSS of earlier runs (default: results/peak_rss.csv)")
+    parser.add_argument("-shard", "--shard", type=shard_type, default=None,
+                        help="only generate shard i/n of the runs, balanced by predicted run time")
+    parser.add_argument("-jsonl", "--jsonl", action="store_true",
+                        help="append the results to one JSONL shard per node instead of one JSON file per run")
 
     args = parser.parse_args()
     config = Config()
@@ -304,9 +379,14 @@ def handle_command_line():
     config.epsFair_runs = args.epsFair
     config.deltaFair_runs = args.deltaFair
     config.seattle_runs = args.seattle
+    config.road_runs = args.road
     config.COF_runs = args.COF
     config.minmaxFair = args.minmaxFair
     config.pNormFair = args.pNormFair
+    config.shard = args.shard
+    config.jsonl = args.jsonl
+    if args.rssHistory is not None:
+        config.rss_history_path = args.rssHistory
 
     return config
 
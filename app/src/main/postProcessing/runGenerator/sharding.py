@@ -0,0 +1,223 @@
+import argparse
+import logging
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from postprocessing import store
+
+log = logging.getLogger(__name__)
+
+# relative solve effort of each objective with respect to 'min', used when no
+# historical computation time is available for a case
+OBJECTIVE_WEIGHT = {'min': 1.0, 'min-max': 4.0, 'p-norm': 6.0, 'eps-fair': 8.0, 'delta-fair': 5.0}
+TIME_LIMIT = 3600.0
+
+
+def parse_shard(value: str):
+    """
+    Parse a shard specification of the form "i/n" (1-based).
+
+    Args:
+        value: shard specification, e.g. "2/4"
+
+    Returns:
+        Tuple (i, n) with 1 <= i <= n
+    """
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', value)
+    if not match:
+        raise ValueError(f"shard should be given as i/n, given: {value}")
+    i, n = int(match.group(1)), int(match.group(2))
+    if n < 1 or not 1 <= i <= n:
+        raise ValueError(f"shard index should satisfy 1 <= i <= n, given: {value}")
+    return i, n
+
+
+def shard_type(value: str):
+    """argparse type wrapper around parse_shard"""
+    try:
+        return parse_shard(value)
+    except ValueError as ve:
+        raise argparse.ArgumentTypeError(str(ve))
+
+
+def shard_name(shard) -> str:
+    i, n = shard
+    return f'shard-{i}-of-{n}'
+
+
+def case_key(instance, vehicle, objective, fc, p):
+    return (instance, int(vehicle), objective, round(float(fc), 4), int(p))
+
+
+def read_dimension(file_path: str) -> int:
+    """Read the DIMENSION entry from the header of a TSPLIB/CVRPLIB file."""
+    with open(file_path, 'r') as fin:
+        for line in fin:
+            if line.strip().startswith('DIMENSION'):
+                return int(line.split(':')[-1].strip())
+    raise ValueError(f"DIMENSION missing in {file_path}")
+
+
+def load_runtime_history(db_path: str):
+    """
+    Read computation times of earlier runs from a results database.
+
+    Args:
+        db_path: results store (latest run of every case) or per-round results.db
+
+    Returns:
+        Dictionary mapping case keys to computation time in seconds
+    """
+    history = {}
+    if db_path is None or not os.path.isfile(db_path):
+        return history
+    connection = store.connect(db_path)
+    cursor = connection.cursor()
+    for table_name in store.vehicle_tables(connection):
+        cursor.execute(f"""
+            SELECT instanceName, numVehicles, objective, fairnessCoefficient, pNorm, computationTimeInSec
+            FROM {table_name}""")
+        for instance, vehicle, objective, fc, p, time in cursor.fetchall():
+            key = case_key(instance, vehicle, objective, fc, p)
+            history[key] = min(float(time), TIME_LIMIT)
+    cursor.close()
+    connection.close()
+    log.info(f'read {len(history)} historical run times from {db_path}')
+    return history
+
+
+class RuntimePredictor:
+    """Predicts the run time of a case from history or, failing that, from instance size."""
+
+    def __init__(self, data_path: str, history: dict = None) -> None:
+        self.data_path = data_path
+        self.history = history if history is not None else {}
+        self._dimensions = {}
+
+    def _dimension(self, instance: str) -> int:
+        if instance not in self._dimensions:
+            self._dimensions[instance] = read_dimension(os.path.join(self.data_path, instance))
+        return self._dimensions[instance]
+
+    def predict(self, case) -> float:
+        key = case_key(*case)
+        if key in self.history:
+            return self.history[key]
+        instance, vehicle, objective, _, _ = key
+        dimension = self._dimension(instance)
+        estimate = 1e-3 * dimension ** 2 * vehicle * OBJECTIVE_WEIGHT.get(objective, 1.0)
+        return min(estimate, TIME_LIMIT)
+
+
+def partition_cases(cases, num_shards: int, predict):
+    """
+    Split cases into shards of roughly equal predicted run time.
+
+    Uses the longest-processing-time-first rule. Cases are ordered by
+    decreasing prediction with the case key as tie-breaker and every case goes
+    to the currently lightest shard (lowest index on ties), so the partition
+    only depends on the case list and the predictions.
+
+    Args:
+        cases: list of (instance, vehicle, objective, fc, p) tuples
+        num_shards: number of shards
+        predict: callable returning the predicted run time of a case
+
+    Returns:
+        List of num_shards case lists, each in the original case order
+    """
+    predicted = [(predict(case), case_key(*case), index) for index, case in enumerate(cases)]
+    predicted.sort(key=lambda it: (-it[0], it[1]))
+    loads = [0.0] * num_shards
+    assignment = [[] for _ in range(num_shards)]
+    for time, _, index in predicted:
+        shard = min(range(num_shards), key=lambda s: (loads[s], s))
+        loads[shard] += time
+        assignment[shard].append(index)
+    for shard, load in enumerate(loads):
+        log.debug(f'shard {shard + 1}/{num_shards}: {len(assignment[shard])} cases, '
+                  f'predicted {load / 3600:.2f} h')
+    return [[cases[index] for index in sorted(indices)] for indices in assignment]
+
+
+def select_shard(cases, shard, predict):
+    """Return the cases that belong to shard (i, n)."""
+    i, n = shard
+    return partition_cases(cases, n, predict)[i - 1]
+
+
+def parse_runs_line(line: str):
+    """Recover the (instance, vehicle, objective, fc, p) case from a runs file line."""
+    tokens = line.split()
+    values = {}
+    for flag in ['-n', '-v', '-obj', '-fc', '-p']:
+        if flag not in tokens:
+            raise ValueError(f"flag {flag} missing in runs line: {line.strip()}")
+        values[flag] = tokens[tokens.index(flag) + 1]
+    return (values['-n'], int(values['-v']), values['-obj'], float(values['-fc']), int(values['-p']))
+
+
+def set_results_path(line: str, results_path: str) -> str:
+    """Point the -r option, and the -jsonl shard if any, of a runs file line at results_path."""
+    tokens = line.split()
+    tokens[tokens.index('-r') + 1] = results_path
+    if '-jsonl' in tokens:
+        index = tokens.index('-jsonl') + 1
+        tokens[index] = os.path.join(results_path, os.path.basename(tokens[index]))
+    return ' '.join(tokens)
+
+
+def shard_runs_file(runs_file: str, shard, predict):
+    """
+    Write the lines of an existing runs file that belong to a shard.
+
+    The results of the shard are redirected to ./results/shard-i-of-n/.
+
+    Returns:
+        Path of the shard runs file
+    """
+    with open(runs_file, 'r') as fin:
+        lines = [line.strip() for line in fin if line.strip()]
+    cases = [parse_runs_line(line) for line in lines]
+    case_lines = {case_key(*case): line for case, line in zip(cases, lines)}
+    selected = select_shard(cases, shard, predict)
+
+    root, ext = os.path.splitext(runs_file)
+    out_path = f'{root}_{shard_name(shard)}{ext}'
+    results_path = f'./results/{shard_name(shard)}/'
+    os.makedirs(os.path.join(os.path.dirname(os.path.abspath(runs_file)), results_path), exist_ok=True)
+    with open(out_path, 'w') as f_out:
+        for case in selected:
+            f_out.write(set_results_path(case_lines[case_key(*case)], results_path))
+            f_out.write('\n')
+    log.info(f'wrote {len(selected)} of {len(lines)} runs to {out_path}')
+    return out_path
+
+
+def handle_command_line():
+    parser = argparse.ArgumentParser(description="split an existing runs file into a shard")
+    parser.add_argument("runs_file", help="runs file written by script_generator.py")
+    parser.add_argument("-s", "--shard", type=shard_type, required=True,
+                        help="shard to extract as i/n (1-based)")
+    parser.add_argument("-d", "--data", default=None,
+                        help="folder with the instance files (default: app/data)")
+    parser.add_argument("-db", "--history", default=None,
+                        help="results database with earlier run times")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.DEBUG)
+    args = handle_command_line()
+    base_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../../..'))
+    data_path = args.data or os.path.join(base_path, 'app', 'data')
+    history_db = args.history or store.default_database()
+    predictor = RuntimePredictor(data_path, load_runtime_history(history_db))
+    shard_runs_file(args.runs_file, args.shard, predictor.predict)
+
+
+if __name__ == '__main__':
+    main()
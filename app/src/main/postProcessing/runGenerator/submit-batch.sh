@@ -1,8 +1,11 @@
 #!/bin/bash
+#
+# usage: ./submit-batch.sh <runs file> [job script, default slurm-batch-job.sh]
+#
 
 lines=`wc -l < $1` 
+job=${2:-slurm-batch-job.sh}
 
-echo "running: sbatch --output="output/slurm-%A_%a.out" --array=1-$lines%500 slurm-batch-job.sh $1"
-
-sbatch --output="output/slurm-%A_%a.out" --array=1-$lines%500 slurm-batch-job.sh $1
+echo "running: sbatch --output="output/slurm-%A_%a.out" --array=1-$lines%500 $job $1"
 
+sbatch --output="output/slurm-%A_%a.out" --array=1-$lines%500 $job $1
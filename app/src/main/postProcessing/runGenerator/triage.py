@@ -0,0 +1,232 @@
+import argparse
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from postprocessing import shards
+from resources import RESOURCE_CLASSES, next_resource_class, write_slurm_job
+from sharding import parse_runs_line
+
+log = logging.getLogger(__name__)
+
+# failure classes in the order they are checked; the first match wins
+FAILURE_PATTERNS = [
+    ('walltime', ['DUE TO TIME LIMIT']),
+    ('oom', ['OutOfMemoryError', 'oom-kill', 'oom_kill', 'Out Of Memory', 'Exceeded job memory limit',
+             'CPLEX Error  1001']),
+    ('license', ['CPLEX Error  32201', 'CPLEX Error  1016', 'ILOG License', 'No license found']),
+    ('jvm-crash', ['A fatal error has been detected by the Java Runtime Environment', 'hs_err_pid',
+                   'core dumped']),
+    ('exception', ['Exception in thread']),
+]
+OUTPUT_FILE_PATTERN = re.compile(r'slurm-(\d+)_(\d+)\.out$')
+GET_LINE_PATTERN = re.compile(r"get line: sed -n '(\d+) p' (\S+)")
+HEAP_PATTERN = re.compile(r'-Xmx(\d+)g')
+
+
+def result_file_name(case):
+    """Name of the result JSON the solver writes for a case (instance, vehicles, objective, fc, p)."""
+    instance, vehicle, objective, fc, p = case
+    return shards.result_file_name(instance, vehicle, objective, p, fc)
+
+
+def classify_output(text):
+    for failure, patterns in FAILURE_PATTERNS:
+        if any(pattern in text for pattern in patterns):
+            return failure
+    return None
+
+
+def scan_output(file_path):
+    """
+    Read one SLURM output file.
+
+    Returns:
+        Dictionary with the job/task ids, the runs file and line the task ran,
+        the command and the failure class found in the output (None if none)
+    """
+    job_id, task_id = OUTPUT_FILE_PATTERN.search(file_path).groups()
+    with open(file_path, 'r', errors='replace') as fin:
+        text = fin.read()
+    entry = {'output': file_path, 'job': int(job_id), 'task': int(task_id),
+             'runs_file': None, 'line': int(task_id), 'command': None,
+             'failure': classify_output(text)}
+    match = GET_LINE_PATTERN.search(text)
+    if match:
+        entry['line'] = int(match.group(1))
+        entry['runs_file'] = match.group(2)
+    for line in text.splitlines():
+        if line.startswith('command: '):
+            entry['command'] = line[len('command: '):].strip()
+            break
+    return entry
+
+
+def read_walltime(job_script):
+    with open(job_script, 'r') as fin:
+        for line in fin:
+            if line.startswith('#SBATCH --time='):
+                return line.split('=')[-1].strip()
+    return None
+
+
+def walltime_seconds(walltime):
+    """Seconds of a SLURM [d-]hh:mm:ss walltime or elapsed time."""
+    days = 0
+    if '-' in walltime:
+        days, walltime = walltime.split('-')
+    parts = [int(x) for x in walltime.split(':')]
+    while len(parts) < 3:
+        parts.insert(0, 0)
+    return int(days) * 86400 + parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def scale_walltime(walltime, factor):
+    """Scale a SLURM [d-]hh:mm:ss walltime by factor."""
+    seconds = int(walltime_seconds(walltime) * factor)
+    return f'{seconds // 3600}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}'
+
+
+def heap_class(command):
+    """Resource class whose heap matches the -Xmx of a command."""
+    match = HEAP_PATTERN.search(command)
+    heap_gb = int(match.group(1)) if match else RESOURCE_CLASSES[-1][1]
+    for resource_class in RESOURCE_CLASSES:
+        if heap_gb <= resource_class[1]:
+            return resource_class
+    return RESOURCE_CLASSES[-1]
+
+
+class Controller:
+    def __init__(self, config):
+        self.config = config
+        self.entries = []
+
+    def run(self):
+        self._scan()
+        self._find_missing_results()
+        self._print_summary()
+        self._write_requeue()
+
+    def _scan(self):
+        output_path = os.path.join(self.config.run_path, 'output')
+        files = [os.path.join(output_path, f) for f in sorted(os.listdir(output_path))
+                 if OUTPUT_FILE_PATTERN.search(f)]
+        with ProcessPoolExecutor(max_workers=self.config.workers) as executor:
+            self.entries = list(executor.map(scan_output, files, chunksize=32))
+        log.info(f'scanned {len(self.entries)} output files in {output_path}')
+
+        # a requeued task leaves an older output behind; keep the latest job per line
+        latest = {}
+        for entry in self.entries:
+            key = (entry['runs_file'], entry['line'])
+            if key not in latest or entry['job'] > latest[key]['job']:
+                latest[key] = entry
+        self.entries = sorted(latest.values(), key=lambda it: (str(it['runs_file']), it['line']))
+
+    def _runs_line(self, entry):
+        runs_file = entry['runs_file'] or self.config.runs_file
+        if entry['command'] is None and runs_file is not None:
+            with open(os.path.join(self.config.run_path, runs_file), 'r') as fin:
+                lines = fin.readlines()
+            entry['command'] = lines[entry['line'] - 1].strip()
+        return entry['command']
+
+    def _find_missing_results(self):
+        shard_results = {}
+        for entry in self.entries:
+            command = self._runs_line(entry)
+            if entry['failure'] is not None or command is None:
+                continue
+            case = parse_runs_line(command)
+            tokens = command.split()
+            results_path = os.path.join(self.config.run_path, tokens[tokens.index('-r') + 1])
+            if '-jsonl' in tokens:
+                # the shard name depends on the node, look for the record in all shards of the folder
+                if results_path not in shard_results:
+                    shard_results[results_path] = shards.shard_keys(results_path)
+                found = result_file_name(case) in shard_results[results_path]
+            else:
+                found = os.path.isfile(os.path.join(results_path, result_file_name(case)))
+            if not found:
+                entry['failure'] = 'missing-result'
+
+    def _print_summary(self):
+        counts = Counter(entry['failure'] or 'ok' for entry in self.entries)
+        width = max([len(name) for name in counts] + [len('class')])
+        print(f'{"class":<{width}}  {"count":>6}')
+        print(f'{"-" * width}  {"-" * 6}')
+        for name, count in counts.most_common():
+            print(f'{name:<{width}}  {count:>6}')
+        print(f'{"total":<{width}}  {len(self.entries):>6}')
+
+    def _requeue_resources(self, entry):
+        """Resource class and walltime factor of a failed entry on requeue."""
+        resource_class = heap_class(entry['command'])
+        factor = 1.0
+        if entry['failure'] == 'oom':
+            larger = next_resource_class(resource_class[0])
+            if larger is None:
+                log.warning(f"{entry['output']}: out of memory in the largest resource class")
+            else:
+                resource_class = larger
+        if entry['failure'] == 'walltime':
+            factor = self.config.walltime_factor
+        return resource_class, factor
+
+    def _write_requeue(self):
+        failed = [entry for entry in self.entries if entry['failure'] is not None and entry['command'] is not None]
+        if not failed:
+            log.info('no failed runs, nothing to requeue')
+            return
+        groups = {}
+        for entry in failed:
+            resource_class, factor = self._requeue_resources(entry)
+            command = HEAP_PATTERN.sub(f'-Xmx{resource_class[1]}g', entry['command'])
+            if not HEAP_PATTERN.search(command):
+                command = command.replace('-Xms32m', f'-Xms32m -Xmx{resource_class[1]}g')
+            groups.setdefault((resource_class, factor), []).append(command)
+
+        template = os.path.join(self.config.run_path, 'slurm-batch-job.sh')
+        walltime = read_walltime(template) or '2:15:00'
+        for (resource_class, factor), commands in groups.items():
+            suffix = resource_class[0] if factor == 1.0 else f'{resource_class[0]}_long'
+            runs_file = os.path.join(self.config.run_path, f'requeue_{suffix}_runs.txt')
+            with open(runs_file, 'w') as f_out:
+                f_out.write('\n'.join(commands))
+                f_out.write('\n')
+            job_script = os.path.join(self.config.run_path, f'slurm-batch-job-requeue-{suffix}.sh')
+            write_slurm_job(template, job_script, resource_class, scale_walltime(walltime, factor))
+            log.info(f'wrote {len(commands)} runs to {runs_file}, submit with: '
+                     f'./submit-batch.sh {os.path.basename(runs_file)} {os.path.basename(job_script)}')
+
+
+def handle_command_line():
+    parser = argparse.ArgumentParser(description="classify failed SLURM array tasks and write requeue runs files")
+    parser.add_argument("run_path", help="run folder (runs/<type>) holding output/ and the runs files")
+    parser.add_argument("-r", "--runs", default=None,
+                        help="runs file for outputs that do not name one")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of worker processes")
+    parser.add_argument("-f", "--walltimeFactor", type=float, default=2.0,
+                        help="walltime multiplier for tasks that hit the time limit")
+    args = parser.parse_args()
+
+    config = argparse.Namespace(run_path=os.path.abspath(args.run_path), runs_file=args.runs,
+                                workers=args.workers, walltime_factor=args.walltimeFactor)
+    return config
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.INFO)
+    controller = Controller(handle_command_line())
+    controller.run()
+
+
+if __name__ == '__main__':
+    main()
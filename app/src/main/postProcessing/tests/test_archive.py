@@ -0,0 +1,98 @@
+import json
+import os
+
+import pytest
+
+from postprocessing import archive, shards
+
+
+def make_result(instance, vehicles, objective, p, fc):
+    return {'instanceName': instance, 'numVehicles': vehicles, 'objectiveType': objective, 'pNorm': p,
+            'fairnessCoefficient': fc, 'tourCost': [1.0] * vehicles}
+
+
+def write_round(root):
+    """Result files and shards of a small round; {member: result}."""
+    members = {}
+    for folder, objective in [('epsFair', 'eps-fair'), ('deltaFair', 'delta-fair')]:
+        os.makedirs(os.path.join(root, folder))
+        for fc in [0.1, 0.5, 0.9]:
+            name = f'eil51-v-3-{objective}-p-1-fc-{int(fc * 100)}.json'
+            result = make_result('eil51.tsp', 3, objective, 1, fc)
+            with open(os.path.join(root, folder, name), 'w') as f_out:
+                json.dump(result, f_out)
+            members[f'{folder}/{name}'] = result
+    os.makedirs(os.path.join(root, 'pNorm', 'shard-1-of-2'))
+    lines = []
+    for p in [2, 3]:
+        name = f'att48-v-4-p-norm-p-{p}-fc-0.json'
+        result = make_result('att48.tsp', 4, 'p-norm', p, 0.0)
+        lines.append(shards.record_line(name, result, 1000))
+        members[f'pNorm/{name}'] = result
+    with open(os.path.join(root, 'pNorm', 'shard-1-of-2', 'node.jsonl'), 'w') as f_out:
+        f_out.writelines(lines)
+    return members
+
+
+@pytest.fixture
+def archived_round(tmp_path):
+    root = str(tmp_path / 'round-2')
+    members = write_round(root)
+    archive_path, count = archive.write_archive(root, block_records=2)
+    archive.remove_archived(root)
+    yield root, archive_path, members
+    archive._open_archives.clear()
+
+
+def test_archive_replaces_the_round(archived_round):
+    root, archive_path, members = archived_round
+    assert archive_path == root + archive.ARCHIVE_SUFFIX
+    assert not shards.has_results(root)
+    with archive.ResultArchive(archive_path) as result_archive:
+        assert len(result_archive) == len(members)
+        assert result_archive.folders() == {'deltaFair': 3, 'epsFair': 3, 'pNorm': 2}
+
+
+def test_load_result_falls_back_to_the_archive(archived_round):
+    root, archive_path, members = archived_round
+    for member, result in members.items():
+        path = os.path.join(root, *member.split('/'))
+        assert not os.path.exists(path)
+        assert archive.find_archive(path) == (archive_path, member)
+        assert archive.load_result(path) == result
+    with pytest.raises(FileNotFoundError):
+        archive.load_result(os.path.join(os.path.dirname(root), 'round-3', 'epsFair', 'missing.json'))
+
+
+def test_get_by_rounded_key(archived_round):
+    _, archive_path, members = archived_round
+    with archive.ResultArchive(archive_path) as result_archive:
+        for result in members.values():
+            key = archive.result_key(result)
+            assert result_archive.get(*key) == result
+        # the fairness coefficient is looked up rounded to two decimals
+        assert result_archive.find('eil51.tsp', 3, 'eps-fair', 1, 0.5000001) == [
+            'epsFair/eil51-v-3-eps-fair-p-1-fc-50.json']
+        assert result_archive.get('eil51.tsp', 3, 'eps-fair', 1, 0.3) is None
+
+
+def test_folder_results(archived_round):
+    root, _, members = archived_round
+    names = [name for name, _ in archive.folder_results(os.path.join(root, 'pNorm'))]
+    assert names == sorted(member.split('/')[1] for member in members if member.startswith('pNorm/'))
+
+
+def test_truncated_archive(archived_round, tmp_path):
+    _, archive_path, _ = archived_round
+    with open(archive_path, 'rb') as fin:
+        data = fin.read()
+    truncated = str(tmp_path / 'truncated.archive')
+    with open(truncated, 'wb') as f_out:
+        f_out.write(data[:-5])
+    with pytest.raises(archive.ArchiveException):
+        archive.ResultArchive(truncated)
+    not_an_archive = str(tmp_path / 'other.archive')
+    with open(not_an_archive, 'wb') as f_out:
+        f_out.write(b'{}' + data[len(archive.MAGIC):])
+    with pytest.raises(archive.ArchiveException):
+        archive.ResultArchive(not_an_archive)
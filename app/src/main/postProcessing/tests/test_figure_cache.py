@@ -0,0 +1,41 @@
+import os
+
+from postprocessing.figure_cache import FigureCache, figure_digest
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f_out:
+        f_out.write(text)
+    return path
+
+
+def test_digest_tells_files_of_the_same_name_apart(tmp_path):
+    name = 'eil51-v-3-delta-fair-p-1-fc-0.json'
+    delta = write(str(tmp_path / 'deltaFair' / name), '{"v": 1}')
+    minmax = write(str(tmp_path / 'minmaxFair' / name), '{"v": 2}')
+    before = figure_digest('paper', {}, files=[delta, minmax])
+    # with name keys, the digest of the later file hid the earlier one
+    write(delta, '{"v": 30}')
+    assert figure_digest('paper', {}, files=[delta, minmax]) != before
+
+
+def test_digest_of_the_same_inputs(tmp_path):
+    data = write(str(tmp_path / 'a.csv'), 'x,y\n1,2\n')
+    assert figure_digest('paper', {'font.size': 8}, [data], [[1, 2]]) == \
+        figure_digest('paper', {'font.size': 8}, [os.path.join(str(tmp_path), '.', 'a.csv')], [[1, 2]])
+    assert figure_digest('paper', {'font.size': 8}, [data]) != figure_digest('presentation', {'font.size': 8}, [data])
+
+
+def test_cache_rebuilds_changed_or_missing_figures(tmp_path):
+    out_path = str(tmp_path / 'plots')
+    figure = write(os.path.join(out_path, 'cof.pdf'), 'pdf')
+    cache = FigureCache(out_path)
+    cache.record('cof', 'digest')
+    cache.save()
+    cache = FigureCache(out_path)
+    assert cache.is_current('cof', 'digest', [figure])
+    assert not cache.is_current('cof', 'other digest', [figure])
+    os.remove(figure)
+    assert not cache.is_current('cof', 'digest', [figure])
+    assert not FigureCache(out_path, force=True).is_current('cof', 'digest', [])
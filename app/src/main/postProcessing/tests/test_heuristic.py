@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from postprocessing import heuristic
+from postprocessing.instance import load_instance
+from postprocessing.shards import result_file_name
+
+
+def check_result(instance, result):
+    """The tours of a result visit every target once, start and end at the depot and have the reported costs."""
+    tours = result['tours']
+    assert tours is not None and len(tours) == result['numVehicles']
+    distances = np.asarray(instance.distances())
+    visited = []
+    costs = []
+    for tour in tours:
+        assert tour[0] == instance.depot and tour[-1] == instance.depot
+        rows = instance.rows(np.asarray(tour, dtype=np.int64))
+        costs.append(float(distances[rows[:-1], rows[1:]].sum()))
+        visited.extend(tour[1:-1])
+    targets = sorted(int(v) for v in instance.vertices if v != instance.depot)
+    assert sorted(visited) == targets
+    assert np.allclose(sorted(costs), sorted(result['tourCost']))
+
+
+@pytest.mark.parametrize('instance_name, num_vehicles', [('burma14.tsp', 3), ('E-n13-k4.vrp', 4)])
+@pytest.mark.parametrize('objective_type, fc, p', [('min', 0.0, 1), ('min-max', 0.0, 1), ('p-norm', 0.0, 2),
+                                                   ('eps-fair', 0.5, 1), ('delta-fair', 0.5, 1)])
+def test_solve_gives_feasible_result(instance_name, num_vehicles, objective_type, fc, p):
+    instance = load_instance(instance_name)
+    solution, objective = heuristic.solve(instance, num_vehicles, objective_type, fc, p)
+    result = heuristic.to_result(instance, solution, objective, 0.0)
+    check_result(instance, result)
+    lengths = np.asarray(result['tourCost'])
+    if objective_type == 'eps-fair':
+        assert result['normIndex'] >= fc - 1e-9
+    if objective_type == 'delta-fair':
+        assert result['giniIndex'] <= fc + 1e-9
+    if objective_type == 'min':
+        assert result['objectiveValue'] == pytest.approx(lengths.sum())
+    if objective_type == 'min-max':
+        assert result['objectiveValue'] == pytest.approx(lengths.max())
+
+
+def test_min_max_does_not_lengthen_the_longest_tour():
+    instance = load_instance('burma14.tsp')
+    unfair = heuristic.to_result(instance, *heuristic.solve(instance, 3, 'min'), 0.0)
+    minmax = heuristic.to_result(instance, *heuristic.solve(instance, 3, 'min-max'), 0.0)
+    assert max(minmax['tourCost']) <= max(unfair['tourCost']) + 1e-9
+
+
+def test_result_file_name():
+    assert result_file_name('eil51.tsp', 3, 'eps-fair', 1, 0.5) == 'eil51-v-3-eps-fair-p-1-fc-50.json'
+    assert result_file_name('A-n33-k6.vrp', 6, 'delta-fair', 1, 0.005) == 'A-n33-k6-v-6-delta-fair-p-1-fc-0.json'
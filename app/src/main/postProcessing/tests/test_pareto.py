@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from postprocessing.pareto import hypervolume, pareto_mask
+
+
+def test_pareto_mask_single_point():
+    assert pareto_mask([3.0], [0.5]).tolist() == [True]
+
+
+def test_pareto_mask_dominated_points():
+    # (2, 0.4) is dominated by (1, 0.5); (1, 0.5) and (3, 0.9) trade cost for fairness
+    assert pareto_mask([1.0, 2.0, 3.0], [0.5, 0.4, 0.9]).tolist() == [True, False, True]
+
+
+def test_pareto_mask_ties():
+    # equal cost: the fairer point dominates; equal fairness: the cheaper point dominates
+    assert pareto_mask([1.0, 1.0], [0.5, 0.8]).tolist() == [False, True]
+    assert pareto_mask([1.0, 2.0], [0.5, 0.5]).tolist() == [True, False]
+
+
+def test_pareto_mask_keeps_duplicates():
+    assert pareto_mask([1.0, 1.0, 2.0], [0.5, 0.5, 0.4]).tolist() == [True, True, False]
+
+
+def test_hypervolume_single_point():
+    assert hypervolume([0.2], [0.5], 1.0) == pytest.approx(0.5 * 0.8)
+
+
+def test_hypervolume_staircase():
+    # rectangles [0, 0.8] x [0.5, 1] and [0, 0.4] x [0.1, 1] overlap in [0, 0.4] x [0.5, 1]
+    assert hypervolume([0.5, 0.1], [0.8, 0.4], 1.0) == pytest.approx(0.4 + 0.36 - 0.2)
+
+
+def test_hypervolume_duplicates_count_once():
+    assert hypervolume([0.2, 0.2], [0.5, 0.5], 1.0) == pytest.approx(hypervolume([0.2], [0.5], 1.0))
+
+
+def test_hypervolume_dominated_point_adds_nothing():
+    assert hypervolume([0.5, 0.1, 0.6], [0.8, 0.4, 0.3], 1.0) == pytest.approx(0.56)
+
+
+def test_hypervolume_point_at_the_reference():
+    # the point at the reference COF has no area, the other one spans [0, 0.3] x [0, 1]
+    assert hypervolume([0.0, 1.0], [0.3, 0.9], 1.0) == pytest.approx(0.3)
+    assert hypervolume([1.0], [0.9], 1.0) == 0.0
+
+
+def test_hypervolume_beyond_the_reference():
+    assert hypervolume([1.2], [0.9], 1.0) == 0.0
+    assert hypervolume(np.array([1.2, 0.5]), np.array([0.9, 0.6]), 1.0) == pytest.approx(0.6 * 0.5)
@@ -0,0 +1,108 @@
+import json
+import os
+
+import pytest
+
+from postprocessing import shards
+
+
+def write_shard(path, lines):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f_out:
+        f_out.write(''.join(lines))
+    return str(path)
+
+
+def write_result_file(folder, name, result, mtime_ms):
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, name)
+    with open(path, 'w') as f_out:
+        json.dump(result, f_out)
+    os.utime(path, ns=(mtime_ms * 1000000, mtime_ms * 1000000))
+
+
+def test_read_shard_skips_incomplete_last_line(tmp_path):
+    path = write_shard(tmp_path / 'node.jsonl', [shards.record_line('a.json', {'v': 1}, 1),
+                                                 shards.record_line('b.json', {'v': 2}, 2)[:-10]])
+    assert list(shards.read_shard(path)) == [('a.json', {'v': 1})]
+
+
+def test_read_shard_keeps_last_record_of_a_key(tmp_path):
+    path = write_shard(tmp_path / 'node.jsonl', [shards.record_line('a.json', {'v': 1}, 1),
+                                                 shards.record_line('b.json', {'v': 2}, 2),
+                                                 shards.record_line('a.json', {'v': 3}, 3)])
+    assert list(shards.read_shard(path)) == [('a.json', {'v': 3}), ('b.json', {'v': 2})]
+
+
+def test_read_shard_sorts_only_when_out_of_order(tmp_path):
+    in_order = write_shard(tmp_path / 'sorted.jsonl', [shards.record_line(k, {'k': k}, 1) for k in 'abc'])
+    out_of_order = write_shard(tmp_path / 'unsorted.jsonl', [shards.record_line(k, {'k': k}, 1) for k in 'cab'])
+    assert shards.index_shard(in_order)[1]
+    assert not shards.index_shard(out_of_order)[1]
+    assert [key for key, _ in shards.read_shard(out_of_order)] == ['a', 'b', 'c']
+
+
+def test_read_shard_skips_lines_without_record(tmp_path):
+    path = write_shard(tmp_path / 'node.jsonl', ['\n', 'not json\n', shards.record_line('a.json', {'v': 1})])
+    assert list(shards.read_shard(path)) == [('a.json', {'v': 1})]
+
+
+def test_merge_results_in_key_order(tmp_path):
+    first = write_shard(tmp_path / 'a.jsonl', [shards.record_line(k, {'k': k}, 1) for k in ['a', 'c', 'e']])
+    second = write_shard(tmp_path / 'b.jsonl', [shards.record_line(k, {'k': k}, 1) for k in ['b', 'd']])
+    assert [key for key, _ in shards.merge_results([first, second])] == ['a', 'b', 'c', 'd', 'e']
+
+
+def test_merge_results_latest_record_wins_across_sources(tmp_path):
+    folder = str(tmp_path / 'epsFair')
+    write_result_file(folder, 'a.json', {'v': 'stale file'}, 1000)
+    write_result_file(folder, 'b.json', {'v': 'newer file'}, 5000)
+    write_shard(tmp_path / 'epsFair' / 'z-node.jsonl', [shards.record_line('a.json', {'v': 'rerun'}, 2000),
+                                                        shards.record_line('b.json', {'v': 'old run'}, 3000)])
+    write_shard(tmp_path / 'epsFair' / 'a-node.jsonl', [shards.record_line('a.json', {'v': 'first run'}, 1500)])
+    merged = dict(shards.merge_results(shards.folder_sources(folder)))
+    assert merged == {'a.json': {'v': 'rerun'}, 'b.json': {'v': 'newer file'}}
+
+
+def test_merge_results_first_source_wins_on_equal_write_times(tmp_path):
+    first = write_shard(tmp_path / 'b.jsonl', [shards.record_line('a.json', {'v': 1}, 7)])
+    second = write_shard(tmp_path / 'a.jsonl', [shards.record_line('a.json', {'v': 2}, 7)])
+    assert list(shards.merge_results([first, second])) == [('a.json', {'v': 1})]
+
+
+def test_merge_results_fails_on_duplicates_without_write_time(tmp_path):
+    first = write_shard(tmp_path / 'a.jsonl', [shards.record_line('a.json', {'v': 1}, 7)])
+    legacy = write_shard(tmp_path / 'b.jsonl', [shards.record_line('a.json', {'v': 2})])
+    with pytest.raises(shards.ShardException):
+        list(shards.merge_results([first, legacy]))
+
+
+def test_folder_sources_include_shard_folders(tmp_path):
+    folder = str(tmp_path / 'pNorm')
+    write_result_file(folder, 'a.json', {'v': 1}, 1000)
+    shard = write_shard(tmp_path / 'pNorm' / 'shard-1-of-2' / 'node.jsonl', [shards.record_line('b.json', {}, 1)])
+    assert shards.folder_sources(folder) == [folder, os.path.join(folder, 'shard-1-of-2'), shard]
+
+
+def test_compact_folder(tmp_path):
+    folder = str(tmp_path / 'deltaFair')
+    write_result_file(folder, 'c.json', {'v': 'c'}, 4000)
+    write_shard(tmp_path / 'deltaFair' / 'node.jsonl', [shards.record_line('b.json', {'v': 'b'}, 3000),
+                                                        shards.record_line('a.json', {'v': 'a'}, 2000)])
+    write_shard(tmp_path / 'deltaFair' / 'shard-2-of-2' / 'node.jsonl',
+                [shards.record_line('a.json', {'v': 'a2'}, 2500)])
+    assert shards.compact_folder(folder, delete=True) == 3
+    assert sorted(os.listdir(folder)) == [shards.COMPACT_NAME]
+    compact_path = os.path.join(folder, shards.COMPACT_NAME)
+    with open(compact_path, 'r') as fin:
+        records = [json.loads(line) for line in fin]
+    assert [(r['resultFile'], r['writtenAt'], r['result']) for r in records] == [
+        ('a.json', 2500, {'v': 'a2'}), ('b.json', 3000, {'v': 'b'}), ('c.json', 4000, {'v': 'c'})]
+    assert shards.index_shard(compact_path)[1]
+
+
+def test_result_folders_include_folders_with_shard_folders_only(tmp_path):
+    write_result_file(str(tmp_path / 'min'), 'a.json', {'v': 1}, 1000)
+    write_shard(tmp_path / 'pNorm' / 'shard-1-of-2' / 'node.jsonl', [shards.record_line('b.json', {}, 1)])
+    os.makedirs(tmp_path / 'empty')
+    assert shards.result_folders(str(tmp_path)) == [str(tmp_path / 'min'), str(tmp_path / 'pNorm')]
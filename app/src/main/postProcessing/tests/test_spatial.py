@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from postprocessing.spatial import KDTree, NodeSnapper, SpatialException, match_nodes
+
+
+@pytest.mark.parametrize('num_points, leaf_size', [(1, 16), (17, 16), (500, 4), (2000, 16)])
+def test_kdtree_matches_brute_force(num_points, leaf_size):
+    rng = np.random.default_rng(num_points)
+    points = rng.uniform(-100.0, 100.0, size=(num_points, 2))
+    # clustered and duplicated points make unbalanced splits
+    points[: num_points // 4] = np.round(points[: num_points // 4] / 10.0) * 10.0
+    queries = np.vstack([rng.uniform(-150.0, 150.0, size=(200, 2)), points[:20]])
+    distances, indices = KDTree(points, leaf_size).query(queries)
+    brute = np.sqrt(((queries[:, None, :] - points[None, :, :]) ** 2).sum(axis=2))
+    assert np.allclose(distances, brute.min(axis=1))
+    assert np.allclose(brute[np.arange(len(queries)), indices], brute.min(axis=1))
+
+
+def test_kdtree_without_points():
+    distances, indices = KDTree(np.empty((0, 2))).query([[1.0, 2.0]])
+    assert np.isinf(distances[0]) and indices[0] == -1
+
+
+def test_node_snapper_max_distance():
+    snapper = NodeSnapper([10, 20], [[-122.33, 47.61], [-122.34, 47.61]])
+    ids, distances = snapper.snap([[-122.3301, 47.61], [-122.20, 47.61]], max_distance_m=25.0)
+    assert ids.tolist() == [10, -1]
+    assert distances[0] < 25.0 < distances[1]
+
+
+def node_data(coordinates):
+    return {str(osm_id): {'x': x, 'y': y} for osm_id, (x, y) in coordinates.items()}
+
+
+def test_match_nodes_by_id_coordinates_and_snapping():
+    stored = node_data({1: (-122.330, 47.610), 2: (-122.331, 47.611), 3: (-122.332, 47.612)})
+    original_to_new = {'1': 0, '2': 1, '3': 2}
+    # node 7 replaced 2 at the same coordinates, node 8 replaced 3 a few meters away
+    nodes = [(1, {'x': -122.330, 'y': 47.610}), (7, {'x': -122.331, 'y': 47.611}),
+             (8, {'x': -122.33201, 'y': 47.61201}), (9, {'x': -122.40, 'y': 47.70})]
+    relabel_map, num_snapped, unmatched = match_nodes(nodes, original_to_new, stored)
+    assert relabel_map == {1: 0, 7: 1, 8: 2}
+    assert num_snapped == 1
+    assert unmatched == [9]
+
+
+def test_match_nodes_raises_on_label_collision():
+    stored = node_data({1: (-122.330, 47.610), 2: (-122.340, 47.610)})
+    original_to_new = {'1': 0, '2': 1}
+    # node 5 is snapped to the label of node 1, which the graph still holds
+    nodes = [(1, {'x': -122.330, 'y': 47.610}), (5, {'x': -122.33005, 'y': 47.610})]
+    with pytest.raises(SpatialException):
+        match_nodes(nodes, original_to_new, stored)
@@ -0,0 +1,440 @@
+"""
+Benchmark of the results pipeline on synthetic result files.
+
+Synthetic result JSONs with the fields of the solver's Result (tour costs,
+tours, vertex coordinates, fairness indices, run times and gaps) are written
+for complete sweeps of (instance, vehicles) pairs: min, min-max, p-norm,
+eps-fair and delta-fair on the fairness coefficient grid and the eps-fair and
+delta-fair runs at the fairness of the min-max and p-norm solutions, so that
+every export of queries.py finds the rows it reads. Catalog instances come
+first, the pairs of the fixed-instance exports (eil51, bays29, eil76) at the
+front; beyond the catalog, copies of catalog instances with the same size
+are added until the requested number of results is reached.
+
+Every stage of the pipeline (update_db ingestion, each databaseToCSV export,
+the runtime statistics and the Pareto data) runs in a fresh process, which
+reports wall and CPU time and its peak RSS. Stages are timed at 1k, 10k and
+100k results by default; --save stores the measurements as baseline, later
+runs are compared with it and fail when a stage got slower or larger than the
+tolerance.
+
+    python benchmark.py -n 1000 10000 --save
+    python benchmark.py -n 1000 10000
+"""
+import os, sys, logging, json, argparse, contextlib, math, platform, resource, shutil, tempfile, time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'app', 'src', 'main', 'postProcessing'))
+from postprocessing.catalog import instance_vehicle_pairs, load_catalog
+from postprocessing.metrics import fairness_indices
+from postprocessing.shards import result_file_name
+
+log = logging.getLogger(__name__)
+
+# folder of update_db for each objective of a sweep
+RESULT_DIRS = {'min': 'min', 'min-max': 'minmax', 'p-norm': 'pNorm', 'eps-fair': 'epsFair',
+               'delta-fair': 'deltaFair', 'minmax-fair': 'minmaxFair', 'pnorm-fair': 'minmaxFair'}
+
+# results per (instance, vehicles) pair and objective of the default sweep
+DEFAULT_MIX = {'min': 1, 'min-max': 1, 'p-norm': 4, 'eps-fair': 20, 'delta-fair': 20, 'minmax-fair': 2}
+
+# p values and fairness coefficients in the order they are added to a sweep
+P_NORMS = [2, 3, 5, 10] + [p for p in range(4, 100) if p not in (5, 10)]
+FAIRNESS_GRID = sorted(round(0.05 * x, 2) for x in range(20))
+FAIRNESS_COEFFICIENTS = FAIRNESS_GRID + sorted(round(0.01 * x, 2) for x in range(1, 100)
+                                               if round(0.01 * x, 2) not in FAIRNESS_GRID)
+
+# pairs of the exports that read fixed instances
+FIXED_PAIRS = [('eil51.tsp', 5)] + [(name, k) for name in ['bays29.tsp', 'eil51.tsp', 'eil76.tsp'] for k in [3, 4, 5]]
+PNORM_FAIR_PAIRS = FIXED_PAIRS[1:]
+
+STAGES = ['ingest', 'runtime_pNorm', 'runtime_epsFair', 'runtime_deltaFair', 'runtime_stats', 'COF', 'ParetoFront',
+          'minmaxFair', 'pNormFair', 'COV', 'ParetoAll']
+
+TIME_LIMIT = 3600.0
+
+
+class ScriptException(Exception):
+    """Custom exception class with message for this module."""
+
+    def __init__(self, value):
+        self.value = value
+        super().__init__(value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+def parse_mix(text):
+    """Sweep of a pair from 'objective=count,...', unnamed objectives keep their default count."""
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, (text or '').split(',')):
+        objective, _, count = item.partition('=')
+        if objective not in DEFAULT_MIX:
+            raise ScriptException(f'unknown objective {objective} in mix, use one of {list(DEFAULT_MIX)}')
+        mix[objective] = int(count)
+    if mix['p-norm'] > len(P_NORMS) or max(mix['eps-fair'], mix['delta-fair']) > len(FAIRNESS_COEFFICIENTS):
+        raise ScriptException(f'at most {len(P_NORMS)} p-norm and {len(FAIRNESS_COEFFICIENTS)} '
+                              f'fairness coefficients per pair')
+    return mix
+
+
+def benchmark_pairs(num_pairs, vehicles=None, max_vertices=None):
+    """
+    (instance name, vehicles, number of vertices) of the first num_pairs pairs.
+
+    The pairs of the fixed-instance exports come first, then the other catalog
+    pairs; catalog pairs are repeated as "<name>-s<i>" copies when more pairs
+    are needed.
+    """
+    catalog = load_catalog()
+    pairs = [(name, k) for name, k in instance_vehicle_pairs()
+             if (vehicles is None or k in vehicles)
+             and (max_vertices is None or catalog[name]['numVertices'] <= max_vertices)]
+    if not pairs:
+        raise ScriptException('no catalog pairs match the vehicle and instance size filters')
+    pairs = [p for p in FIXED_PAIRS if p in pairs] + [p for p in pairs if p not in FIXED_PAIRS]
+    selected = []
+    for i in range(num_pairs):
+        name, k = pairs[i % len(pairs)]
+        copy = i // len(pairs)
+        if copy > 0:
+            stem, extension = os.path.splitext(name)
+            name = f'{stem}-s{copy}{extension}'
+        selected.append((name, k, catalog[pairs[i % len(pairs)][0]]['numVertices']))
+    return selected
+
+
+def results_per_pair(mix):
+    return sum(mix.values())
+
+
+class ResultGenerator:
+    """
+    Synthetic solver results of the sweep of one (instance, vehicles) pair.
+
+    Tour lengths are the min solution's lengths contracted towards their mean;
+    the contraction of a fairness-constrained run is the weakest one that
+    meets its fairness coefficient, and its cost grows with the contraction.
+    Run times are log-normal in the instance size and reach the time limit
+    (with an optimality gap) for a share of the large instances.
+    """
+
+    def __init__(self, rng, mix):
+        self.rng = rng
+        self.mix = mix
+        self.spreads = np.linspace(0.0, 0.95, 191)
+
+    def _lengths(self, base, spread):
+        return base.mean() + spread * (base - base.mean())
+
+    def _result(self, pair, objective, spread, p=1, fc=0.0):
+        name, k, n, coords, base, min_cost = pair
+        lengths = self._lengths(base, spread)
+        lengths = lengths * min_cost * (1.0 + 0.6 * (1.0 - spread) ** 2) / lengths.sum()
+        jain, gini, norm = (float(v) for v in fairness_indices(lengths))
+        seconds = float(self.rng.lognormal(np.log(0.05 * n * k) + (0 if objective == 'min' else 1.0), 1.2))
+        gap = 0.0
+        if seconds > TIME_LIMIT:
+            seconds, gap = TIME_LIMIT + float(self.rng.uniform(0, 15)), float(self.rng.uniform(0.5, 25))
+        targets = self.rng.permutation(np.arange(1, n))
+        cuts = np.sort(self.rng.choice(np.arange(1, n - 1), size=k - 1, replace=False)) if n > k else []
+        tours = [[0] + part.tolist() + [0] for part in np.split(targets, cuts)]
+        tour_cost = [round(float(v), 1) for v in lengths]
+        objective_value = {'min': sum(tour_cost), 'min-max': max(tour_cost),
+                           'p-norm': float(np.sum(lengths ** p) ** (1.0 / p))}.get(objective, sum(tour_cost))
+        return {
+            'instanceName': name,
+            'numVertices': n,
+            'depot': 0,
+            'numVehicles': k,
+            'objectiveType': objective,
+            'vertexCoords': coords,
+            'tours': tours,
+            'tourCost': tour_cost,
+            'objectiveValue': round(objective_value, 2),
+            'computationTimeInSec': round(seconds, 1),
+            'fairnessCoefficient': fc,
+            'pNorm': p,
+            'optimalityGapPercent': round(gap, 2),
+            'jainIndex': jain,
+            'giniIndex': gini,
+            'normIndex': norm,
+        }
+
+    def _spread_for(self, base, objective, fc):
+        """Weakest contraction whose norm index (eps-fair) or Gini index (delta-fair) meets fc."""
+        indices = fairness_indices(np.array([self._lengths(base, s) for s in self.spreads]))
+        if objective == 'eps-fair':
+            feasible = self.spreads[indices[2] >= fc]
+        else:
+            feasible = self.spreads[indices[1] <= fc]
+        return float(feasible.max()) if len(feasible) else 0.0
+
+    def sweep(self, name, k, n):
+        """(objective folder, file name, result) of all runs of the pair."""
+        coords = {str(v): {'x': x, 'y': y} for v, (x, y) in
+                  enumerate(np.round(self.rng.uniform(0, 100, (n, 2)), 2).tolist())}
+        base = self.rng.gamma(4.0, 1.0, k)
+        pair = (name, k, n, coords, base, float(self.rng.uniform(200, 50 * n)))
+        runs = []
+
+        def add(objective, spread, p=1, fc=0.0, folder=None, tag=''):
+            result = self._result(pair, objective, spread, p, fc)
+            file_name = result_file_name(name, k, objective, p, fc)
+            if tag:
+                file_name = f'{file_name[:-len(".json")]}-{tag}.json'
+            runs.append((RESULT_DIRS[folder or objective], file_name, result))
+            return result
+
+        if self.mix['min'] > 0:
+            add('min', 1.0)
+        minmax = add('min-max', float(self.rng.uniform(0.0, 0.1))) if self.mix['min-max'] > 0 else None
+        pnorms = {}
+        for p in P_NORMS[:self.mix['p-norm']]:
+            pnorms[p] = add('p-norm', float(np.clip(1.8 / p + self.rng.normal(0, 0.03), 0.05, 0.95)), p=p)
+        for objective in ['eps-fair', 'delta-fair']:
+            for fc in sorted(FAIRNESS_COEFFICIENTS[:self.mix[objective]]):
+                add(objective, self._spread_for(base, objective, fc), fc=fc)
+        derived = []
+        if minmax is not None and self.mix['minmax-fair'] > 0:
+            derived.append(('minmax-fair', minmax))
+        if (name, k) in PNORM_FAIR_PAIRS and 2 in pnorms:
+            derived.append(('pnorm-fair', pnorms[2]))
+        for folder, reference in derived:
+            # the exports look these runs up at the truncated fairness of the reference solution
+            eps = round(math.floor(reference['normIndex'] * 10000) / 10000, 4)
+            delta = round(math.ceil(reference['giniIndex'] * 10000) / 10000, 4)
+            add('eps-fair', self._spread_for(base, 'eps-fair', eps), fc=eps, folder=folder, tag=folder)
+            add('delta-fair', self._spread_for(base, 'delta-fair', delta), fc=delta, folder=folder, tag=folder)
+        return runs
+
+
+def generate_results(root, count, seed=0, mix=None, vehicles=None, max_vertices=None):
+    """
+    Write synthetic result files of about count runs to the update_db folders below root.
+
+    Returns:
+        Tuple (number of written results, [(instance, vehicles)] pairs of the sweeps)
+    """
+    mix = mix or dict(DEFAULT_MIX)
+    num_pairs = max(1, round(count / results_per_pair(mix)))
+    pairs = benchmark_pairs(num_pairs, vehicles, max_vertices)
+    generator = ResultGenerator(np.random.default_rng(seed), mix)
+    for folder in set(RESULT_DIRS.values()):
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+    written = 0
+    for name, k, n in pairs:
+        for folder, file_name, result in generator.sweep(name, k, n):
+            with open(os.path.join(root, folder, file_name), 'w') as f_out:
+                json.dump(result, f_out)
+            written += 1
+    return written, [(name, k) for name, k, _ in pairs]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def _call_stage(stage, root, pairs):
+    import update_db
+    from queries import databaseToCSV
+
+    db_path = os.path.join(root, 'results.db')
+    if stage == 'ingest':
+        update_db.Controller(update_db.Config(root, store_path=db_path)).run()
+        return
+    if stage == 'ParetoAll':
+        from postprocessing.pareto import export_pareto_data
+        export_pareto_data(db_path, root)
+        return
+    exports = {
+        'runtime_pNorm': lambda d: d.export_computation_time_to_csv(table_objective='p-norm'),
+        'runtime_epsFair': lambda d: d.export_computation_time_to_csv(table_objective='eps-fair'),
+        'runtime_deltaFair': lambda d: d.export_computation_time_to_csv(table_objective='delta-fair'),
+        'runtime_stats': lambda d: d.export_runtime_stats_to_csv(),
+        'COF': lambda d: d.export_COF_plotdata(),
+        'ParetoFront': lambda d: d.export_ParetoFront_plotdata(),
+        'minmaxFair': lambda d: d.export_minmaxFair_final(),
+        'pNormFair': lambda d: d.export_pNormFair_to_csv(),
+        'COV': lambda d: d.export_coeff_variation(),
+    }
+    data_transfer = databaseToCSV(db_path, root, pairs)
+    try:
+        exports[stage](data_transfer)
+    finally:
+        data_transfer._closeConnection()
+
+
+def run_stage(stage, root, pairs):
+    """
+    Run one pipeline stage (in a fresh worker process) and measure it.
+
+    Returns:
+        Dictionary with seconds, cpuSeconds, baseRssMB (after the imports),
+        peakRssMB, ok and the error message of a failed stage
+    """
+    # imports are not part of the measurement
+    import update_db, queries  # noqa: F401
+    import postprocessing.pareto  # noqa: F401
+
+    base_rss = _peak_rss_mb()
+    error = None
+    start, start_cpu = time.perf_counter(), time.process_time()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            _call_stage(stage, root, pairs)
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+    return {
+        'seconds': round(time.perf_counter() - start, 4),
+        'cpuSeconds': round(time.process_time() - start_cpu, 4),
+        'baseRssMB': round(base_rss, 1),
+        'peakRssMB': round(_peak_rss_mb(), 1),
+        'ok': error is None,
+        'error': error,
+    }
+
+
+def benchmark_size(count, work_path, stages=STAGES, seed=0, mix=None, vehicles=None, max_vertices=None, keep=False):
+    """Generate about count results in a scratch folder and measure every stage on them."""
+    root = tempfile.mkdtemp(prefix=f'bench-{count}-', dir=work_path)
+    try:
+        start = time.perf_counter()
+        written, pairs = generate_results(root, count, seed, mix, vehicles, max_vertices)
+        generate_seconds = time.perf_counter() - start
+        log.info(f'generated {written} results of {len(pairs)} pairs in {generate_seconds:.1f}s')
+        measurements = {}
+        for stage in stages:
+            # a spawned process per stage, so that its peak RSS is its own
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                measurement = executor.submit(run_stage, stage, root, pairs).result()
+            measurement['throughput'] = round(written / measurement['seconds'], 1) if measurement['seconds'] else None
+            measurements[stage] = measurement
+            status = 'ok' if measurement['ok'] else f'FAILED ({measurement["error"]})'
+            log.info(f'{count:>7} {stage:<18} {measurement["seconds"]:9.2f}s {measurement["throughput"] or 0:10.0f} '
+                     f'results/s {measurement["peakRssMB"]:8.1f} MB  {status}')
+        return {'results': written, 'pairs': len(pairs), 'generateSeconds': round(generate_seconds, 2),
+                'stages': measurements}
+    finally:
+        if keep:
+            log.info(f'kept the synthetic results in {root}')
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def compare(report, baseline, tolerance=0.25, min_seconds=0.05):
+    """
+    Regressions of report w.r.t. baseline.
+
+    A stage regresses when its wall time or peak RSS grew by more than the
+    tolerance (time differences below min_seconds are noise), or when it
+    fails and did not fail in the baseline.
+
+    Returns:
+        List of (size, stage, message)
+    """
+    regressions = []
+    for size, measured in report['sizes'].items():
+        reference = baseline.get('sizes', {}).get(size)
+        if reference is None:
+            continue
+        for stage, m in measured['stages'].items():
+            r = reference['stages'].get(stage)
+            if r is None:
+                continue
+            if r['ok'] and not m['ok']:
+                regressions.append((size, stage, f'fails: {m["error"]}'))
+                continue
+            if m['seconds'] > r['seconds'] * (1 + tolerance) and m['seconds'] - r['seconds'] > min_seconds:
+                regressions.append((size, stage, f'{r["seconds"]:.2f}s -> {m["seconds"]:.2f}s'))
+            if m['peakRssMB'] - m['baseRssMB'] > (r['peakRssMB'] - r['baseRssMB']) * (1 + tolerance) + 1.0:
+                regressions.append((size, stage, f'peak RSS {r["peakRssMB"]:.1f} MB -> {m["peakRssMB"]:.1f} MB'))
+    return regressions
+
+
+def print_comparison(report, baseline):
+    for size, measured in report['sizes'].items():
+        reference = baseline.get('sizes', {}).get(size, {'stages': {}})
+        print(f'{size} results')
+        for stage, m in measured['stages'].items():
+            r = reference['stages'].get(stage)
+            ratio = f'{m["seconds"] / r["seconds"]:6.2f}x' if r and r['seconds'] else '     -'
+            print(f'  {stage:<18} {m["seconds"]:9.2f}s {ratio}  {m["peakRssMB"]:8.1f} MB'
+                  f'{"" if m["ok"] else "  FAILED"}')
+
+
+def handle_command_line():
+    parser = argparse.ArgumentParser(description='benchmark ingestion, exports and Pareto data on synthetic results')
+    parser.add_argument('-n', '--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='numbers of results to benchmark')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed of the synthetic results')
+    parser.add_argument('-v', '--vehicles', type=int, nargs='+', default=None, help='only these vehicle counts')
+    parser.add_argument('--maxVertices', type=int, default=None, help='only instances up to this many vertices')
+    parser.add_argument('--mix', default='',
+                        help='results per pair and objective, e.g. "p-norm=8,eps-fair=40" '
+                             f'(default {",".join(f"{o}={c}" for o, c in DEFAULT_MIX.items())})')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, help='stages to benchmark')
+    parser.add_argument('-b', '--baseline', default=None, help='baseline file, '
+                        'default results/benchmarks/pipeline-baseline.json')
+    parser.add_argument('--save', action='store_true', help='store the measurements as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    parser.add_argument('--workDir', default=None, help='folder for the synthetic results')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic results')
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.INFO)
+    try:
+        config = handle_command_line()
+        folder_path = os.path.dirname(os.path.realpath(__file__))
+        baseline_path = config.baseline or os.path.join(folder_path, '..', 'results', 'benchmarks',
+                                                        'pipeline-baseline.json')
+        mix = parse_mix(config.mix)
+        report = {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'host': {'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+                     'python': platform.python_version(), 'system': platform.platform()},
+            'generator': {'seed': config.seed, 'mix': mix, 'vehicles': config.vehicles,
+                          'maxVertices': config.maxVertices},
+            'sizes': {},
+        }
+        for count in config.sizes:
+            report['sizes'][str(count)] = benchmark_size(count, config.workDir, config.stages, config.seed, mix,
+                                                         config.vehicles, config.maxVertices, config.keep)
+
+        if config.save:
+            os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+            tmp_path = f'{baseline_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f_out:
+                json.dump(report, f_out, indent=1)
+            os.replace(tmp_path, baseline_path)
+            log.info(f'saved baseline {baseline_path}')
+            return 0
+        if not os.path.isfile(baseline_path):
+            log.warning(f'no baseline {baseline_path}, run with --save to create it')
+            return 0
+        with open(baseline_path, 'r') as fin:
+            baseline = json.load(fin)
+        if baseline.get('generator') != report['generator']:
+            log.warning('the baseline was measured with other generator settings')
+        print_comparison(report, baseline)
+        regressions = compare(report, baseline, config.tolerance)
+        for size, stage, message in regressions:
+            log.error(f'regression at {size} results in {stage}: {message}')
+        return 1 if regressions else 0
+    except ScriptException as se:
+        log.error(se)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
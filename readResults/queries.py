@@ -1,11 +1,11 @@
-import sqlite3, logging, argparse, ast, re
-import csv, os, numpy as np
+import logging, argparse, ast, re
+import csv, os
 from math import ceil, floor
 import sys
 
-# Add the script_generator path to sys.path to import the function
-sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'app', 'src', 'main', 'postProcessing', 'runGenerator'))
-from script_generator import get_all_instance_vehicle_pairs, get_data_path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'app', 'src', 'main', 'postProcessing'))
+from postprocessing import profiling, store
+from postprocessing.catalog import get_data_path, instance_vehicle_pairs as get_all_instance_vehicle_pairs
 
 log = logging.getLogger(__name__)
 
@@ -105,6 +105,7 @@ def _runtime_stats(entries, tmax_s=3600.0, par_k=1.0):
     timeout_pct = (timeouts / n) * 100.0
 
     if solved_times:
+        import numpy as np
         median_s = float(np.median(solved_times))
         p25_s = float(np.percentile(solved_times, 25))
         p75_s = float(np.percentile(solved_times, 75))
@@ -164,7 +165,7 @@ def extract_runtime_stats_round2(
     for delta in [0.1, 0.3, 0.5, 0.7, 0.9]:
         rows_spec.append((f"deltaFair {delta}", (delta_tsp, delta_vrp, f"deltaFair {delta}")))
 
-    header = ["formulation", "solved", "timeout", "median", "P25", "P75", "PAR1"]
+    header = ["formulation", "solved", "timeout (%)", "median (s)", "P25 (s)", "P75 (s)", "PAR-1 (s)"]
     rows = []
 
     for formulation, (csv_a, csv_b, logical_col) in rows_spec:
@@ -192,15 +193,26 @@ def extract_runtime_stats_round2(
 
 
 class databaseToCSV():
-    def __init__(self, database_path, results_path) -> None:
-        self.connection = sqlite3.connect(database_path)
+    def __init__(self, database_path, results_path, instance_vehicle_pairs=None, round_name=None) -> None:
+        # vehi<n> tables of a per-round database, or views of a round (default: latest runs) of the store
+        self.connection = store.connect(database_path, round_name)
+        profiling.trace_queries(self.connection)
         self.cursor = self.connection.cursor()
         self.results_path = results_path
+        # (instance, vehicles) pairs of the exports, all pairs of the instance catalog by default, also of
+        # the instances that only have results
+        self.instance_vehicle_pairs = instance_vehicle_pairs
+
+    def _instance_vehicle_pairs(self):
+        if self.instance_vehicle_pairs is not None:
+            return self.instance_vehicle_pairs
+        return get_all_instance_vehicle_pairs(get_data_path(), with_results_only=True)
 
     def _closeConnection(self):
         self.cursor.close()
         self.connection.close()
 
+    @profiling.timed('query')
     def _getComputationTime(self, instance_name, objective, numVehicles, pNorm = 1, fc = 0.0):
         self.cursor.execute(f"""
             SELECT computationTimeInSec
@@ -210,6 +222,7 @@ class databaseToCSV():
         result = self.cursor.fetchone()
         return result[0] if result else None
 
+    @profiling.timed('query')
     def _getGapToOpt(self, instance_name, objective, numVehicles, pNorm = 1, fc = 0.0):
         self.cursor.execute(f"""
             SELECT GapToOpt
@@ -224,6 +237,7 @@ class databaseToCSV():
         except (TypeError, ValueError):
             return result[0]
 
+    @profiling.timed('query')
     def _getSumofTours(self, instance_name, objective, numVehicles, pNorm = 1, fc = 0.0):
         self.cursor.execute(f"""
             SELECT SumOfTours
@@ -233,6 +247,7 @@ class databaseToCSV():
         result = self.cursor.fetchone()
         return round(float(result[0]),1) if result else None
 
+    @profiling.timed('query')
     def _getLengthofTours(self, instance_name, objective, numVehicles, pNorm = 1, fc = 0.0):
         self.cursor.execute(f"""
             SELECT LengthOfTours
@@ -256,6 +271,7 @@ class databaseToCSV():
             return None
         return round(max(lengthOfTours), 1)
 
+    @profiling.timed('query')
     def _getFairnessIndex(self, instance_name, numVehicles, objective, pNorm = 1, fc = 0.0):
         # returns jainIndex, giniIndex and normIndex corresponding to given instance
         self.cursor.execute(f"""
@@ -267,6 +283,7 @@ class databaseToCSV():
         fairIndex = {'giniIndex': float(result[0]), 'jainIndex':float(result[1]), 'normIndex':float(result[2])} if result else None
         return fairIndex
 
+    @profiling.timed('query')
     def _getMinParam(self, instance_name, numVehicles, objective):
         self.cursor.execute(f"""
             SELECT MIN(fairnessCoefficient)
@@ -276,6 +293,7 @@ class databaseToCSV():
         result = self.cursor.fetchone()
         return round(float(result[0]),4) if result else None
 
+    @profiling.timed('query')
     def _getMaxParam(self, instance_name, numVehicles, objective):
         self.cursor.execute(f"""
             SELECT MAX(fairnessCoefficient)
@@ -286,6 +304,7 @@ class databaseToCSV():
         return round(float(result[0]),4) if result else None
 
     def _getCoefficientOfVariation(self, lengthOfTours):
+        import numpy as np
         mean = np.mean(lengthOfTours)
         std = np.std(lengthOfTours)
         return round(std/mean, 3)
@@ -314,11 +333,7 @@ class databaseToCSV():
             tsp_writer.writerow(header)
             vrp_writer.writerow(header)
 
-            # Get all instance-vehicle pairs using the shared function
-            data_path = get_data_path()
-            instance_vehicle_pairs = get_all_instance_vehicle_pairs(data_path)
-
-            for instance_name, numVehicle in instance_vehicle_pairs:
+            for instance_name, numVehicle in self._instance_vehicle_pairs():
                 is_tsp = instance_name.endswith('.tsp')
                 is_vrp = instance_name.endswith('.vrp')
                 if not (is_tsp or is_vrp):
@@ -426,7 +441,7 @@ class databaseToCSV():
             csv_writer.writerows([['instanceName', instance_name], ['numVehicles', numVehicle ],
                                   ['minmaxCOF', minmax_COF],['fairnessCoefficient', 'epsCOF', 'deltaCOF']])
 
-            fairnessCoefficient = [round(x,2) for x in np.arange(0,1,0.05)]
+            fairnessCoefficient = [round(0.05 * x, 2) for x in range(20)]
 
             for fc in fairnessCoefficient:
                 data = [fc]
@@ -450,7 +465,7 @@ class databaseToCSV():
             csv_writer.writerows([['instanceName', instance_name], ['numVehicles', numVehicle ], ['minCost', min_cost],
                                   ['minmaxCost', minmax_cost],['fairnessCoefficient', 'epsCost', 'deltaCost']])
 
-            fairnessCoefficient = [round(x,2) for x in np.arange(0,1,0.05)]
+            fairnessCoefficient = [round(0.05 * x, 2) for x in range(20)]
 
             for fc in fairnessCoefficient:
                 data = [fc]
@@ -507,10 +522,7 @@ class databaseToCSV():
                                  'epsFair cost', 'epsFair COF', 'max_tour_epsFair', 'deltaFair cost', 'deltaFair COF', 'max_tour_deltaFair' ])
 
             data = []
-            data_path = get_data_path()
-            instance_vehicle_pairs = get_all_instance_vehicle_pairs(data_path)
-
-            for instance_name, numVehicle in instance_vehicle_pairs:
+            for instance_name, numVehicle in self._instance_vehicle_pairs():
 
                 min_cost = self._getSumofTours(instance_name=instance_name, objective='min', numVehicles=numVehicle)
 
@@ -612,9 +624,7 @@ class databaseToCSV():
             csv_writer = csv.writer(csvfile)
             csv_writer.writerow(['Instance Name', 'Number of Vehicles', 'min-max cov', 'p-norm 2 cov', 'p-norm 3 cov', 'p-norm 5 cov', 'p-norm 10 cov', 'eps-fair 0.1 cov', 'eps-fair 0.3 cov', 'eps-fair 0.5 cov', 'eps-fair 0.7 cov', 'eps-fair 0.9 cov', 'eps-fair min-max cov', 'delta-fair min-max cov', 'delta-fair 0.1 cov', 'delta-fair 0.3 cov', 'delta-fair 0.5 cov', 'delta-fair 0.7 cov', 'delta-fair 0.9 cov'])
 
-            data_path = get_data_path()
-            instance_vehicle_pairs = get_all_instance_vehicle_pairs(data_path)
-            for instance_name, numVehicle in instance_vehicle_pairs:
+            for instance_name, numVehicle in self._instance_vehicle_pairs():
                 min_max_comp_time = self._getComputationTime(instance_name=instance_name, objective='min-max', numVehicles=numVehicle)
                 if float(min_max_comp_time) > 3600:
                     continue
@@ -662,12 +672,17 @@ class databaseToCSV():
 def handle_command_line():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("-t", "--tableName", choices=['runtime_pNorm', 'runtime_epsFair', 'runtime_deltaFair', 'runtime_stats', 'COF', 'minmaxFair', 'pNormFair', 'ParetoFront', 'COV'],
+    profiling.add_arguments(parser)
+    parser.add_argument("-t", "--tableName", choices=['runtime_pNorm', 'runtime_epsFair', 'runtime_deltaFair', 'runtime_stats', 'COF', 'minmaxFair', 'pNormFair', 'ParetoFront', 'ParetoAll', 'COV'],
                         help="give the table name", type=str)
+    parser.add_argument("-db", "--database", default=None,
+                        help="results store or per-round results database (default: results/store.db if it exists, "
+                             "results/round-2/results.db otherwise)")
+    parser.add_argument("-r", "--round", default=None,
+                        help="round of the store to export (default: the latest run of every case)")
+    parser.add_argument("-o", "--output", default=None, help="folder of the CSV files (default: results/round-2)")
 
-    args = parser.parse_args()
-
-    return args.tableName
+    return parser.parse_args()
 
 def main():
     logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
@@ -676,35 +691,41 @@ def main():
     try:
         folder_path = os.path.dirname(os.path.realpath(__file__))
         base_path = os.path.abspath(os.path.join(folder_path, '..'))
-        results_path = os.path.join(base_path, 'results/round-2')
-        db_path = os.path.join(results_path, 'results.db')
-
-        tableName = handle_command_line()
-        dataTransfer = databaseToCSV(db_path, results_path)
-
-        if tableName == 'runtime_pNorm':
-            dataTransfer.export_computation_time_to_csv(table_objective='p-norm')
-        elif tableName == 'runtime_epsFair':
-            dataTransfer.export_computation_time_to_csv(table_objective='eps-fair')
-        elif tableName == 'runtime_deltaFair':
-            dataTransfer.export_computation_time_to_csv(table_objective='delta-fair')
-        elif tableName == 'runtime_stats':
-            dataTransfer.export_runtime_stats_to_csv()
-        elif tableName == 'COF':
-            dataTransfer.export_COF_plotdata()
-        elif tableName == 'minmaxFair':
-            dataTransfer.export_minmaxFair_final()
-        elif tableName == 'pNormFair':
-            dataTransfer.export_pNormFair_to_csv()
-        elif tableName == 'ParetoFront':
-            dataTransfer.export_ParetoFront_plotdata()
-        elif tableName == 'COV':
-            dataTransfer.export_coeff_variation()
+
+        config = handle_command_line()
+        profiling.setup(config, 'queries')
+        results_path = config.output or os.path.join(base_path, 'results/round-2')
+        db_path = config.database or store.default_database()
+        tableName = config.tableName
+        dataTransfer = databaseToCSV(db_path, results_path, round_name=config.round)
+
+        with profiling.stage(f'export {tableName}'):
+            if tableName == 'runtime_pNorm':
+                dataTransfer.export_computation_time_to_csv(table_objective='p-norm')
+            elif tableName == 'runtime_epsFair':
+                dataTransfer.export_computation_time_to_csv(table_objective='eps-fair')
+            elif tableName == 'runtime_deltaFair':
+                dataTransfer.export_computation_time_to_csv(table_objective='delta-fair')
+            elif tableName == 'runtime_stats':
+                dataTransfer.export_runtime_stats_to_csv()
+            elif tableName == 'COF':
+                dataTransfer.export_COF_plotdata()
+            elif tableName == 'minmaxFair':
+                dataTransfer.export_minmaxFair_final()
+            elif tableName == 'pNormFair':
+                dataTransfer.export_pNormFair_to_csv()
+            elif tableName == 'ParetoFront':
+                dataTransfer.export_ParetoFront_plotdata()
+            elif tableName == 'ParetoAll':
+                from postprocessing.pareto import export_pareto_data
+                export_pareto_data(db_path, results_path, config.round)
+            elif tableName == 'COV':
+                dataTransfer.export_coeff_variation()
 
         dataTransfer._closeConnection()
 
 
-    except ScriptException as se:
+    except (ScriptException, store.StoreException) as se:
         log.error(se)
 
 
@@ -1,18 +1,24 @@
-import os, logging, json
+import os, sys, logging, argparse, platform
 import sqlite3
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'app', 'src', 'main', 'postProcessing'))
+from postprocessing import archive, profiling, shards, store
+
 log = logging.getLogger(__name__)
 
 class Config(object):
     """Class that holds global parameters."""
 
-    def __init__(self):
+    def __init__(self, results_path=None, round_name=None, store_path=None):
         folder_path = os.path.dirname(os.path.realpath(__file__))
         self.base_path = os.path.abspath(os.path.join(folder_path, '..'))
-        self.results_path = os.path.join(self.base_path, 'results/round-2')
-        self.db_path = os.path.join(self.results_path, 'results.db')
-        if os.path.exists(self.db_path):
-            os.remove(self.db_path)
+        if results_path is None:
+            self.round_name = round_name or 'round-2'
+            self.results_path = os.path.join(self.base_path, 'results', self.round_name)
+        else:
+            self.results_path = results_path
+            self.round_name = round_name or os.path.basename(os.path.normpath(results_path))
+        self.db_path = store_path or store.get_store_path()
 
 
 class ScriptException(Exception):
@@ -25,86 +31,96 @@ class ScriptException(Exception):
     def __repr__(self):
         return repr(self.value)
     
-def table_exists(cursor, name):
-    cmd = f"""
-        SELECT count(name)
-        FROM sqlite_master
-        WHERE type='table'
-        AND name='{name}'"""
-    cursor.execute(cmd)
-    return cursor.fetchone()[0] == 1
-
-def create_table(cursor, name, fields):
-    if not table_exists(cursor, name):
-        field_str = ",".join(fields)
-        cursor.execute(
-            f"""CREATE TABLE {name} ({field_str})""")
+def results(dir_path):
+    """
+    Stream the results of a results folder as (file name, result) in name order.
+
+    Results are result JSON files or records of JSONL shards (see
+    postprocessing.shards) in the folder and in its shard-<i>-of-<n>
+    sub-folders, k-way merged into a single stream. A file name present in
+    more than one place is only reported once, the one written last. The
+    results of an archived round are read from its archive (see
+    postprocessing.archive).
+    """
+    if not shards.has_results(dir_path) and archive.find_archive(dir_path) is not None:
+        return archive.folder_results(dir_path)
+    if not os.path.isdir(dir_path):
+        log.warning(f"no results folder {dir_path}")
+        return iter(())
+    return shards.merge_results(shards.folder_sources(dir_path))
+
+def round_provenance(results_path, dir_names):
+    """Provenance of the runs of every results folder (PROVENANCE of the run generator) and of this ingestion."""
+    runs = {}
+    for dir_name in [''] + dir_names:
+        dir_path = os.path.join(results_path, dir_name)
+        for folder in shards.shard_folders(dir_path) if os.path.isdir(dir_path) else []:
+            data = store.read_provenance(folder)
+            if data is not None:
+                runs[os.path.relpath(folder, results_path)] = data
+    if not runs:
+        log.warning(f"no {store.PROVENANCE_FILE} files in {results_path}, the provenance of its runs is unknown")
+    return {'runs': runs, 'ingest': {'resultsPath': os.path.abspath(results_path), 'host': platform.node(),
+                                     'gitCommit': store.git_commit()}}
+
 
 class Controller:
     def __init__(self, config):
         self.config = config
         self._connection = None  # will point to a connection to a SQL database
-        self._cursor = None
 
     def run(self):
-        self._connection = sqlite3.connect(self.config.db_path)
-        self._cursor = self._connection.cursor()
-        table_names = ['vehi3','vehi4','vehi5','vehi6','vehi7']
         dirList = ['min', 'minmax', 'pNorm', 'epsFair', 'deltaFair', 'minmaxFair']
-        for name in table_names:
-            for dir in dirList:
-                self._write_result_table(name, dir)
-
-        # self._write_result_table('vehi5', 'COF')
-        # for name in table_names:
-        #     self._write_result_table(name, 'minmaxFair')
-        #     self._write_result_table(name, 'pNormFair')
+        self._connection = sqlite3.connect(self.config.db_path)
+        round_id = store.begin_round(self._connection, self.config.round_name,
+                                     round_provenance(self.config.results_path, dirList))
+        for dir in dirList:
+            self._write_results(round_id, dir)
 
-        self._connection.commit()
-        self._cursor.close()
+        with profiling.stage('commit'):
+            self._connection.commit()
         self._connection.close()
-        log.info("result addition completed")
-
-    def _write_result_table(self, table_name, dir_name):
-            
-            col_names = ['instanceName', 'numVehicles', 'numTargets' , 'objective', 'pNorm', 'fairnessCoefficient', 'LengthOfTours', 'SumOfTours', 'GapToOpt', 'computationTimeInSec', 'GiniIndex', 'JainIndex', 'normIndex'] 
-            create_table(self._cursor, table_name, col_names)
+        log.info(f"result addition of round {self.config.round_name} to {self.config.db_path} completed")
 
+    def _write_results(self, round_id, dir_name):
             dir_path = os.path.join(self.config.results_path, dir_name)
-            for f in os.listdir(dir_path):
-                if not f.endswith(".json"):
-                    continue
-                
-                with open(os.path.join(dir_path, f),'r') as fin:
-                    result_dict = json.load(fin)
-                    if table_name[-1] in ['3','4','5','6','7'] and result_dict['numVehicles'] != int(table_name[-1]):
-                        continue
-                    
+            for f, result_dict in profiling.iterate('parse', results(dir_path)):
+                    profiling.count('files parsed')
                     try:
                         table_values = [result_dict['instanceName'], result_dict['numVehicles'], result_dict['numVertices']-1,  result_dict['objectiveType'], result_dict['pNorm'], result_dict['fairnessCoefficient'], result_dict['tourCost'], sum(result_dict['tourCost']), round(result_dict['optimalityGapPercent']/100, 2), result_dict['computationTimeInSec'], result_dict['giniIndex'], result_dict['jainIndex'], result_dict['normIndex']]
                     except KeyError as ke:
                         log.error(f"missing key {ke} in file {f}, skipping")
                         input("Press Enter to continue...")
                         continue
-                    values = [f"'{v}'" for v in table_values]
-                    
-                    cmd = f"""
-                        INSERT INTO {table_name}
-                        VALUES ({",".join(values)})"""
-                    self._cursor.execute(cmd)
+
+                    with profiling.stage('insert'):
+                        store.insert_results(self._connection, round_id,
+                                             [table_values + [result_dict.get('numNodes'), f]])
+                    profiling.count('rows inserted')
 
                     log.info(f"added results for {f}")
-                       
-    
+
+
+def handle_command_line():
+    parser = argparse.ArgumentParser(
+        description="ingest the result files of a round into the results store")
+    parser.add_argument("-r", "--round", default='round-2',
+                        help="name of the round (default: round-2), its results are in results/<round>")
+    parser.add_argument("--results", default=None, help="results folder of the round (default: results/<round>)")
+    parser.add_argument("-s", "--store", default=None, help="results store (default: results/store.db)")
+    profiling.add_arguments(parser)
+    return parser.parse_args()
 
 def main():
     logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
                         level=logging.DEBUG)
 
     try:
-        controller = Controller(Config())
+        args = handle_command_line()
+        profiling.setup(args, 'update_db')
+        controller = Controller(Config(args.results, args.round, args.store))
         controller.run()
-    except ScriptException as se:
+    except (ScriptException, store.StoreException, shards.ShardException) as se:
         log.error(se)
 
 
@@ -0,0 +1,258 @@
+import os, sys, logging, csv, argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'app', 'src', 'main', 'postProcessing'))
+from postprocessing import archive, shards
+from postprocessing.instance import InstanceException, get_data_path, load_instance
+from postprocessing.metrics import fairness_indices
+
+log = logging.getLogger(__name__)
+
+REPORT_FIELDS = ['file', 'instanceName', 'numVehicles', 'objectiveType', 'pNorm', 'fairnessCoefficient', 'check', 'reported', 'recomputed']
+
+
+class Config(object):
+    """Class that holds global parameters."""
+
+    def __init__(self):
+        folder_path = os.path.dirname(os.path.realpath(__file__))
+        self.base_path = os.path.abspath(os.path.join(folder_path, '..'))
+        self.results_path = os.path.join(self.base_path, 'results/round-2')
+        self.data_path = get_data_path()
+        self.report_path = None
+        self.workers = None
+        self.cost_tol = 1e-3
+        self.index_tol = 1e-6
+
+
+class ScriptException(Exception):
+    """Custom exception class with message for this module."""
+
+    def __init__(self, value):
+        self.value = value
+        super().__init__(value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+def read_results(results_path):
+    """
+    (path relative to results_path, result) of all results below results_path.
+
+    Results are read like update_db reads them: result files and JSONL shards
+    of every results folder and its shard folders, merged by
+    postprocessing.shards, or the archive of the round if the folder holds none.
+    """
+    folders = shards.result_folders(results_path) if os.path.isdir(results_path) else []
+    for folder in folders:
+        for name, result in shards.merge_results(shards.folder_sources(folder)):
+            yield os.path.relpath(os.path.join(folder, name), results_path), result
+    if folders:
+        return
+    found = archive.find_archive(results_path)
+    if found is None:
+        log.warning(f'no result files, shards or archive of {results_path}')
+        return
+    archive_path, member = found
+    round_archive = archive.open_archive(archive_path)
+    prefix = '' if member == '.' else f'{member}/'
+    for folder in round_archive.folders():
+        path = f'{folder}/' if folder else ''
+        if not path.startswith(prefix):
+            continue
+        for name, result in round_archive.folder_results(folder):
+            yield os.path.join(*(path[len(prefix):] + name).split('/')), result
+
+
+def collect_result_files(results_path):
+    """All results below results_path (see read_results()), grouped by instance name."""
+    groups = {}
+    try:
+        for file_path, result in read_results(results_path):
+            result.pop('vertexCoords', None)
+            result['file'] = file_path
+            groups.setdefault(result['instanceName'], []).append(result)
+    except (shards.ShardException, archive.ArchiveException) as e:
+        raise ScriptException(e.value)
+    return groups
+
+
+def validate_instance(instance_name, results, data_path, cost_tol, index_tol):
+    """
+    Check all results of one instance.
+
+    Tours and reported costs are checked in one pass: the legs of every tour of
+    every result are concatenated and their lengths looked up in the distance
+    matrix with a single fancy-indexing operation.
+
+    Returns:
+        List of report rows, one per failed check
+    """
+    issues = []
+
+    def report(result, check, reported='', recomputed=''):
+        issues.append({'file': result['file'], 'instanceName': instance_name, 'numVehicles': result['numVehicles'],
+                       'objectiveType': result['objectiveType'], 'pNorm': result['pNorm'],
+                       'fairnessCoefficient': result['fairnessCoefficient'], 'check': check,
+                       'reported': reported, 'recomputed': recomputed})
+
+    try:
+        instance = load_instance(instance_name, data_path)
+    except InstanceException as ie:
+        for result in results:
+            report(result, 'instance', recomputed=str(ie))
+        return issues
+
+    # results written for another vertex layout of the instance (e.g. by an older
+    # solver version) cannot be checked against the current distance matrix
+    solved = []
+    for result in results:
+        if not result.get('tours'):
+            continue
+        if result['numVertices'] != instance.num_vertices or result['depot'] != instance.depot:
+            report(result, 'layout', f"{result['numVertices']} vertices, depot {result['depot']}",
+                   f'{instance.num_vertices} vertices, depot {instance.depot}')
+            continue
+        solved.append(result)
+    if not solved:
+        return issues
+    distances = instance.distances()
+    n = instance.num_vertices
+    depot_row = int(instance.rows(instance.depot))
+
+    tours = [tour for result in solved for tour in result['tours']]
+    tour_result = np.repeat(np.arange(len(solved)), [len(result['tours']) for result in solved])
+    tour_sizes = np.array([len(tour) for tour in tours])
+    rows = instance.rows(np.concatenate([np.asarray(tour, dtype=np.int64) for tour in tours]))
+    tour_of_vertex = np.repeat(np.arange(len(tours)), tour_sizes)
+    starts = np.concatenate([[0], np.cumsum(tour_sizes)[:-1]])
+    ends = starts + tour_sizes - 1
+
+    # legs join consecutive vertices of the same tour
+    same_tour = tour_of_vertex[1:] == tour_of_vertex[:-1]
+    legs_from, legs_to = rows[:-1][same_tour], rows[1:][same_tour]
+    leg_cost = distances[legs_from, legs_to]
+    tour_cost = np.bincount(tour_of_vertex[:-1][same_tour], weights=leg_cost, minlength=len(tours))
+
+    # every target is visited exactly once over the inner vertices of all tours of a result
+    inner = np.ones(len(rows), dtype=bool)
+    inner[starts] = False
+    inner[ends] = False
+    visits = np.bincount(tour_result[tour_of_vertex[inner]] * n + rows[inner],
+                         minlength=len(solved) * n).reshape(len(solved), n)
+    targets = np.ones(n, dtype=bool)
+    targets[depot_row] = False
+
+    bad_depot = (rows[starts] != depot_row) | (rows[ends] != depot_row)
+    offset = 0
+    for index, result in enumerate(solved):
+        k = len(result['tours'])
+        if np.any(bad_depot[offset:offset + k]):
+            report(result, 'depot')
+        if not np.all(visits[index, targets] == 1) or visits[index, depot_row] != 0:
+            missing = int(np.sum(visits[index, targets] == 0))
+            repeated = int(np.sum(visits[index, targets] > 1))
+            report(result, 'coverage', recomputed=f'{missing} missing, {repeated} repeated')
+        reported = np.abs(np.asarray(result['tourCost'], dtype=float))
+        recomputed = tour_cost[offset:offset + k]
+        if len(reported) != k or not np.allclose(np.sort(reported), np.sort(recomputed), rtol=1e-9, atol=cost_tol):
+            report(result, 'tourCost', reported.tolist(), recomputed.tolist())
+        offset += k
+
+    by_vehicles = {}
+    for index, result in enumerate(solved):
+        by_vehicles.setdefault(len(result['tours']), []).append(index)
+    starts_of_result = np.concatenate([[0], np.cumsum([len(result['tours']) for result in solved])])
+    for k, indices in by_vehicles.items():
+        lengths = np.stack([tour_cost[starts_of_result[i]:starts_of_result[i] + k] for i in indices])
+        jain, gini, norm = fairness_indices(lengths)
+        for row, index in enumerate(indices):
+            result = solved[index]
+            for key, value in [('jainIndex', jain[row]), ('giniIndex', gini[row]), ('normIndex', norm[row])]:
+                if result.get(key) is None or not np.isfinite(value):
+                    continue
+                if abs(result[key] - value) > index_tol:
+                    report(result, key, result[key], float(value))
+            fc = result['fairnessCoefficient']
+            if result['objectiveType'] == 'eps-fair' and norm[row] < fc - index_tol:
+                report(result, 'eps-fair', fc, float(norm[row]))
+            if result['objectiveType'] == 'delta-fair' and gini[row] > fc + index_tol:
+                report(result, 'delta-fair', fc, float(gini[row]))
+    return issues
+
+
+class Controller:
+    def __init__(self, config):
+        self.config = config
+
+    def run(self):
+        groups = collect_result_files(self.config.results_path)
+        num_results = sum(len(results) for results in groups.values())
+        log.info(f'validating {num_results} results of {len(groups)} instances in {self.config.results_path}')
+
+        issues = []
+        with ProcessPoolExecutor(max_workers=self.config.workers) as executor:
+            futures = [executor.submit(validate_instance, instance_name, results, self.config.data_path,
+                                       self.config.cost_tol, self.config.index_tol)
+                       for instance_name, results in sorted(groups.items())]
+            for future in futures:
+                issues.extend(future.result())
+
+        checks = {}
+        for issue in issues:
+            checks[issue['check']] = checks.get(issue['check'], 0) + 1
+        for check, count in sorted(checks.items()):
+            log.warning(f'{count} results failed the {check} check')
+        log.info(f'{len(issues)} issues in {num_results} results')
+
+        report_path = self.config.report_path or os.path.join(self.config.results_path, 'validation.csv')
+        if self.config.report_path is None and not os.path.isdir(self.config.results_path):
+            # an archived round has no folder left
+            report_path = f'{os.path.normpath(self.config.results_path)}-validation.csv'
+        with open(report_path, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(issues)
+        log.info(f'wrote validation report to {report_path}')
+        return issues
+
+
+def handle_command_line():
+    parser = argparse.ArgumentParser(description="recompute tour costs and fairness indices of result files")
+    parser.add_argument("-r", "--results", default=None,
+                        help="results folder to validate (default: results/round-2)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="report CSV (default: <results>/validation.csv, <results>-validation.csv of an archived round)")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of worker processes")
+    parser.add_argument("--costTol", type=float, default=1e-3,
+                        help="absolute tolerance on tour costs")
+    parser.add_argument("--indexTol", type=float, default=1e-6,
+                        help="absolute tolerance on fairness indices and fairness constraints")
+    args = parser.parse_args()
+
+    config = Config()
+    if args.results is not None:
+        config.results_path = os.path.abspath(args.results)
+    config.report_path = args.output
+    config.workers = args.workers
+    config.cost_tol = args.costTol
+    config.index_tol = args.indexTol
+    return config
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s--: %(message)s',
+                        level=logging.INFO)
+
+    try:
+        controller = Controller(handle_command_line())
+        controller.run()
+    except ScriptException as se:
+        log.error(se)
+
+
+if __name__ == '__main__':
+    main()